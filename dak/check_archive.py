@@ -40,6 +40,7 @@ import apt_inst
 
 from daklib.dbconn import *
 from daklib import utils
+import daklib.daksql as daksql
 from daklib.config import Config
 from daklib.dak_exceptions import InvalidDscError, ChangesUnicodeError, CantOpenError
 
@@ -110,7 +111,7 @@ def check_files():
     pool/ directory to compare it.
     """
     cnf = Config()
-    session = DBConn().session()
+    session = DBConn().session(readonly=True)
 
     query = """
         SELECT archive.name, suite.suite_name, f.filename
@@ -124,7 +125,7 @@ def check_files():
                               AND af.file_id = b.file)
          ORDER BY archive.name, suite.suite_name, f.filename
         """
-    for row in session.execute(query):
+    for row in daksql.stream(session, query):
         print "MISSING-ARCHIVE-FILE {0} {1} {2}".vformat(row)
 
     query = """
@@ -140,12 +141,13 @@ def check_files():
                               AND af.file_id = df.file)
          ORDER BY archive.name, suite.suite_name, f.filename
         """
-    for row in session.execute(query):
+    for row in daksql.stream(session, query):
         print "MISSING-ARCHIVE-FILE {0} {1} {2}".vformat(row)
 
     archive_files = session.query(ArchiveFile) \
         .join(ArchiveFile.archive).join(ArchiveFile.file) \
-        .order_by(Archive.archive_name, PoolFile.filename)
+        .order_by(Archive.archive_name, PoolFile.filename) \
+        .yield_per(cnf.find_i('DB::FetchSize', 1000))
 
     expected_files = set()
     for af in archive_files:
@@ -174,7 +176,7 @@ def check_dscs():
 
     count = 0
 
-    for src in DBConn().session().query(DBSource).order_by(DBSource.source, DBSource.version):
+    for src in DBConn().session(readonly=True).query(DBSource).order_by(DBSource.source, DBSource.version):
         f = src.poolfile.fullpath
         try:
             utils.parse_changes(f, signing_rules=1, dsc_file=1)
@@ -200,7 +202,7 @@ def check_override():
     """
     Check for missing overrides in stable and unstable.
     """
-    session = DBConn().session()
+    session = DBConn().session(readonly=True)
 
     # FIXME: Don't hardcode that!
     for suite_name in [ "chromodoris" ]:
@@ -237,7 +239,7 @@ def check_source_in_one_dir():
     # Not the most enterprising method, but hey...
     broken_count = 0
 
-    session = DBConn().session()
+    session = DBConn().session(readonly=True)
 
     q = session.query(DBSource)
     for s in q.all():
@@ -317,7 +319,7 @@ def check_checksums():
     Validate all files
     """
     print "Getting file information from database..."
-    q = DBConn().session().query(PoolFile)
+    q = DBConn().session(readonly=True).query(PoolFile)
 
     print "Checking file checksums & sizes..."
     for f in q:
@@ -367,7 +369,7 @@ def check_timestamps():
 
     global current_file
 
-    q = DBConn().session().query(PoolFile).filter(PoolFile.filename.like('.deb$'))
+    q = DBConn().session(readonly=True).query(PoolFile).filter(PoolFile.filename.like('.deb$'))
 
     db_files.clear()
     count = 0
@@ -395,7 +397,7 @@ def check_files_in_dsc():
     count = 0
 
     print "Building list of database files..."
-    q = DBConn().session().query(PoolFile).filter(PoolFile.filename.like('.dsc$'))
+    q = DBConn().session(readonly=True).query(PoolFile).filter(PoolFile.filename.like('.dsc$'))
 
     if q.count() > 0:
         print "Checking %d files..." % len(ql)
@@ -517,7 +519,7 @@ def check_files_not_symlinks():
     """
     print "Building list of database files... ",
     before = time.time()
-    q = DBConn().session().query(PoolFile).filter(PoolFile.filename.like('.dsc$'))
+    q = DBConn().session(readonly=True).query(PoolFile).filter(PoolFile.filename.like('.dsc$'))
 
     for pf in q.all():
         filename = os.path.abspath(os.path.join(pf.location.path, pf.filename))
@@ -45,12 +45,21 @@ from daklib.config import Config
 from daklib.dbconn import *
 from daklib import utils
 from daklib import daklog
+from daklib.morgue import FileRemover, MorgueJournal
+from sqlalchemy import tuple_
 
 ################################################################################
 
 Options = None
 Logger = None
 
+# Number of file ids handled per transaction when updating last_used
+ChunkSize = 50000
+
+# Changes recorded this long before the previous run are looked at again,
+# to catch transactions that committed only after that run had started.
+HighWaterOverlap = timedelta(days=1)
+
 ################################################################################
 
 def usage (exit_code=0):
@@ -59,12 +68,49 @@ Clean old packages from suites.
 
   -n, --no-action            don't do anything
   -h, --help                 show this help and exit
+  -i, --incremental          only check files whose suite associations
+                             changed since the last run
   -m, --maximum              maximum number of files to remove"""
     sys.exit(exit_code)
 
 ################################################################################
 
-def check_binaries(now_date, session):
+def file_id_ranges(session, incremental):
+    """Split the file ids to check into ranges of at most C{ChunkSize} ids"""
+    if incremental:
+        query = "SELECT MIN(file_id), MAX(file_id) FROM changed_files"
+    else:
+        query = "SELECT MIN(file_id), MAX(file_id) FROM files_archive_map"
+    (first, last) = session.execute(query).fetchone()
+    if first is None:
+        return
+    for lo in xrange(first, last + 1, ChunkSize):
+        yield (lo, lo + ChunkSize)
+
+def update_last_used(query, now_date, session, incremental):
+    """Run a last_used update for each chunk of file ids
+
+    Each chunk is committed on its own so row locks on files_archive_map
+    are only held for a short time.
+    """
+    restrict = ""
+    if incremental:
+        restrict = "AND af.file_id IN (SELECT file_id FROM changed_files)"
+    query = query.format(restrict=restrict)
+
+    for (lo, hi) in file_id_ranges(session, incremental):
+        res = session.execute(query, {'last_used': now_date, 'lo': lo, 'hi': hi})
+        for i in res:
+            op = "set lastused"
+            if i[2]:
+                op = "unset lastused"
+            Logger.log([op, i[0], i[1]])
+        if not Options["No-Action"]:
+            session.commit()
+
+########################################
+
+def check_binaries(now_date, session, incremental=False):
     Logger.log(["Checking for orphaned binary packages..."])
 
     # Get the list of binary packages not in a suite and mark them for
@@ -85,6 +131,7 @@ def check_binaries(now_date, session):
              AS in_use
          FROM files_archive_map af
          JOIN binaries b ON af.file_id = b.file
+         WHERE af.file_id >= :lo AND af.file_id < :hi {restrict}
          GROUP BY af.archive_id, af.file_id, af.component_id
        )
 
@@ -97,16 +144,11 @@ def check_binaries(now_date, session):
           AND af.archive_id = archive.id
        RETURNING archive.name, f.filename, af.last_used IS NULL"""
 
-    res = session.execute(query, {'last_used': now_date})
-    for i in res:
-        op = "set lastused"
-        if i[2]:
-            op = "unset lastused"
-        Logger.log([op, i[0], i[1]])
+    update_last_used(query, now_date, session, incremental)
 
 ########################################
 
-def check_sources(now_date, session):
+def check_sources(now_date, session, incremental=False):
     Logger.log(["Checking for orphaned source packages..."])
 
     # Get the list of source packages not in a suite and not used by
@@ -142,6 +184,7 @@ def check_sources(now_date, session):
       FROM files_archive_map af
       JOIN dsc_files df ON af.file_id = df.file
       JOIN archive_delete_date ad ON af.archive_id = ad.archive_id
+      WHERE af.file_id >= :lo AND af.file_id < :hi {restrict}
       GROUP BY af.archive_id, af.file_id, af.component_id
     )
 
@@ -156,12 +199,71 @@ def check_sources(now_date, session):
     RETURNING archive.name, f.filename, af.last_used IS NULL
     """
 
-    res = session.execute(query, {'last_used': now_date})
-    for i in res:
-        op = "set lastused"
-        if i[2]:
-            op = "unset lastused"
-        Logger.log([op, i[0], i[1]])
+    update_last_used(query, now_date, session, incremental)
+
+########################################
+
+def get_high_water_mark(session):
+    """Returns the start time of the last incremental run or None"""
+    value = session.execute("SELECT value FROM config WHERE name = 'clean_suites_high_water_mark'").scalar()
+    if value is None:
+        return None
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+
+def set_high_water_mark(now_date, session):
+    args = {'value': now_date.strftime("%Y-%m-%d %H:%M:%S")}
+    res = session.execute("UPDATE config SET value = :value WHERE name = 'clean_suites_high_water_mark'", args)
+    if res.rowcount == 0:
+        session.execute("INSERT INTO config (name, value) VALUES ('clean_suites_high_water_mark', :value)", args)
+
+def set_changed_files(since, session):
+    """Collect files whose usage might have changed since C{since}
+
+    Uses the association changes recorded in audit.package_changes.  As
+    sources also depend on the last_used date of their binaries, sources
+    with binaries pending deletion are always included.
+    """
+    session.execute("""
+        CREATE TEMPORARY TABLE changed_files (
+          file_id INT PRIMARY KEY
+        )""")
+
+    session.execute("""
+        WITH
+        changes AS (
+          SELECT DISTINCT package, version, architecture
+            FROM audit.package_changes
+           WHERE changedate >= :since
+        ),
+        changed_binaries AS (
+          SELECT b.id, b.file, b.source
+            FROM binaries b
+            JOIN architecture a ON b.architecture = a.id
+            JOIN changes c ON c.package = b.package AND c.version = b.version AND c.architecture = a.arch_string
+        ),
+        changed_sources AS (
+          SELECT s.id
+            FROM source s
+            JOIN changes c ON c.package = s.source AND c.version = s.version AND c.architecture = 'source'
+          UNION
+          SELECT source FROM changed_binaries
+          UNION
+          SELECT esr.src_id
+            FROM extra_src_references esr
+            JOIN changed_binaries cb ON esr.bin_id = cb.id
+          UNION
+          SELECT b.source
+            FROM binaries b
+            JOIN files_archive_map af ON af.file_id = b.file
+           WHERE af.last_used IS NOT NULL
+        )
+        INSERT INTO changed_files (file_id)
+        SELECT file FROM changed_binaries
+        UNION
+        SELECT df.file FROM dsc_files df WHERE df.source IN (SELECT id FROM changed_sources)
+        """, {'since': since})
+
+    session.flush()
 
 ########################################
 
@@ -213,14 +315,15 @@ def clean_binaries(now_date, session):
     for b in q:
         Logger.log(["delete binary", b[0]])
 
+    if not Options["No-Action"]:
+        session.commit()
+        bump_archive_generation(session)
+
 ########################################
 
 def clean(now_date, archives, max_delete, session):
     cnf = Config()
 
-    count = 0
-    size = 0
-
     Logger.log(["Cleaning out packages..."])
 
     morguedir = cnf.get("Dir::Morgue", os.path.join("Dir::Pool", 'morgue'))
@@ -266,6 +369,7 @@ def clean(now_date, archives, max_delete, session):
 
     if not Options["No-Action"]:
         session.commit()
+        bump_archive_generation(session)
 
     # Delete files from the pool
     old_files = session.query(ArchiveFile).filter('files_archive_map.last_used <= (SELECT delete_date FROM archive_delete_date ad WHERE ad.archive_id = files_archive_map.archive_id)').join(Archive)
@@ -277,6 +381,19 @@ def clean(now_date, archives, max_delete, session):
         archive_ids = [ a.archive_id for a in archives ]
         old_files = old_files.filter(ArchiveFile.archive_id.in_(archive_ids))
 
+    threads = cnf.find_i("Clean-Suites::Threads", cnf.find_i("Common::ThreadCount", 1))
+    rate = cnf.find_i("Clean-Suites::MaxRate", 0) * 1024 * 1024
+    batch_size = cnf.find_i("Clean-Suites::BatchSize", 1000)
+    remover = FileRemover(threads=threads, rate=rate, no_action=Options["No-Action"])
+
+    # Filesystem operations happen before the database rows are deleted.
+    # The journal allows cleaning up after an interrupted move.
+    journal = MorgueJournal(os.path.join(morguedir, '.clean-suites.journal'))
+    if not Options["No-Action"]:
+        for entry in journal.reconcile():
+            Logger.log(entry)
+
+    jobs = []
     for af in old_files:
         filename = af.path
         if not os.path.exists(filename):
@@ -285,37 +402,45 @@ def clean(now_date, archives, max_delete, session):
             continue
         Logger.log(["delete archive file", filename])
         if os.path.isfile(filename):
+            dest_filename = None
             if os.path.islink(filename):
-                count += 1
                 Logger.log(["delete symlink", filename])
+            elif af.archive.use_morgue:
+                dest_filename = remover.reserve(dest + '/' + os.path.basename(filename))
                 if not Options["No-Action"]:
-                    os.unlink(filename)
-            else:
-                size += os.stat(filename)[stat.ST_SIZE]
-                count += 1
+                    Logger.log(["move to morgue", filename, dest_filename])
+            elif not Options["No-Action"]:
+                Logger.log(["removed file", filename])
+            jobs.append(((af.archive_id, af.file_id, af.component_id), filename, dest_filename))
+        else:
+            utils.fubar("%s is neither symlink nor file?!" % (filename))
 
-                dest_filename = dest + '/' + os.path.basename(filename)
-                # If the destination file exists; try to find another filename to use
-                if os.path.lexists(dest_filename):
-                    dest_filename = utils.find_next_free(dest_filename)
+    if not Options["No-Action"]:
+        session.commit()
 
-                if not Options["No-Action"]:
-                    if af.archive.use_morgue:
-                        Logger.log(["move to morgue", filename, dest_filename])
-                        utils.move(filename, dest_filename)
-                    else:
-                        Logger.log(["removed file", filename])
-                        os.unlink(filename)
+    for i in xrange(0, len(jobs), batch_size):
+        batch = jobs[i:i + batch_size]
+        if not Options["No-Action"]:
+            journal.write([ (src, dest_filename) for key, src, dest_filename in batch ])
 
-            if not Options["No-Action"]:
-                session.delete(af)
-                session.commit()
+        done = []
+        for key, src, dest_filename, size, error in remover.run(batch):
+            if error is None:
+                done.append(key)
+            else:
+                Logger.log(["failed to remove", src, error])
 
-        else:
-            utils.fubar("%s is neither symlink nor file?!" % (filename))
+        if not Options["No-Action"]:
+            if len(done) > 0:
+                session.query(ArchiveFile) \
+                    .filter(tuple_(ArchiveFile.archive_id, ArchiveFile.file_id, ArchiveFile.component_id).in_(done)) \
+                    .delete(synchronize_session=False)
+            session.commit()
+            journal.clear()
 
-    if count > 0:
-        Logger.log(["total", count, utils.size_type(size)])
+    if remover.count > 0:
+        Logger.log(["total", remover.count, utils.size_type(remover.bytes)])
+        Logger.log(["throughput", remover.summary()])
 
     # Delete entries in files no longer referenced by any archive
     query = """
@@ -431,17 +556,18 @@ def set_archive_delete_dates(now_date, session):
 ################################################################################
 
 def main():
-    global Options, Logger
+    global Options, Logger, ChunkSize
 
     cnf = Config()
 
-    for i in ["Help", "No-Action", "Maximum" ]:
+    for i in ["Help", "No-Action", "Incremental", "Maximum" ]:
         if not cnf.has_key("Clean-Suites::Options::%s" % (i)):
             cnf["Clean-Suites::Options::%s" % (i)] = ""
 
     Arguments = [('h',"help","Clean-Suites::Options::Help"),
                  ('a','archive','Clean-Suites::Options::Archive','HasArg'),
                  ('n',"no-action","Clean-Suites::Options::No-Action"),
+                 ('i',"incremental","Clean-Suites::Options::Incremental"),
                  ('m',"maximum","Clean-Suites::Options::Maximum", "HasArg")]
 
     apt_pkg.parse_commandline(cnf.Cnf, Arguments, sys.argv)
@@ -461,6 +587,8 @@ def main():
     if Options["Help"]:
         usage()
 
+    ChunkSize = cnf.find_i("Clean-Suites::ChunkSize", ChunkSize)
+
     program = "clean-suites"
     if Options['No-Action']:
         program = "clean-suites (no action)"
@@ -479,15 +607,28 @@ def main():
 
     set_archive_delete_dates(now_date, session)
 
-    check_binaries(now_date, session)
+    incremental = False
+    if Options["Incremental"]:
+        high_water_mark = get_high_water_mark(session)
+        if high_water_mark is None:
+            Logger.log(["no previous incremental run, checking all files"])
+        else:
+            set_changed_files(high_water_mark - HighWaterOverlap, session)
+            incremental = True
+
+    check_binaries(now_date, session, incremental)
     clean_binaries(now_date, session)
-    check_sources(now_date, session)
+    check_sources(now_date, session, incremental)
     check_files(now_date, session)
     clean(now_date, archives, max_delete, session)
     clean_maintainers(now_date, session)
     clean_fingerprints(now_date, session)
     clean_empty_directories(session)
 
+    if Options["Incremental"] and not Options["No-Action"]:
+        set_high_water_mark(now_date, session)
+        session.commit()
+
     session.rollback()
 
     Logger.close()
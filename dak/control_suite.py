@@ -264,6 +264,7 @@ def set_suite(file, suite, transaction, britney=False, force=False):
             Logger.log(["removed", " ".join(key), pkid])
 
     session.commit()
+    bump_archive_generation(session)
 
     if britney:
         britney_changelog(current, suite, session)
@@ -361,6 +362,7 @@ def process_file(file, suite, action, transaction, britney=False, force=False):
                     Logger.log(["removed", package, version, architecture, suite.suite_name, pkid])
 
     session.commit()
+    bump_archive_generation(session)
 
 #######################################################################################
 
@@ -37,17 +37,18 @@ Check for obsolete binary packages
 
 import commands, os, sys, re
 import apt_pkg
+from StringIO import StringIO
 
 from daklib.config import Config
 from daklib.dbconn import *
 from daklib import utils
+import daklib.daksql as daksql
+from daklib.dakmultiprocessing import DakProcessPool, PROC_STATUS_SUCCESS
 from daklib.regexes import re_extract_src_version
 from daklib.cruft import *
 
 ################################################################################
 
-no_longer_in_suite = {}; # Really should be static to add_nbs, but I'm lazy
-
 source_binaries = {}
 source_versions = {}
 
@@ -66,18 +67,29 @@ Check for obsolete or duplicated packages.
 
 ################################################################################
 
-def add_nbs(nbs_d, source, version, package, suite_id, session):
+class SuiteSnapshot(object):
+    """binary packages of a suite, loaded with a single query
+
+    Checks based on the Sources and Packages files look up binaries here
+    instead of querying the database for every package.
+    """
+    def __init__(self, suite_id, session):
+        self.binaries = {}
+        """binary package name to list of (architecture, version) tuples"""
+        query = """SELECT b.package, a.arch_string, b.version
+                     FROM binaries b
+                     JOIN bin_associations ba ON ba.bin = b.id
+                     JOIN architecture a ON b.architecture = a.id
+                    WHERE ba.suite = :suite_id"""
+        for package, arch, version in daksql.stream(session, query, {'suite_id': suite_id}):
+            self.binaries.setdefault(package, []).append((arch, version))
+
+################################################################################
+
+def add_nbs(nbs_d, source, version, package, snapshot):
     # Ensure the package is still in the suite (someone may have already removed it)
-    if no_longer_in_suite.has_key(package):
+    if package not in snapshot.binaries:
         return
-    else:
-        q = session.execute("""SELECT b.id FROM binaries b, bin_associations ba
-                                WHERE ba.bin = b.id AND ba.suite = :suite_id
-                                  AND b.package = :package LIMIT 1""", {'suite_id': suite_id,
-                                                                         'package': package})
-        if not q.fetchall():
-            no_longer_in_suite[package] = ""
-            return
 
     nbs_d.setdefault(source, {})
     nbs_d[source].setdefault(version, {})
@@ -86,7 +98,7 @@ def add_nbs(nbs_d, source, version, package, suite_id, session):
 ################################################################################
 
 # Check for packages built on architectures they shouldn't be.
-def do_anais(architecture, binaries_list, source, session):
+def do_anais(architecture, binaries_list, source, snapshot):
     if architecture == "any" or architecture == "all":
         return ""
 
@@ -95,12 +107,7 @@ def do_anais(architecture, binaries_list, source, session):
     for arch in architecture.split():
         architectures[arch.strip()] = ""
     for binary in binaries_list:
-        q = session.execute("""SELECT a.arch_string, b.version
-                                FROM binaries b, bin_associations ba, architecture a
-                               WHERE ba.suite = :suiteid AND ba.bin = b.id
-                                 AND b.architecture = a.id AND b.package = :package""",
-                             {'suiteid': suite_id, 'package': binary})
-        ql = q.fetchall()
+        ql = snapshot.binaries.get(binary, [])
         versions = []
         for i in ql:
             arch = i[0]
@@ -288,12 +295,13 @@ def queryNBS(suite_id, session):
     """This one is really complex. It searches arch != all packages that
     are no longer built from current source packages in suite.
 
-    temp table unique_binaries: will be populated with packages that
-    have only one version in suite because 'dak rm' does not allow
-    specifying version numbers
+    subquery unique_binaries: returns packages that have only one version
+    in suite because 'dak rm' does not allow specifying version numbers
 
-    temp table newest_binaries: will be populated with packages that are
-    built from current sources
+    subquery newest_binaries: returns packages that are built from current
+    sources
+
+    The query only uses subqueries, so it also works on a read-only replica.
 
     subquery uptodate_arch: returns all architectures built from current
     sources
@@ -313,30 +321,17 @@ def queryNBS(suite_id, session):
     """
 
     query = """
-create temp table unique_binaries (
-    package text not null,
-    architecture integer not null,
-    source integer not null);
-
-insert into unique_binaries
-    select bab.package, bab.architecture, max(bab.source)
+with unique_binaries as
+    (select bab.package, bab.architecture, max(bab.source) as source
         from bin_associations_binaries bab
         where bab.suite = :suite_id and bab.architecture > 2
-        group by package, architecture having count(*) = 1;
-
-create temp table newest_binaries (
-    package text not null,
-    architecture integer not null,
-    source text not null,
-    version debversion not null);
-
-insert into newest_binaries
-    select ub.package, ub.architecture, nsa.source, nsa.version
+        group by package, architecture having count(*) = 1),
+    newest_binaries as
+    (select ub.package, ub.architecture, nsa.source, nsa.version
         from unique_binaries ub
         join newest_src_association nsa
-            on ub.source = nsa.src and nsa.suite = :suite_id;
-
-with uptodate_arch as
+            on ub.source = nsa.src and nsa.suite = :suite_id),
+    uptodate_arch as
     (select architecture, source, version
         from newest_binaries
         group by architecture, source, version),
@@ -369,8 +364,7 @@ with uptodate_arch as
     select * from outdated_packages order by source"""
     return session.execute(query, { 'suite_id': suite_id })
 
-def reportNBS(suite_name, suite_id, rdeps=False):
-    session = DBConn().session()
+def reportNBS(suite_name, suite_id, session, rdeps=False):
     nbsRows = queryNBS(suite_id, session)
     title = 'NBS packages in suite %s' % suite_name
     if nbsRows.rowcount > 0:
@@ -394,12 +388,11 @@ def reportNBS(suite_name, suite_id, rdeps=False):
                 print "  - No dependency problem found\n"
         else:
             print
-    session.close()
 
 def reportAllNBS(suite_name, suite_id, session, rdeps=False):
     reportWithoutSource(suite_name, suite_id, session, rdeps)
     reportNewerAll(suite_name, session)
-    reportNBS(suite_name, suite_id, rdeps)
+    reportNBS(suite_name, suite_id, session, rdeps)
 
 ################################################################################
 
@@ -505,20 +498,6 @@ def report_obsolete_source(suite_name, session):
         rm_opts = "-S -p -m \"[auto-cruft] obsolete source package\""
         print "     dak rm -s %s %s %s\n" % (suite_name, rm_opts, old_source)
 
-def get_suite_binaries(suite, session):
-    # Initalize a large hash table of all binary packages
-    binaries = {}
-
-    print "Getting a list of binary packages in %s..." % suite.suite_name
-    q = session.execute("""SELECT distinct b.package
-                             FROM binaries b, bin_associations ba
-                            WHERE ba.suite = :suiteid AND ba.bin = b.id""",
-                           {'suiteid': suite.suite_id})
-    for i in q.fetchall():
-        binaries[i[0]] = ""
-
-    return binaries
-
 ################################################################################
 
 def report_outdated_nonfree(suite, session, rdeps=False):
@@ -599,6 +578,27 @@ def report_outdated_nonfree(suite, session, rdeps=False):
 
 ################################################################################
 
+def run_section(func, *args, **kwds):
+    """run a report section in a worker process
+
+    The section is called with a new session and its output is captured
+    so that the parent can print the sections in order.
+
+    @rtype:  tuple
+    @return: (PROC_STATUS_SUCCESS, output of the section)
+    """
+    session = DBConn().session(readonly=True)
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        func(*args, session=session, **kwds)
+        return (PROC_STATUS_SUCCESS, sys.stdout.getvalue())
+    finally:
+        sys.stdout = stdout
+        session.close()
+
+################################################################################
+
 def main ():
     global suite, suite_id, source_binaries, source_versions
 
@@ -643,7 +643,32 @@ def main ():
         utils.warn("%s is not a recognised mode - only 'full', 'daily' or 'bdo' are understood." % (Options["Mode"]))
         usage(1)
 
-    session = DBConn().session()
+    # Checks that only query the database run in worker processes while the
+    # Sources and Packages files are checked against a snapshot of the suite
+    # here.  Their output is printed in the usual order afterwards.  The
+    # workers are started before the first database connection is opened.
+    db_checks = [ c for c in ("obsolete source", "nbs", "outdated non-free", "nviu") if c in checks ]
+    pool = DakProcessPool(processes=max(1, len(db_checks)))
+    section_output = {}
+    def submit(check, func, *args, **kwds):
+        def callback(result):
+            section_output[check] = result
+        pool.apply_async(run_section, (func,) + args, kwds, callback=callback)
+
+    def print_section(check):
+        if check not in checks:
+            return
+        result = section_output.get(check)
+        if result is None:
+            utils.warn("%s check did not report back; section is missing." % check)
+            return
+        (status, output) = result
+        if status == PROC_STATUS_SUCCESS:
+            sys.stdout.write(output)
+        else:
+            utils.warn("%s check failed: %s" % (check, output))
+
+    session = DBConn().session(readonly=True)
 
     bin_pkgs = {}
     src_pkgs = {}
@@ -664,18 +689,25 @@ def main ():
     suite_name = suite.suite_name.lower()
 
     if "obsolete source" in checks:
-        report_obsolete_source(suite_name, session)
+        submit("obsolete source", report_obsolete_source, suite_name)
 
     if "nbs" in checks:
-        reportAllNBS(suite_name, suite_id, session, rdeps)
+        submit("nbs", reportAllNBS, suite_name, suite_id, rdeps=rdeps)
 
     if "outdated non-free" in checks:
-        report_outdated_nonfree(suite_name, session, rdeps)
+        submit("outdated non-free", report_outdated_nonfree, suite_name, rdeps=rdeps)
+
+    if "nviu" in checks:
+        submit("nviu", do_newer_version, 'chromodoris', 'staging', 'NVIU')
+
+    pool.close()
+
+    snapshot = SuiteSnapshot(suite_id, session)
 
     bin_not_built = {}
 
     if "bnb" in checks:
-        bins_in_suite = get_suite_binaries(suite, session)
+        bins_in_suite = snapshot.binaries
 
     # Checks based on the Sources files
     components = get_component_names(session)
@@ -704,7 +736,7 @@ def main ():
                         bin_not_built[source][binary] = ""
 
             if "anais" in checks:
-                anais_output += do_anais(architecture, binaries_list, source, session)
+                anais_output += do_anais(architecture, binaries_list, source, snapshot)
 
             # build indices for checking "no source" later
             source_index = component + '/' + source
@@ -783,10 +815,14 @@ def main ():
             latest_version = versions.pop()
             source_version = source_versions.get(source,"0")
             if apt_pkg.version_compare(latest_version, source_version) == 0:
-                add_nbs(dubious_nbs, source, latest_version, package, suite_id, session)
+                add_nbs(dubious_nbs, source, latest_version, package, snapshot)
 
-    if "nviu" in checks:
-        do_newer_version('chromodoris', 'staging', 'NVIU', session)
+    pool.join()
+
+    print_section("obsolete source")
+    print_section("nbs")
+    print_section("outdated non-free")
+    print_section("nviu")
 
     # FIXME: Not used in Tanglu
     #if "nvit" in checks:
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# coding=utf8
+
+"""
+Add archive_generation counter bumped whenever suite contents change
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+################################################################################
+
+import psycopg2
+from daklib.dak_exceptions import DBUpdateError
+
+statements = [
+    # A single row updated in place rather than a sequence: sequences are
+    # not WAL-logged on every nextval(), so read-only replicas would only
+    # see some of the changes.
+    """
+    CREATE TABLE archive_generation (
+        generation INT NOT NULL
+    )
+    """,
+    # Start at 1, so the first change after the upgrade is seen as a new
+    # generation.
+    """
+    INSERT INTO archive_generation (generation) VALUES (1)
+    """,
+    """
+    GRANT SELECT ON archive_generation TO PUBLIC
+    """,
+    """
+    GRANT UPDATE ON archive_generation TO ftpmaster, ftpteam
+    """,
+]
+
+################################################################################
+def do_update(self):
+    print __doc__
+    try:
+        c = self.db.cursor()
+
+        for stmt in statements:
+            c.execute(stmt)
+
+        c.execute("UPDATE config SET value = '109' WHERE name = 'db_revision'")
+        self.db.commit()
+
+    except psycopg2.ProgrammingError as msg:
+        self.db.rollback()
+        raise DBUpdateError('Unable to apply sick update 109, rollback issued. Error message: {0}'.format(msg))
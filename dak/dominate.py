@@ -29,81 +29,103 @@ import apt_pkg, sys
 
 Options = None
 Logger = None
+ChunkSize = 10000
 
 def fetch(reason, query, args, session):
-    idList = []
-    for row in session.execute(query, args).fetchall():
-        (id, package, version, suite_name, architecture) = row
-        if Options['No-Action']:
-            print "Delete %s %s from %s architecture %s (%s, %d)" % \
-                (package, version, suite_name, architecture, reason, id)
-        else:
-            Logger.log([reason, package, version, suite_name, \
-	        architecture, id])
-        idList.append(id)
-    return idList
+    """delete obsolete associations in chunks and log them
+
+    C{query} must be a C{DELETE ... RETURNING id, package, version,
+    suite_name, arch_string} statement limited to C{:limit} rows.  It is
+    repeated until it deletes fewer rows than that.  Unless running in
+    no-action mode, each chunk is committed to keep lock times short.
+    """
+    args = dict(args)
+    args['limit'] = ChunkSize
+    while True:
+        count = 0
+        for row in session.execute(query, args):
+            (id, package, version, suite_name, architecture) = row
+            if Options['No-Action']:
+                print "Delete %s %s from %s architecture %s (%s, %d)" % \
+                    (package, version, suite_name, architecture, reason, id)
+            else:
+                Logger.log([reason, package, version, suite_name, \
+                    architecture, id])
+            count += 1
+        if not Options['No-Action']:
+            session.commit()
+            if count > 0:
+                bump_archive_generation(session)
+        if count < ChunkSize:
+            break
 
 def obsoleteAnyByAllAssociations(suite, session):
     query = """
-        SELECT obsolete.id, package, obsolete.version, suite_name, arch_string
-            FROM obsolete_any_by_all_associations AS obsolete
-            JOIN architecture ON obsolete.architecture = architecture.id
-            JOIN suite ON obsolete.suite = suite.id
-            WHERE suite = :suite
+        DELETE FROM bin_associations AS ba
+            USING (SELECT id, package, version, architecture
+                     FROM obsolete_any_by_all_associations
+                    WHERE suite = :suite
+                    LIMIT :limit) AS obsolete,
+                  architecture, suite
+            WHERE ba.id = obsolete.id
+              AND obsolete.architecture = architecture.id
+              AND ba.suite = suite.id
+            RETURNING ba.id, obsolete.package, obsolete.version, suite_name, arch_string
     """
-    return fetch('newer_all', query, { 'suite': suite }, session)
+    fetch('newer_all', query, { 'suite': suite }, session)
 
 def obsoleteAnyAssociations(suite, session):
     query = """
-        SELECT obsolete.id, package, obsolete.version, suite_name, arch_string
-            FROM obsolete_any_associations AS obsolete
-            JOIN architecture ON obsolete.architecture = architecture.id
-            JOIN suite ON obsolete.suite = suite.id
-            WHERE suite = :suite
+        DELETE FROM bin_associations AS ba
+            USING (SELECT id, package, version, architecture
+                     FROM obsolete_any_associations
+                    WHERE suite = :suite
+                    LIMIT :limit) AS obsolete,
+                  architecture, suite
+            WHERE ba.id = obsolete.id
+              AND obsolete.architecture = architecture.id
+              AND ba.suite = suite.id
+            RETURNING ba.id, obsolete.package, obsolete.version, suite_name, arch_string
     """
-    return fetch('newer_any', query, { 'suite': suite }, session)
+    fetch('newer_any', query, { 'suite': suite }, session)
 
 def obsoleteSrcAssociations(suite, session):
     query = """
-        SELECT obsolete.id, source, obsolete.version, suite_name,
-	    'source' AS arch_string
-            FROM obsolete_src_associations AS obsolete
-            JOIN suite ON obsolete.suite = suite.id
-            WHERE suite = :suite
+        DELETE FROM src_associations AS sa
+            USING (SELECT id, source, version
+                     FROM obsolete_src_associations
+                    WHERE suite = :suite
+                    LIMIT :limit) AS obsolete,
+                  suite
+            WHERE sa.id = obsolete.id
+              AND sa.suite = suite.id
+            RETURNING sa.id, obsolete.source, obsolete.version, suite_name,
+                'source' AS arch_string
     """
-    return fetch('old_and_unreferenced', query, { 'suite': suite }, session)
+    fetch('old_and_unreferenced', query, { 'suite': suite }, session)
 
 def obsoleteAllAssociations(suite, session):
     query = """
-        SELECT obsolete.id, package, obsolete.version, suite_name,
-	    'all' AS arch_string
-            FROM obsolete_all_associations AS obsolete
-            JOIN suite ON obsolete.suite = suite.id
-            WHERE suite = :suite
+        DELETE FROM bin_associations AS ba
+            USING (SELECT id, package, version
+                     FROM obsolete_all_associations
+                    WHERE suite = :suite
+                    LIMIT :limit) AS obsolete,
+                  suite
+            WHERE ba.id = obsolete.id
+              AND ba.suite = suite.id
+            RETURNING ba.id, obsolete.package, obsolete.version, suite_name,
+                'all' AS arch_string
     """
-    return fetch('old_and_unreferenced', query, { 'suite': suite }, session)
-
-def deleteAssociations(table, idList, session):
-    query = """
-        DELETE
-            FROM %s
-            WHERE id = :id
-    """ % table
-    session.execute(query, [{'id': id} for id in idList])
+    fetch('old_and_unreferenced', query, { 'suite': suite }, session)
 
 def doDaDoDa(suite, session):
     # keep this part disabled because it is too dangerous
-    #idList = obsoleteAnyByAllAssociations(suite, session)
-    #deleteAssociations('bin_associations', idList, session)
-
-    idList = obsoleteAnyAssociations(suite, session)
-    deleteAssociations('bin_associations', idList, session)
-
-    idList = obsoleteSrcAssociations(suite, session)
-    deleteAssociations('src_associations', idList, session)
+    #obsoleteAnyByAllAssociations(suite, session)
 
-    idList = obsoleteAllAssociations(suite, session)
-    deleteAssociations('bin_associations', idList, session)
+    obsoleteAnyAssociations(suite, session)
+    obsoleteSrcAssociations(suite, session)
+    obsoleteAllAssociations(suite, session)
 
 def usage():
     print """Usage: dak dominate [OPTIONS]
@@ -119,8 +141,9 @@ SUITE can be comma (or space) separated list, e.g.
     sys.exit()
 
 def main():
-    global Options, Logger
+    global Options, Logger, ChunkSize
     cnf = Config()
+    ChunkSize = cnf.find_i('Obsolete::ChunkSize', ChunkSize)
     Arguments = [('h', "help",      "Obsolete::Options::Help"),
                  ('s', "suite",     "Obsolete::Options::Suite", "HasArg"),
                  ('n', "no-action", "Obsolete::Options::No-Action"),
@@ -61,7 +61,7 @@ import threading
 
 from daklib import utils
 from daklib.config import Config
-from daklib.dbconn import DBConn, get_component_by_package_suite
+from daklib.dbconn import DBConn, get_components_by_packages_suite
 from daklib.gpg import SignedFile
 from daklib.regexes import html_escaping, re_html_escaping, re_version, re_spacestrip, \
                            re_contrib, re_nonfree, re_localhost, re_newlinespace, \
@@ -365,6 +365,8 @@ def create_depends_string (suite, depends_tree, session = None):
         suite_list = [suite]
 
     provides = set()
+    components = get_components_by_packages_suite(
+        [ d['name'] for l in depends_tree for d in l ], suite_list, session = session)
     comma_count = 1
     for l in depends_tree:
         if (comma_count >= 2):
@@ -375,8 +377,7 @@ def create_depends_string (suite, depends_tree, session = None):
                 result += " | "
             # doesn't do version lookup yet.
 
-            component = get_component_by_package_suite(d['name'], suite_list, \
-                session = session)
+            component = components.get(d['name'])
             if component is not None:
                 adepends = d['name']
                 if d['version'] != '' :
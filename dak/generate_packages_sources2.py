@@ -106,6 +106,7 @@ def generate_sources(suite_id, component_id):
     from daklib.filewriter import SourcesFileWriter
     from daklib.dbconn import Component, DBConn, OverrideType, Suite
     from daklib.dakmultiprocessing import PROC_STATUS_SUCCESS
+    import daklib.daksql as daksql
 
     session = DBConn().session()
     dsc_type = session.query(OverrideType).filter_by(overridetype='dsc').one().overridetype_id
@@ -126,7 +127,7 @@ def generate_sources(suite_id, component_id):
     output = writer.open()
 
     # run query and write Sources
-    r = session.execute(_sources_query, {"suite": suite_id, "component": component_id, "component_name": component.component_name, "dsc_type": dsc_type, "overridesuite": overridesuite_id})
+    r = daksql.stream(session, _sources_query, {"suite": suite_id, "component": component_id, "component_name": component.component_name, "dsc_type": dsc_type, "overridesuite": overridesuite_id})
     for (stanza,) in r:
         print >>output, stanza
         print >>output, ""
@@ -225,6 +226,7 @@ def generate_packages(suite_id, component_id, architecture_id, type_name):
     from daklib.filewriter import PackagesFileWriter
     from daklib.dbconn import Architecture, Component, DBConn, OverrideType, Suite
     from daklib.dakmultiprocessing import PROC_STATUS_SUCCESS
+    import daklib.daksql as daksql
 
     session = DBConn().session()
     arch_all_id = session.query(Architecture).filter_by(arch_string='all').one().arch_id
@@ -257,7 +259,7 @@ def generate_packages(suite_id, component_id, architecture_id, type_name):
     writer = PackagesFileWriter(**writer_args)
     output = writer.open()
 
-    r = session.execute(_packages_query, {"archive_id": suite.archive.archive_id,
+    r = daksql.stream(session, _packages_query, {"archive_id": suite.archive.archive_id,
         "suite": suite_id, "component": component_id, 'component_name': component.component_name,
         "arch": architecture_id, "type_id": type_id, "type_name": type_name, "arch_all": arch_all_id,
         "overridesuite": overridesuite_id, "metadata_skip": metadata_skip,
@@ -24,6 +24,7 @@ from daklib.dbconn import *
 import daklib.archive
 import daklib.config
 import daklib.daklog
+import daklib.daksql
 import daklib.upload
 import daklib.regexes
 
@@ -171,9 +172,9 @@ ORDER BY tmp.order, f.filename;
 
 def export_dump(transaction, suite, component):
     session = transaction.session
-    query = session.execute(_export_query,
-                            {'suite_id': suite.suite_id,
-                             'component_id': component.component_id})
+    query = daklib.daksql.stream(session, _export_query,
+                                 {'suite_id': suite.suite_id,
+                                  'component_id': component.component_id})
     for row in query:
         print ":".join(row)
 
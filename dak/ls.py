@@ -36,6 +36,7 @@ import sys
 import apt_pkg
 
 from daklib.config import Config
+from daklib.dbconn import DBConn
 from daklib.ls import list_packages
 from daklib import utils
 
@@ -122,8 +123,10 @@ def main ():
     elif Options['GreaterThan']:
         kwargs['highest'] = '>>'
 
-    for line in list_packages(packages, **kwargs):
+    session = DBConn().session(readonly=True)
+    for line in list_packages(packages, session=session, **kwargs):
         print line
+    session.close()
 
 ######################################################################################
 
@@ -34,6 +34,7 @@ and binary package version it has in a standard rfc2822-like format.
 import sys
 
 from daklib.dbconn import *
+import daklib.daksql as daksql
 
 ################################################################################
 
@@ -75,14 +76,14 @@ def build_mapping(archive, session):
     ORDER BY source, version, package, bin_version
     """
 
-    for row in session.execute(query_sources, {'archive_id': archive.archive_id}).fetchall():
+    for row in daksql.stream(session, query_sources, {'archive_id': archive.archive_id}):
         (source, version, path) = row
         print "Path: %s"%path
         print "Source: %s"%source
         print "Source-Version: %s"%version
         print
 
-    for row in session.execute(query_binaries, {'archive_id': archive.archive_id}).fetchall():
+    for row in daksql.stream(session, query_binaries, {'archive_id': archive.archive_id}):
         (source, version, arch, path, bin, binv) = row
         print "Path: %s"%path
         print "Source: %s"%source
@@ -164,6 +164,7 @@ import errno
 from errno import EACCES, EAGAIN
 import fcntl
 import os
+import signal
 import sys
 import traceback
 import apt_pkg
@@ -174,6 +175,7 @@ from daklib import daklog
 from daklib.dbconn import *
 from daklib.urgencylog import UrgencyLog
 from daklib.summarystats import SummaryStats
+from daklib.timing import TimingSummary
 from daklib.config import Config
 import daklib.utils as utils
 from daklib.regexes import *
@@ -187,6 +189,14 @@ import daklib.upload
 
 Options = None
 Logger = None
+Timings = TimingSummary()
+
+# Number of samples per phase kept for the timing summary in daemon mode
+DaemonTimingsWindow = 1000
+
+# Maximum number of seconds the daemon waits for new uploads before checking
+# whether it was asked to stop
+DaemonPollInterval = 1
 
 ###############################################################################
 
@@ -194,10 +204,14 @@ def usage (exit_code=0):
     print """Usage: dak process-upload [OPTION]... [CHANGES]...
   -a, --automatic           automatic run
   -d, --directory <DIR>     process uploads in <DIR>
+  -D, --daemon              keep running and process uploads in the directory
+                            given by -d as they arrive (requires -a)
   -h, --help                show this help and exit.
   -n, --no-action           don't do anything
   -p, --no-lock             don't check lockfile !! for cron.daily only !!
   -s, --no-mail             don't send any mail
+  -t, --timings             show a summary of the time spent per check and
+                            install phase
   -V, --version             display the version number and exit"""
     sys.exit(exit_code)
 
@@ -462,6 +476,8 @@ def process_it(directory, changes, keyrings, session):
 
     with daklib.archive.ArchiveUpload(directory, changes, keyrings) as upload:
         processed = action(directory, upload)
+        Logger.log(["timings", changes.filename] + upload.timings.log_fields())
+        Timings.add(upload.timings)
         if processed and not Options['No-Action']:
             session = DBConn().session()
             history = SignatureHistory.from_signed_file(upload.changes)
@@ -476,10 +492,13 @@ def process_it(directory, changes, keyrings, session):
 
 ###############################################################################
 
+def active_keyring_files(session):
+    keyrings = session.query(Keyring).filter_by(active=True).order_by(Keyring.priority)
+    return [ k.keyring_name for k in keyrings ]
+
 def process_changes(changes_filenames):
     session = DBConn().session()
-    keyrings = session.query(Keyring).filter_by(active=True).order_by(Keyring.priority)
-    keyring_files = [ k.keyring_name for k in keyrings ]
+    keyring_files = active_keyring_files(session)
 
     changes = []
     for fn in changes_filenames:
@@ -499,21 +518,171 @@ def process_changes(changes_filenames):
 
 ###############################################################################
 
+def try_lock():
+    """Try to obtain dinstall.lock
+
+    Returns the file descriptor holding the lock or None if the lock is
+    already held by another process.  Closing the descriptor releases the
+    lock.
+    """
+    cnf = Config()
+    lock_fd = os.open(os.path.join(cnf["Dir::Lock"], 'dinstall.lock'), os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.lockf(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+        os.close(lock_fd)
+        if errno.errorcode[e.errno] == 'EACCES' or errno.errorcode[e.errno] == 'EAGAIN':
+            return None
+        raise
+    return lock_fd
+
+def daily_lock_exists():
+    """Check whether archive maintenance (dinstall) is in progress"""
+    return os.path.exists("%s/daily.lock" % (Config()["Dir::Lock"]))
+
+def changes_file_complete(directory, filename, keyring_files):
+    """Check whether a .changes and all files it references are complete
+
+    A .changes is complete when it can be parsed, carries a valid signature
+    and all files it lists exist with the expected size.
+    """
+    try:
+        changes = daklib.upload.Changes(directory, filename, keyring_files)
+    except Exception:
+        return False
+
+    for f in changes.files.itervalues():
+        try:
+            if os.stat(os.path.join(directory, f.filename)).st_size != f.size:
+                return False
+        except OSError:
+            return False
+
+    return True
+
+def process_queue(directory, everything):
+    """Process uploads in a queue directory for daemon mode
+
+    Honors daily.lock and dinstall.lock like a regular run; dinstall.lock is
+    only held while uploads are being processed.
+
+    @type  everything: bool
+    @param everything: process all .changes files, not only complete ones
+
+    @rtype:  bool
+    @return: False if processing had to be postponed because of a lock
+    """
+    if daily_lock_exists():
+        return False
+    lock_fd = try_lock()
+    if lock_fd is None:
+        return False
+
+    try:
+        changes_files = [ fn for fn in os.listdir(directory) if fn.endswith('.changes') ]
+        if not everything:
+            session = DBConn().session()
+            keyring_files = active_keyring_files(session)
+            session.close()
+            changes_files = [ fn for fn in changes_files if changes_file_complete(directory, fn, keyring_files) ]
+
+        if len(changes_files) > 0:
+            Logger.log(["Using changes files from directory", directory, len(changes_files)])
+            # Suites, components etc. may have been changed with dak admin
+            # since the last batch.  This is the only place the daemon
+            # notices such changes: other processes cannot invalidate its
+            # lookup caches.
+            invalidate_lookup_caches()
+            urgencylog = UrgencyLog()
+            try:
+                process_changes([ os.path.join(directory, fn) for fn in changes_files ])
+            finally:
+                urgencylog.close()
+    finally:
+        os.close(lock_fd)
+
+    return True
+
+def daemon(directory):
+    """Process uploads in C{directory} as they arrive
+
+    Uses inotify to get notified about new files.  Complete uploads are
+    processed right away; all .changes files are looked at every
+    Dinstall::Daemon::RescanInterval seconds (default 300) so incomplete
+    uploads are eventually skipped or rejected just like in cron runs.
+    """
+    try:
+        import pyinotify
+    except ImportError:
+        utils.fubar("--daemon requires the pyinotify module.")
+
+    cnf = Config()
+    rescan_interval = cnf.find_i('Dinstall::Daemon::RescanInterval', 300)
+    retry_interval = cnf.find_i('Dinstall::Daemon::RetryInterval', 60)
+
+    watch_manager = pyinotify.WatchManager()
+    watch_manager.add_watch(directory, pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO)
+    # We only need to be woken up; the directory is listed again anyway.
+    notifier = pyinotify.Notifier(watch_manager, pyinotify.ProcessEvent())
+
+    stop = []
+    def request_stop(signum, frame):
+        stop.append(signum)
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGHUP, request_stop)
+
+    Logger.log(["daemon start", directory])
+
+    next_rescan = 0
+    while not stop:
+        everything = time.time() >= next_rescan
+        try:
+            done = process_queue(directory, everything)
+        except Exception:
+            utils.warn("Processing uploads failed:\n{0}".format(traceback.format_exc()))
+            Logger.log(["daemon", "exception", traceback.format_exc().replace("\n", " ")])
+            done = False
+
+        if done and everything:
+            next_rescan = time.time() + rescan_interval
+
+        timeout = max(0, next_rescan - time.time())
+        if not done:
+            timeout = min(timeout, retry_interval)
+        # check_events() restarts poll() with the full timeout when it is
+        # interrupted by a signal, so wait in short steps to notice requests
+        # to stop.
+        deadline = time.time() + timeout
+        while not stop:
+            step = min(max(0, deadline - time.time()), DaemonPollInterval)
+            if notifier.check_events(timeout=int(step * 1000)):
+                notifier.read_events()
+                notifier.process_events()
+                break
+            if time.time() >= deadline:
+                break
+
+    Logger.log(["daemon stop", directory])
+
+###############################################################################
+
 def main():
-    global Options, Logger
+    global Options, Logger, Timings
 
     cnf = Config()
-    summarystats = SummaryStats()
 
     Arguments = [('a',"automatic","Dinstall::Options::Automatic"),
                  ('h',"help","Dinstall::Options::Help"),
                  ('n',"no-action","Dinstall::Options::No-Action"),
                  ('p',"no-lock", "Dinstall::Options::No-Lock"),
                  ('s',"no-mail", "Dinstall::Options::No-Mail"),
-                 ('d',"directory", "Dinstall::Options::Directory", "HasArg")]
+                 ('t',"timings", "Dinstall::Options::Timings"),
+                 ('d',"directory", "Dinstall::Options::Directory", "HasArg"),
+                 ('D',"daemon", "Dinstall::Options::Daemon")]
 
     for i in ["automatic", "help", "no-action", "no-lock", "no-mail",
-              "version", "directory"]:
+              "timings", "version", "directory", "daemon"]:
         if not cnf.has_key("Dinstall::Options::%s" % (i)):
             cnf["Dinstall::Options::%s" % (i)] = ""
 
@@ -527,20 +696,28 @@ def main():
     if Options["No-Action"]:
         Options["Automatic"] = ""
 
+    if Options["Daemon"]:
+        if not Options["Automatic"] or Options["Directory"] == "":
+            utils.fubar("--daemon requires --automatic and --directory.")
+        if Options["No-Lock"]:
+            utils.fubar("--daemon cannot be used with --no-lock.")
+
+        Logger = daklog.Logger("process-upload")
+        Timings = TimingSummary(window=DaemonTimingsWindow)
+        daemon(os.path.abspath(Options["Directory"]))
+        print_summary()
+        Logger.close()
+        return
+
     # Check that we aren't going to clash with the daily cron job
-    if not Options["No-Action"] and os.path.exists("%s/daily.lock" % (cnf["Dir::Lock"])) and not Options["No-Lock"]:
+    if not Options["No-Action"] and daily_lock_exists() and not Options["No-Lock"]:
         utils.fubar("Archive maintenance in progress.  Try again later.")
 
     # Obtain lock if not in no-action mode and initialize the log
     if not Options["No-Action"]:
-        lock_fd = os.open(os.path.join(cnf["Dir::Lock"], 'dinstall.lock'), os.O_RDWR | os.O_CREAT)
-        try:
-            fcntl.lockf(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-        except IOError as e:
-            if errno.errorcode[e.errno] == 'EACCES' or errno.errorcode[e.errno] == 'EAGAIN':
-                utils.fubar("Couldn't obtain lock; assuming another 'dak process-upload' is already running.")
-            else:
-                raise
+        lock_fd = try_lock()
+        if lock_fd is None:
+            utils.fubar("Couldn't obtain lock; assuming another 'dak process-upload' is already running.")
 
         # Initialise UrgencyLog() - it will deal with the case where we don't
         # want to log urgencies
@@ -564,6 +741,16 @@ def main():
 
     process_changes(changes_files)
 
+    print_summary()
+
+    if not Options["No-Action"]:
+        urgencylog.close()
+
+    Logger.close()
+
+def print_summary():
+    summarystats = SummaryStats()
+
     if summarystats.accept_count:
         sets = "set"
         if summarystats.accept_count > 1:
@@ -579,10 +766,13 @@ def main():
         print "Rejected %d package %s." % (summarystats.reject_count, sets)
         Logger.log(["rejected", summarystats.reject_count])
 
-    if not Options["No-Action"]:
-        urgencylog.close()
-
-    Logger.close()
+    if Options["Timings"] and len(Timings) > 0:
+        print
+        print Timings.format()
+        print
+        print "{0:<16} {1:>7} {2:>9} {3:>9}".format('lookup cache', 'entries', 'hits', 'misses')
+        for name, entries, hits, misses in lookup_cache_stats():
+            print "{0:<16} {1:>7} {2:>9} {3:>9}".format(name, entries, hits, misses)
 
 ###############################################################################
 
@@ -279,7 +279,7 @@ def table_row(source, version, arch, last_mod, maint, distribution, closes, fing
     global row_number
 
     trclass = "sid"
-    session = DBConn().session()
+    session = DBConn().session(readonly=True)
     for dist in distribution:
         if dist == "experimental":
             trclass = "exp"
@@ -371,7 +371,7 @@ RRA:MAX:0.5:288:795
 def process_queue(queue, log, rrd_dir):
     msg = ""
     type = queue.queue_name
-    session = DBConn().session()
+    session = DBConn().session(readonly=True)
 
     # Divide the .changes into per-source groups
     per_source = {}
@@ -659,7 +659,7 @@ def main():
         if filename822:
             f = open(filename822, "w")
 
-    session = DBConn().session()
+    session = DBConn().session(readonly=True)
 
     for queue_name in queue_names:
         queue = session.query(PolicyQueue).filter_by(queue_name=queue_name).first()
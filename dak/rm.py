@@ -63,10 +63,12 @@ Options = None
 
 def usage (exit_code=0):
     print """Usage: dak rm [OPTIONS] PACKAGE[...]
+       dak rm [-n] --batch=FILE
 Remove PACKAGE(s) from suite(s).
 
   -a, --architecture=ARCH    only act on this architecture
   -b, --binary               PACKAGE are binary packages to remove
+      --batch=FILE           process the removal requests in FILE
   -B, --binary-only          remove binaries only
   -c, --component=COMPONENT  act on this component
   -C, --carbon-copy=EMAIL    send a CC of removal message to EMAIL
@@ -81,7 +83,15 @@ Remove PACKAGE(s) from suite(s).
   -S, --source-only          remove source only
 
 ARCH, BUG#, COMPONENT and SUITE can be comma (or space) separated lists, e.g.
-    --architecture=amd64,i386"""
+    --architecture=amd64,i386
+
+FILE contains one paragraph per removal request with the fields Package
+and Reason and optionally Suite, Architecture, Component, Binary,
+Binary-Only, Source-Only, Partial, Done and Carbon-Copy, e.g.
+
+    Package: foo bar
+    Suite: unstable
+    Reason: [auto-cruft] NBS (no longer built by baz)"""
 
     sys.exit(exit_code)
 
@@ -112,6 +122,422 @@ def reverse_depends_check(removals, suite, arches=None, session=None):
 
 ################################################################################
 
+def parse_carbon_copy(value, packages):
+    """Process -C/--carbon-copy
+
+    Accept 3 types of arguments (space separated):
+     1) a number - assumed to be a bug number, i.e. nnnnn@bugs.debian.org
+     2) the keyword 'package' - cc's $package@packages.debian.org for every package
+     3) contains a '@' - assumed to be an email address, used unmofidied
+    """
+    cnf = Config()
+    carbon_copy = []
+    for copy_to in utils.split_args(value):
+        if copy_to.isdigit():
+            if cnf.has_key("Dinstall::BugServer"):
+                carbon_copy.append(copy_to + "@" + cnf["Dinstall::BugServer"])
+            else:
+                utils.fubar("Asked to send mail to #%s in BTS but Dinstall::BugServer is not configured" % copy_to)
+        elif copy_to == 'package':
+            for package in packages:
+                if cnf.has_key("Dinstall::PackagesServer"):
+                    carbon_copy.append(package + "@" + cnf["Dinstall::PackagesServer"])
+                if cnf.has_key("Dinstall::TrackingServer"):
+                    carbon_copy.append(package + "@" + cnf["Dinstall::TrackingServer"])
+        elif '@' in copy_to:
+            carbon_copy.append(copy_to)
+        else:
+            utils.fubar("Invalid -C/--carbon-copy argument '%s'; not a bug number, 'package' or email address." % (copy_to))
+    return carbon_copy
+
+def find_removals(packages, options, con_suites, con_architectures, con_components, session):
+    """Returns (package, version, architecture, id, maintainer) rows to remove"""
+    if options["Binary"]:
+        field = "b.package"
+    else:
+        field = "s.source"
+    con_packages = "AND %s IN (%s)" % (field, ", ".join([ repr(i) for i in packages ]))
+
+    to_remove = []
+
+    # We have 3 modes of package selection: binary, source-only, binary-only
+    # and source+binary.
+
+    # XXX: TODO: This all needs converting to use placeholders or the object
+    #            API. It's an SQL injection dream at the moment
+
+    if options["Binary"]:
+        # Removal by binary package name
+        q = session.execute("SELECT b.package, b.version, a.arch_string, b.id, b.maintainer FROM binaries b, bin_associations ba, architecture a, suite su, files f, files_archive_map af, component c WHERE ba.bin = b.id AND ba.suite = su.id AND b.architecture = a.id AND b.file = f.id AND af.file_id = f.id AND af.archive_id = su.archive_id AND af.component_id = c.id %s %s %s %s" % (con_packages, con_suites, con_components, con_architectures))
+        to_remove.extend(q)
+    else:
+        # Source-only
+        if not options["Binary-Only"]:
+            q = session.execute("SELECT s.source, s.version, 'source', s.id, s.maintainer FROM source s, src_associations sa, suite su, archive, files f, files_archive_map af, component c WHERE sa.source = s.id AND sa.suite = su.id AND archive.id = su.archive_id AND s.file = f.id AND af.file_id = f.id AND af.archive_id = su.archive_id AND af.component_id = c.id %s %s %s" % (con_packages, con_suites, con_components))
+            to_remove.extend(q)
+        if not options["Source-Only"]:
+            # Source + Binary
+            q = session.execute("""
+                    SELECT b.package, b.version, a.arch_string, b.id, b.maintainer
+                    FROM binaries b
+                         JOIN bin_associations ba ON b.id = ba.bin
+                         JOIN architecture a ON b.architecture = a.id
+                         JOIN suite su ON ba.suite = su.id
+                         JOIN archive ON archive.id = su.archive_id
+                         JOIN files_archive_map af ON b.file = af.file_id AND af.archive_id = archive.id
+                         JOIN component c ON af.component_id = c.id
+                         JOIN source s ON b.source = s.id
+                         JOIN src_associations sa ON s.id = sa.source AND sa.suite = su.id
+                    WHERE TRUE %s %s %s %s""" % (con_packages, con_suites, con_components, con_architectures))
+            to_remove.extend(q)
+
+    return to_remove
+
+def summarise_removals(to_remove):
+    """Generate the summary of what's to be removed
+
+    @rtype:  tuple
+    @return: (sorted package names, summary, versions of the last package,
+             maintainer names)
+    """
+    d = {}
+    maintainers = {}
+    for i in to_remove:
+        package = i[0]
+        version = i[1]
+        architecture = i[2]
+        maintainer = i[4]
+        maintainers[maintainer] = ""
+        if not d.has_key(package):
+            d[package] = {}
+        if not d[package].has_key(version):
+            d[package][version] = []
+        if architecture not in d[package][version]:
+            d[package][version].append(architecture)
+
+    maintainer_list = []
+    for maintainer_id in maintainers.keys():
+        maintainer_list.append(get_maintainer(maintainer_id).name)
+    summary = ""
+    removals = d.keys()
+    removals.sort()
+    versions = []
+    for package in removals:
+        versions = d[package].keys()
+        versions.sort(apt_pkg.version_compare)
+        for version in versions:
+            d[package][version].sort(utils.arch_compare_sw)
+            summary += "%10s | %10s | %s\n" % (package, version, ", ".join(d[package][version]))
+    return (removals, summary, versions, maintainer_list)
+
+def log_removal(logfile, logfile822, date, whoami, suites_list, summary, reason, done):
+    """Write a removal to the log files
+
+    @rtype:  list
+    @return: removed sources as C{source_version}
+    """
+    logfile.write("=========================================================================\n")
+    logfile.write("[Date: %s] [ftpmaster: %s]\n" % (date, whoami))
+    logfile.write("Removed the following packages from %s:\n\n%s" % (suites_list, summary))
+    if done:
+        logfile.write("Closed bugs: %s\n" % (done))
+    logfile.write("\n------------------- Reason -------------------\n%s\n" % (reason))
+    logfile.write("----------------------------------------------\n")
+
+    # Do the same in rfc822 format
+    logfile822.write("Date: %s\n" % date)
+    logfile822.write("Ftpmaster: %s\n" % whoami)
+    logfile822.write("Suite: %s\n" % suites_list)
+    sources = []
+    binaries = []
+    for package in summary.split("\n"):
+        for row in package.split("\n"):
+            element = row.split("|")
+            if len(element) == 3:
+                if element[2].find("source") > 0:
+                    sources.append("%s_%s" % tuple(elem.strip(" ") for elem in element[:2]))
+                    element[2] = sub("source\s?,?", "", element[2]).strip(" ")
+                if element[2]:
+                    binaries.append("%s_%s [%s]" % tuple(elem.strip(" ") for elem in element))
+    if sources:
+        logfile822.write("Sources:\n")
+        for source in sources:
+            logfile822.write(" %s\n" % source)
+    if binaries:
+        logfile822.write("Binaries:\n")
+        for binary in binaries:
+            logfile822.write(" %s\n" % binary)
+    logfile822.write("Reason: %s\n" % reason.replace('\n', '\n '))
+    if done:
+        logfile822.write("Bug: %s\n" % done)
+    return sources
+
+def delete_removals(to_remove, suite_ids_list, partial, over_con_components, session):
+    """Remove packages from the suites (and overrides unless C{partial})"""
+    dsc_type_id = get_override_type('dsc', session).overridetype_id
+    deb_type_id = get_override_type('deb', session).overridetype_id
+
+    for i in to_remove:
+        package = i[0]
+        architecture = i[2]
+        package_id = i[3]
+        for suite_id in suite_ids_list:
+            if architecture == "source":
+                session.execute("DELETE FROM src_associations WHERE source = :packageid AND suite = :suiteid",
+                                {'packageid': package_id, 'suiteid': suite_id})
+                #print "DELETE FROM src_associations WHERE source = %s AND suite = %s" % (package_id, suite_id)
+            else:
+                session.execute("DELETE FROM bin_associations WHERE bin = :packageid AND suite = :suiteid",
+                                {'packageid': package_id, 'suiteid': suite_id})
+                #print "DELETE FROM bin_associations WHERE bin = %s AND suite = %s" % (package_id, suite_id)
+            # Delete from the override file
+            if not partial:
+                if architecture == "source":
+                    type_id = dsc_type_id
+                else:
+                    type_id = deb_type_id
+                # TODO: Again, fix this properly to remove the remaining non-bind argument
+                session.execute("DELETE FROM override WHERE package = :package AND type = :typeid AND suite = :suiteid %s" % (over_con_components), {'package': package, 'typeid': type_id, 'suiteid': suite_id})
+
+def common_substitutions(carbon_copy, suites_list, whoami):
+    """read common subst variables for all bug closure mails"""
+    cnf = Config()
+    Subst_common = {}
+    Subst_common["__RM_ADDRESS__"] = cnf["Dinstall::MyEmailAddress"]
+    Subst_common["__BUG_SERVER__"] = cnf["Dinstall::BugServer"]
+    Subst_common["__CC__"] = "X-DAK: dak rm"
+    if carbon_copy:
+        Subst_common["__CC__"] += "\nCc: " + ", ".join(carbon_copy)
+    Subst_common["__SUITE_LIST__"] = suites_list
+    Subst_common["__SUBJECT__"] = "Removed package(s) from %s" % (suites_list)
+    Subst_common["__ADMIN_ADDRESS__"] = cnf["Dinstall::MyAdminAddress"]
+    Subst_common["__DISTRO__"] = cnf["Dinstall::MyDistribution"]
+    Subst_common["__WHOAMI__"] = whoami
+    return Subst_common
+
+def close_bugs(Subst_close_rm, summary, reason, done, do_close, whitelists):
+    """Send the bug closing messages"""
+    cnf = Config()
+    bcc = []
+    if cnf.find("Dinstall::Bcc") != "":
+        bcc.append(cnf["Dinstall::Bcc"])
+    if cnf.find("Rm::Bcc") != "":
+        bcc.append(cnf["Rm::Bcc"])
+    if bcc:
+        Subst_close_rm["__BCC__"] = "Bcc: " + ", ".join(bcc)
+    else:
+        Subst_close_rm["__BCC__"] = "X-Filler: 42"
+    summarymail = "%s\n------------------- Reason -------------------\n%s\n" % (summary, reason)
+    summarymail += "----------------------------------------------\n"
+    Subst_close_rm["__SUMMARY__"] = summarymail
+
+    for bug in utils.split_args(done):
+        Subst_close_rm["__BUG_NUMBER__"] = bug
+        if do_close:
+            mail_message = utils.TemplateSubst(Subst_close_rm,cnf["Dir::Templates"]+"/rm.bug-close-with-related")
+        else:
+            mail_message = utils.TemplateSubst(Subst_close_rm,cnf["Dir::Templates"]+"/rm.bug-close")
+        utils.send_mail(mail_message, whitelists=whitelists)
+
+################################################################################
+
+class RemovalRequest(object):
+    """a removal read from a batch file
+
+    Each paragraph of the batch file describes one removal with the fields
+    Package (required), Reason (required), Suite, Architecture, Component,
+    Binary, Binary-Only, Source-Only, Partial, Done and Carbon-Copy which
+    correspond to the command line options of the same name.
+    """
+    def __init__(self, number, section):
+        self.number = number
+        self.packages = utils.split_args(section.get('Package', ''))
+        self.options = {
+            'Suite':        section.get('Suite', Options['Suite']),
+            'Architecture': section.get('Architecture', ''),
+            'Component':    section.get('Component', ''),
+        }
+        for field in ('Binary', 'Binary-Only', 'Source-Only', 'Partial'):
+            if section.get(field, 'no').lower() in ('yes', 'true', '1'):
+                self.options[field] = 'true'
+            else:
+                self.options[field] = ''
+        lines = section.get('Reason', '').split('\n')
+        self.reason = "\n".join(lines[:1] + [ '' if line.strip() == '.' else line[1:] for line in lines[1:] ]).strip()
+        self.done = section.get('Done', '')
+        self.carbon_copy = section.get('Carbon-Copy', '')
+
+    def fubar(self, message):
+        utils.fubar("request %d: %s" % (self.number, message))
+
+    def check(self):
+        """check the request is complete and consistent"""
+        if not self.packages:
+            self.fubar("no Package field.")
+        if not self.reason:
+            self.fubar("no Reason field.")
+        if self.options["Architecture"] and self.options["Source-Only"]:
+            self.fubar("can't use Architecture and Source-Only simultaneously.")
+        if len([ o for o in ("Binary", "Binary-Only", "Source-Only") if self.options[o] ]) > 1:
+            self.fubar("Only one of Binary, Binary-Only and Source-Only can be used.")
+        if self.carbon_copy and not self.done:
+            self.fubar("can't use Carbon-Copy without also using Done.")
+        if self.options["Architecture"]:
+            self.options["Partial"] = "true"
+        if not Options["No-Action"] and not self.carbon_copy \
+               and not self.done and self.reason.find("[auto-cruft]") == -1:
+            self.fubar("Need a Carbon-Copy if not closing a bug and not doing a cruft removal.")
+
+        suites = utils.split_args(self.options["Suite"])
+        if len(suites) != 1:
+            self.fubar("batch removals have to act on exactly one suite.")
+        self.suite = suites[0]
+
+    def prepare(self, session):
+        """check the request and look up the packages to remove"""
+        self.check()
+        self.suites_list = self.suite
+        self.arches = utils.split_args(self.options["Architecture"])
+        self.carbon_copy_list = parse_carbon_copy(self.carbon_copy, self.packages)
+
+        s = get_suite(self.suite, session=session)
+        if s is None:
+            self.fubar("unknown suite %s." % self.suite)
+        self.suite_ids_list = [s.suite_id]
+        self.whitelists = [s.mail_whitelist]
+
+        (con_suites, con_architectures, con_components, check_source) = \
+                     utils.parse_args(self.options)
+        self.over_con_components = con_components.replace("c.id", "component")
+        self.to_remove = find_removals(self.packages, self.options, con_suites,
+                                       con_architectures, con_components, session)
+        (self.removals, self.summary, versions, self.maintainers) = \
+                     summarise_removals(self.to_remove)
+
+def combined_depends_check(requests, session):
+    """check reverse dependencies of several requests as a whole"""
+    suites = {}
+    for request in requests:
+        suites.setdefault(request.suite, []).append(request)
+    for suite, suite_requests in sorted(suites.items()):
+        removals = set()
+        arches = set()
+        for request in suite_requests:
+            removals.update(request.removals)
+            arches.update(request.arches)
+        # A request without architecture restriction acts on all of them
+        if not all(request.arches for request in suite_requests):
+            arches = set()
+        print "Checking reverse dependencies of all %d requests for %s..." % (len(suite_requests), suite)
+        if utils.check_reverse_depends(sorted(removals), suite, list(arches), session):
+            print "Dependency problem found."
+        else:
+            print "No dependency problem found."
+        print
+
+def batch_main(filename, session):
+    """Remove packages listed in a batch file
+
+    All requests are checked first; their reverse dependencies are checked
+    individually and combined.  Accepted requests are then removed in a
+    single transaction and logged (and mailed) per request.
+    """
+    cnf = Config()
+
+    with open(filename) as fh:
+        requests = [ RemovalRequest(number, section)
+                     for number, section in enumerate(apt_pkg.TagFile(fh), 1) ]
+    if not requests:
+        utils.fubar("no removal requests found in %s." % filename)
+
+    for request in requests:
+        request.prepare(session)
+        if request.suite in ("oldstable", "stable", "testing") and not Options["No-Action"]:
+            print "**WARNING** Request %d removes from the %s suite!" % (request.number, request.suite)
+            game_over()
+
+    requests = [ request for request in requests if request.to_remove ]
+    if not requests:
+        print "Nothing to do."
+        sys.exit(0)
+
+    for request in requests:
+        print "=== Request %d: remove the following packages from %s:" % (request.number, request.suites_list)
+        print
+        print request.summary
+        print "Maintainer: %s" % ", ".join(request.maintainers)
+        if request.done:
+            print "Will also close bugs: " + request.done
+        if request.carbon_copy_list:
+            print "Will also send CCs to: " + ", ".join(request.carbon_copy_list)
+        print
+        print "------------------- Reason -------------------"
+        print request.reason
+        print "----------------------------------------------"
+        print
+        print "Checking reverse dependencies..."
+        if utils.check_reverse_depends(request.removals, request.suite, request.arches, session):
+            print "Dependency problem found."
+        else:
+            print "No dependency problem found."
+        print
+
+    if len(requests) > 1:
+        combined_depends_check(requests, session)
+
+    # If -n/--no-action, drop out here
+    if Options["No-Action"]:
+        sys.exit(0)
+
+    accepted = []
+    for request in requests:
+        answer = utils.our_raw_input("Apply request %d (%s) (y/N)? " % (request.number, " ".join(request.removals))).lower()
+        if answer == "y":
+            accepted.append(request)
+    if not accepted:
+        print "Nothing to do."
+        sys.exit(0)
+    if len(accepted) != len(requests) and len(accepted) > 1:
+        combined_depends_check(accepted, session)
+
+    print "Going to remove the packages of %d requests now." % len(accepted)
+    game_over()
+
+    whoami = utils.whoami()
+    date = commands.getoutput('date -R')
+
+    # Log first; if it all falls apart I want a record that we at least tried.
+    logfile = utils.open_file(cnf["Rm::LogFile"], 'a')
+    logfile822 = utils.open_file(cnf["Rm::LogFile822"], 'a')
+    for request in accepted:
+        log_removal(logfile, logfile822, date, whoami, request.suites_list,
+                    request.summary, request.reason, request.done)
+        logfile.write("=========================================================================\n")
+        logfile822.write("\n")
+    logfile.close()
+    logfile822.close()
+
+    print "Deleting...",
+    sys.stdout.flush()
+    for request in accepted:
+        delete_removals(request.to_remove, request.suite_ids_list, request.options["Partial"],
+                        request.over_con_components, session)
+    session.commit()
+    bump_archive_generation(session)
+    print "done."
+
+    if not cnf.has_key("Dinstall::BugServer"):
+        if any(request.done for request in accepted):
+            print "Cannot send mail to BugServer as Dinstall::BugServer is not configured"
+        return
+
+    for request in accepted:
+        if request.done:
+            Subst = common_substitutions(request.carbon_copy_list, request.suites_list, whoami)
+            close_bugs(Subst, request.summary, request.reason, request.done, False, request.whitelists)
+
+################################################################################
+
 def main ():
     global Options
 
@@ -120,6 +546,7 @@ def main ():
     Arguments = [('h',"help","Rm::Options::Help"),
                  ('a',"architecture","Rm::Options::Architecture", "HasArg"),
                  ('b',"binary", "Rm::Options::Binary"),
+                 ('',"batch", "Rm::Options::Batch", "HasArg"),
                  ('B',"binary-only", "Rm::Options::Binary-Only"),
                  ('c',"component", "Rm::Options::Component", "HasArg"),
                  ('C',"carbon-copy", "Rm::Options::Carbon-Copy", "HasArg"), # Bugs to Cc
@@ -133,7 +560,7 @@ def main ():
                  ('S',"source-only", "Rm::Options::Source-Only"),
                  ]
 
-    for i in [ "architecture", "binary", "binary-only", "carbon-copy", "component",
+    for i in [ "architecture", "batch", "binary", "binary-only", "carbon-copy", "component",
                "done", "help", "no-action", "partial", "rdep-check", "reason",
                "source-only", "Do-Close" ]:
         if not cnf.has_key("Rm::Options::%s" % (i)):
@@ -149,6 +576,12 @@ def main ():
 
     session = DBConn().session()
 
+    if Options["Batch"]:
+        if arguments:
+            utils.fubar("can't use --batch with package names as arguments.")
+        batch_main(Options["Batch"], session)
+        return
+
     # Sanity check options
     if not arguments:
         utils.fubar("need at least one package name as an argument.")
@@ -176,36 +609,7 @@ def main ():
            and not Options["Done"] and Options["Reason"].find("[auto-cruft]") == -1:
         utils.fubar("Need a -C/--carbon-copy if not closing a bug and not doing a cruft removal.")
 
-    # Process -C/--carbon-copy
-    #
-    # Accept 3 types of arguments (space separated):
-    #  1) a number - assumed to be a bug number, i.e. nnnnn@bugs.debian.org
-    #  2) the keyword 'package' - cc's $package@packages.debian.org for every argument
-    #  3) contains a '@' - assumed to be an email address, used unmofidied
-    #
-    carbon_copy = []
-    for copy_to in utils.split_args(Options.get("Carbon-Copy")):
-        if copy_to.isdigit():
-            if cnf.has_key("Dinstall::BugServer"):
-                carbon_copy.append(copy_to + "@" + cnf["Dinstall::BugServer"])
-            else:
-                utils.fubar("Asked to send mail to #%s in BTS but Dinstall::BugServer is not configured" % copy_to)
-        elif copy_to == 'package':
-            for package in arguments:
-                if cnf.has_key("Dinstall::PackagesServer"):
-                    carbon_copy.append(package + "@" + cnf["Dinstall::PackagesServer"])
-                if cnf.has_key("Dinstall::TrackingServer"):
-                    carbon_copy.append(package + "@" + cnf["Dinstall::TrackingServer"])
-        elif '@' in copy_to:
-            carbon_copy.append(copy_to)
-        else:
-            utils.fubar("Invalid -C/--carbon-copy argument '%s'; not a bug number, 'package' or email address." % (copy_to))
-
-    if Options["Binary"]:
-        field = "b.package"
-    else:
-        field = "s.source"
-    con_packages = "AND %s IN (%s)" % (field, ", ".join([ repr(i) for i in arguments ]))
+    carbon_copy = parse_carbon_copy(Options.get("Carbon-Copy"), arguments)
 
     (con_suites, con_architectures, con_components, check_source) = \
                  utils.parse_args(Options)
@@ -243,39 +647,7 @@ def main ():
     if Options["Rdep-Check"] and len(suites) > 1:
         utils.fubar("Reverse dependency check on multiple suites is not implemented.")
 
-    to_remove = []
-    maintainers = {}
-
-    # We have 3 modes of package selection: binary, source-only, binary-only
-    # and source+binary.
-
-    # XXX: TODO: This all needs converting to use placeholders or the object
-    #            API. It's an SQL injection dream at the moment
-
-    if Options["Binary"]:
-        # Removal by binary package name
-        q = session.execute("SELECT b.package, b.version, a.arch_string, b.id, b.maintainer FROM binaries b, bin_associations ba, architecture a, suite su, files f, files_archive_map af, component c WHERE ba.bin = b.id AND ba.suite = su.id AND b.architecture = a.id AND b.file = f.id AND af.file_id = f.id AND af.archive_id = su.archive_id AND af.component_id = c.id %s %s %s %s" % (con_packages, con_suites, con_components, con_architectures))
-        to_remove.extend(q)
-    else:
-        # Source-only
-        if not Options["Binary-Only"]:
-            q = session.execute("SELECT s.source, s.version, 'source', s.id, s.maintainer FROM source s, src_associations sa, suite su, archive, files f, files_archive_map af, component c WHERE sa.source = s.id AND sa.suite = su.id AND archive.id = su.archive_id AND s.file = f.id AND af.file_id = f.id AND af.archive_id = su.archive_id AND af.component_id = c.id %s %s %s" % (con_packages, con_suites, con_components))
-            to_remove.extend(q)
-        if not Options["Source-Only"]:
-            # Source + Binary
-            q = session.execute("""
-                    SELECT b.package, b.version, a.arch_string, b.id, b.maintainer
-                    FROM binaries b
-                         JOIN bin_associations ba ON b.id = ba.bin
-                         JOIN architecture a ON b.architecture = a.id
-                         JOIN suite su ON ba.suite = su.id
-                         JOIN archive ON archive.id = su.archive_id
-                         JOIN files_archive_map af ON b.file = af.file_id AND af.archive_id = archive.id
-                         JOIN component c ON af.component_id = c.id
-                         JOIN source s ON b.source = s.id
-                         JOIN src_associations sa ON s.id = sa.source AND sa.suite = su.id
-                    WHERE TRUE %s %s %s %s""" % (con_packages, con_suites, con_components, con_architectures))
-            to_remove.extend(q)
+    to_remove = find_removals(arguments, Options, con_suites, con_architectures, con_components, session)
 
     if not to_remove:
         print "Nothing to do."
@@ -295,34 +667,7 @@ def main ():
         temp_file.close()
         os.unlink(temp_filename)
 
-    # Generate the summary of what's to be removed
-    d = {}
-    for i in to_remove:
-        package = i[0]
-        version = i[1]
-        architecture = i[2]
-        maintainer = i[4]
-        maintainers[maintainer] = ""
-        if not d.has_key(package):
-            d[package] = {}
-        if not d[package].has_key(version):
-            d[package][version] = []
-        if architecture not in d[package][version]:
-            d[package][version].append(architecture)
-
-    maintainer_list = []
-    for maintainer_id in maintainers.keys():
-        maintainer_list.append(get_maintainer(maintainer_id).name)
-    summary = ""
-    removals = d.keys()
-    removals.sort()
-    versions = []
-    for package in removals:
-        versions = d[package].keys()
-        versions.sort(apt_pkg.version_compare)
-        for version in versions:
-            d[package][version].sort(utils.arch_compare_sw)
-            summary += "%10s | %10s | %s\n" % (package, version, ", ".join(d[package][version]))
+    (removals, summary, versions, maintainer_list) = summarise_removals(to_remove)
     print "Will remove the following packages from %s:" % (suites_list)
     print
     print summary
@@ -355,71 +700,17 @@ def main ():
 
     # Log first; if it all falls apart I want a record that we at least tried.
     logfile = utils.open_file(cnf["Rm::LogFile"], 'a')
-    logfile.write("=========================================================================\n")
-    logfile.write("[Date: %s] [ftpmaster: %s]\n" % (date, whoami))
-    logfile.write("Removed the following packages from %s:\n\n%s" % (suites_list, summary))
-    if Options["Done"]:
-        logfile.write("Closed bugs: %s\n" % (Options["Done"]))
-    logfile.write("\n------------------- Reason -------------------\n%s\n" % (Options["Reason"]))
-    logfile.write("----------------------------------------------\n")
-
-    # Do the same in rfc822 format
     logfile822 = utils.open_file(cnf["Rm::LogFile822"], 'a')
-    logfile822.write("Date: %s\n" % date)
-    logfile822.write("Ftpmaster: %s\n" % whoami)
-    logfile822.write("Suite: %s\n" % suites_list)
-    sources = []
-    binaries = []
-    for package in summary.split("\n"):
-        for row in package.split("\n"):
-            element = row.split("|")
-            if len(element) == 3:
-                if element[2].find("source") > 0:
-                    sources.append("%s_%s" % tuple(elem.strip(" ") for elem in element[:2]))
-                    element[2] = sub("source\s?,?", "", element[2]).strip(" ")
-                if element[2]:
-                    binaries.append("%s_%s [%s]" % tuple(elem.strip(" ") for elem in element))
-    if sources:
-        logfile822.write("Sources:\n")
-        for source in sources:
-            logfile822.write(" %s\n" % source)
-    if binaries:
-        logfile822.write("Binaries:\n")
-        for binary in binaries:
-            logfile822.write(" %s\n" % binary)
-    logfile822.write("Reason: %s\n" % Options["Reason"].replace('\n', '\n '))
-    if Options["Done"]:
-        logfile822.write("Bug: %s\n" % Options["Done"])
-
-    dsc_type_id = get_override_type('dsc', session).overridetype_id
-    deb_type_id = get_override_type('deb', session).overridetype_id
+    sources = log_removal(logfile, logfile822, date, whoami, suites_list, summary,
+                          Options["Reason"], Options["Done"])
 
     # Do the actual deletion
     print "Deleting...",
     sys.stdout.flush()
 
-    for i in to_remove:
-        package = i[0]
-        architecture = i[2]
-        package_id = i[3]
-        for suite_id in suite_ids_list:
-            if architecture == "source":
-                session.execute("DELETE FROM src_associations WHERE source = :packageid AND suite = :suiteid",
-                                {'packageid': package_id, 'suiteid': suite_id})
-                #print "DELETE FROM src_associations WHERE source = %s AND suite = %s" % (package_id, suite_id)
-            else:
-                session.execute("DELETE FROM bin_associations WHERE bin = :packageid AND suite = :suiteid",
-                                {'packageid': package_id, 'suiteid': suite_id})
-                #print "DELETE FROM bin_associations WHERE bin = %s AND suite = %s" % (package_id, suite_id)
-            # Delete from the override file
-            if not Options["Partial"]:
-                if architecture == "source":
-                    type_id = dsc_type_id
-                else:
-                    type_id = deb_type_id
-                # TODO: Again, fix this properly to remove the remaining non-bind argument
-                session.execute("DELETE FROM override WHERE package = :package AND type = :typeid AND suite = :suiteid %s" % (over_con_components), {'package': package, 'typeid': type_id, 'suiteid': suite_id})
+    delete_removals(to_remove, suite_ids_list, Options["Partial"], over_con_components, session)
     session.commit()
+    bump_archive_generation(session)
     print "done."
 
     # If we don't have a Bug server configured, we're done
@@ -436,41 +727,12 @@ def main ():
         return
 
     # read common subst variables for all bug closure mails
-    Subst_common = {}
-    Subst_common["__RM_ADDRESS__"] = cnf["Dinstall::MyEmailAddress"]
-    Subst_common["__BUG_SERVER__"] = cnf["Dinstall::BugServer"]
-    Subst_common["__CC__"] = "X-DAK: dak rm"
-    if carbon_copy:
-        Subst_common["__CC__"] += "\nCc: " + ", ".join(carbon_copy)
-    Subst_common["__SUITE_LIST__"] = suites_list
-    Subst_common["__SUBJECT__"] = "Removed package(s) from %s" % (suites_list)
-    Subst_common["__ADMIN_ADDRESS__"] = cnf["Dinstall::MyAdminAddress"]
-    Subst_common["__DISTRO__"] = cnf["Dinstall::MyDistribution"]
-    Subst_common["__WHOAMI__"] = whoami
+    Subst_common = common_substitutions(carbon_copy, suites_list, whoami)
 
     # Send the bug closing messages
     if Options["Done"]:
-        Subst_close_rm = Subst_common
-        bcc = []
-        if cnf.find("Dinstall::Bcc") != "":
-            bcc.append(cnf["Dinstall::Bcc"])
-        if cnf.find("Rm::Bcc") != "":
-            bcc.append(cnf["Rm::Bcc"])
-        if bcc:
-            Subst_close_rm["__BCC__"] = "Bcc: " + ", ".join(bcc)
-        else:
-            Subst_close_rm["__BCC__"] = "X-Filler: 42"
-        summarymail = "%s\n------------------- Reason -------------------\n%s\n" % (summary, Options["Reason"])
-        summarymail += "----------------------------------------------\n"
-        Subst_close_rm["__SUMMARY__"] = summarymail
-
-        for bug in utils.split_args(Options["Done"]):
-            Subst_close_rm["__BUG_NUMBER__"] = bug
-            if Options["Do-Close"]:
-                mail_message = utils.TemplateSubst(Subst_close_rm,cnf["Dir::Templates"]+"/rm.bug-close-with-related")
-            else:
-                mail_message = utils.TemplateSubst(Subst_close_rm,cnf["Dir::Templates"]+"/rm.bug-close")
-            utils.send_mail(mail_message, whitelists=whitelists)
+        close_bugs(Subst_common, summary, Options["Reason"], Options["Done"],
+                   Options["Do-Close"], whitelists)
 
     # close associated bug reports
     if Options["Do-Close"]:
@@ -490,7 +752,7 @@ def main ():
         # some useful information on why the package got removed
         Subst_close_other["__BUG_NUMBER__"] = utils.split_args(Options["Done"])[0]
         if len(sources) == 1:
-            source_pkg = source.split("_", 1)[0]
+            source_pkg = sources[0].split("_", 1)[0]
         else:
             utils.fubar("Closing bugs for multiple source packages is not supported.  Do it yourself.")
         Subst_close_other["__BUG_NUMBER_ALSO__"] = ""
@@ -83,7 +83,7 @@ The following MODEs are available:
 ################################################################################
 
 def per_arch_space_use():
-    session = DBConn().session()
+    session = DBConn().session(readonly=True)
     q = session.execute("""
 SELECT a.arch_string as Architecture, sum(f.size) AS sum
   FROM files f, binaries b, architecture a
@@ -147,7 +147,7 @@ def number_of_packages():
     suites = {}
     suite_ids = {}
     d = {}
-    session = DBConn().session()
+    session = DBConn().session(readonly=True)
     # Build up suite mapping
     for i in session.query(Suite).all():
         suites[i.suite_id] = i.suite_name
@@ -25,6 +25,7 @@ from daklib.config import Config
 import daklib.upload as upload
 import daklib.utils as utils
 from daklib.fstransactions import FilesystemTransaction
+from daklib.timing import PhaseTimer
 from daklib.regexes import re_changelog_versions, re_bin_only_nmu
 import daklib.daksubprocess
 
@@ -50,6 +51,7 @@ class ArchiveTransaction(object):
     def __init__(self):
         self.fs = FilesystemTransaction()
         self.session = DBConn().session()
+        self._pending_metadata = []
 
     def get_file(self, hashed_file, source_name, check_hashes=True):
         """Look for file C{hashed_file} in database
@@ -190,7 +192,7 @@ class ArchiveTransaction(object):
                 setattr(db_binary, key, value)
             session.add(db_binary)
             session.flush()
-            import_metadata_into_db(db_binary, session)
+            self._pending_metadata.append(db_binary)
 
             self._add_built_using(db_binary, binary.hashed_file.filename, control, suite, extra_archives=extra_source_archives)
 
@@ -360,7 +362,7 @@ class ArchiveTransaction(object):
         session.flush()
 
         # Importing is safe as we only arrive here when we did not find the source already installed earlier.
-        import_metadata_into_db(db_source, session)
+        self._pending_metadata.append(db_source)
 
         # Uploaders are the maintainer and co-maintainers from the Uploaders field
         db_source.uploaders.append(maintainer)
@@ -517,17 +519,31 @@ class ArchiveTransaction(object):
         source.suites.remove(suite)
         session.flush()
 
+    def flush_metadata(self):
+        """import metadata of packages installed so far
+
+        The metadata of new binaries and sources is imported in bulk when the
+        transaction is committed.  Call this before looking at the metadata
+        of packages installed in this transaction.
+        """
+        if len(self._pending_metadata) > 0:
+            import_metadata_into_db_bulk(self._pending_metadata, self.session)
+            self._pending_metadata = []
+
     def commit(self):
         """commit changes"""
         try:
+            self.flush_metadata()
             self.session.commit()
             self.fs.commit()
+            bump_archive_generation(self.session)
         finally:
             self.session.rollback()
             self.fs.rollback()
 
     def rollback(self):
         """rollback changes"""
+        self._pending_metadata = []
         self.session.rollback()
         self.fs.rollback()
 
@@ -632,9 +648,33 @@ class ArchiveUpload(object):
         @type: bool
         """
 
+        self.timings = PhaseTimer()
+        """time spent in the individual checks and install phases
+        @type: L{daklib.timing.PhaseTimer}
+        """
+
         self._new_queue = self.session.query(PolicyQueue).filter_by(queue_name='new').one()
         self._new = self._new_queue.suite
 
+        self._overrides = None
+
+    @property
+    def overrides(self):
+        """override lookups for the packages in this upload
+
+        Created on first use after C{prepare} was called.
+
+        @type: L{daklib.dbconn.OverrideResolver}
+        """
+        if self._overrides is None:
+            package_names = set(b.name for b in self.changes.binaries)
+            source = self.changes.source
+            if source is not None:
+                package_names.add(source.dsc['Source'])
+                package_names.update(entry.name for entry in source.package_list.package_list)
+            self._overrides = OverrideResolver(self.session, package_names)
+        return self._overrides
+
     def warn(self, message):
         """add a warning message
 
@@ -831,9 +871,7 @@ class ArchiveUpload(object):
         final_suites = set()
 
         for suite in mapped_suites:
-            overridesuite = suite
-            if suite.overridesuite is not None:
-                overridesuite = session.query(Suite).filter_by(suite_name=suite.overridesuite).one()
+            overridesuite = self.overrides.override_suite(suite)
             if self._check_new(overridesuite):
                 self.new = True
             final_suites.add(suite)
@@ -852,21 +890,13 @@ class ArchiveUpload(object):
         @rtype:  L{daklib.dbconn.Override} or C{None}
         @return: override for the given binary or C{None}
         """
-        if suite.overridesuite is not None:
-            suite = self.session.query(Suite).filter_by(suite_name=suite.overridesuite).one()
+        suite = self.overrides.override_suite(suite)
 
-        mapped_component = get_mapped_component(binary.component)
+        mapped_component = self.overrides.mapped_component(binary.component)
         if mapped_component is None:
             return None
 
-        query = self.session.query(Override).filter_by(suite=suite, package=binary.name) \
-                .join(Component).filter(Component.component_name == mapped_component.component_name) \
-                .join(OverrideType).filter(OverrideType.overridetype == binary.type)
-
-        try:
-            return query.one()
-        except NoResultFound:
-            return None
+        return self.overrides.get(suite, binary.name, binary.type, mapped_component)
 
     def _source_override(self, suite, source):
         """Get override entry for a source
@@ -880,20 +910,10 @@ class ArchiveUpload(object):
         @rtype:  L{daklib.dbconn.Override} or C{None}
         @return: override for the given source or C{None}
         """
-        if suite.overridesuite is not None:
-            suite = self.session.query(Suite).filter_by(suite_name=suite.overridesuite).one()
-
-        query = self.session.query(Override).filter_by(suite=suite, package=source.dsc['Source']) \
-                .join(OverrideType).filter(OverrideType.overridetype == 'dsc')
+        suite = self.overrides.override_suite(suite)
 
         component = source_component_from_package_list(source.package_list, suite)
-        if component is not None:
-            query = query.filter(Override.component == component)
-
-        try:
-            return query.one()
-        except NoResultFound:
-            return None
+        return self.overrides.get(suite, source.dsc['Source'], 'dsc', component)
 
     def _binary_component(self, suite, binary, only_overrides=True):
         """get component for a binary
@@ -916,7 +936,7 @@ class ArchiveUpload(object):
             return override.component
         if only_overrides:
             return None
-        return get_mapped_component(binary.component, self.session)
+        return self.overrides.mapped_component(binary.component)
 
     def check(self, force=False):
         """run checks against the upload
@@ -942,9 +962,11 @@ class ArchiveUpload(object):
                     checks.BinaryTimestampCheck,
                     checks.SingleDistributionCheck,
                     ):
-                chk().check(self)
+                with self.timings.measure(chk.__name__):
+                    chk().check(self)
 
-            final_suites = self._final_suites()
+            with self.timings.measure('final_suites'):
+                final_suites = self._final_suites()
             if len(final_suites) == 0:
                 self.reject_reasons.append('No target suite found. Please check your target distribution and that you uploaded to the right archive.')
                 return False
@@ -957,7 +979,8 @@ class ArchiveUpload(object):
                     checks.NoSourceOnlyCheck,
                     checks.LintianCheck,
                     ):
-                chk().check(self)
+                with self.timings.measure(chk.__name__):
+                    chk().check(self)
 
             for chk in (
                     checks.ACLCheck,
@@ -965,8 +988,9 @@ class ArchiveUpload(object):
                     checks.SuiteArchitectureCheck,
                     checks.VersionCheck,
                     ):
-                for suite in final_suites:
-                    chk().per_suite_check(self, suite)
+                with self.timings.measure('{0}.per_suite'.format(chk.__name__)):
+                    for suite in final_suites:
+                        chk().per_suite_check(self, suite)
 
             if len(self.reject_reasons) != 0:
                 return False
@@ -1223,12 +1247,11 @@ class ArchiveUpload(object):
         assert self._checked
         assert not self.new
 
-        db_changes = self._install_changes()
+        with self.timings.measure('install.changes'):
+            db_changes = self._install_changes()
 
         for suite in self.final_suites:
-            overridesuite = suite
-            if suite.overridesuite is not None:
-                overridesuite = self.session.query(Suite).filter_by(suite_name=suite.overridesuite).one()
+            overridesuite = self.overrides.override_suite(suite)
 
             policy_queue = self._policy_queue(suite)
 
@@ -1248,17 +1271,21 @@ class ArchiveUpload(object):
             source_component_func = lambda source: self._source_override(overridesuite, source).component
             binary_component_func = lambda binary: self._binary_component(overridesuite, binary)
 
-            (db_source, db_binaries) = self._install_to_suite(redirected_suite, source_component_func, binary_component_func, source_suites=source_suites, extra_source_archives=[suite.archive])
+            with self.timings.measure('install.suite'):
+                (db_source, db_binaries) = self._install_to_suite(redirected_suite, source_component_func, binary_component_func, source_suites=source_suites, extra_source_archives=[suite.archive])
 
             if policy_queue is not None:
-                self._install_policy(policy_queue, suite, db_changes, db_source, db_binaries)
+                with self.timings.measure('install.policy'):
+                    self._install_policy(policy_queue, suite, db_changes, db_source, db_binaries)
 
             # copy to build queues
             if policy_queue is None or policy_queue.send_to_build_queues:
-                for build_queue in suite.copy_queues:
-                    self._install_to_suite(build_queue.suite, source_component_func, binary_component_func, source_suites=source_suites, extra_source_archives=[suite.archive])
+                with self.timings.measure('install.build_queues'):
+                    for build_queue in suite.copy_queues:
+                        self._install_to_suite(build_queue.suite, source_component_func, binary_component_func, source_suites=source_suites, extra_source_archives=[suite.archive])
 
-        self._do_bts_versiontracking()
+        with self.timings.measure('install.bts_versiontracking'):
+            self._do_bts_versiontracking()
 
     def install_to_new(self):
         """install upload to NEW
@@ -1314,25 +1341,31 @@ class ArchiveUpload(object):
             source_component = self.session.query(Component).filter_by(component_name=source_component_name).one()
         source_component_func = lambda source: source_component
 
-        db_changes = self._install_changes()
-        (db_source, db_binaries) = self._install_to_suite(new_suite, source_component_func, binary_component_func, source_suites=True, extra_source_archives=[suite.archive])
-        policy_upload = self._install_policy(new_queue, suite, db_changes, db_source, db_binaries)
+        with self.timings.measure('install.changes'):
+            db_changes = self._install_changes()
+        with self.timings.measure('install.suite'):
+            (db_source, db_binaries) = self._install_to_suite(new_suite, source_component_func, binary_component_func, source_suites=True, extra_source_archives=[suite.archive])
+        with self.timings.measure('install.policy'):
+            policy_upload = self._install_policy(new_queue, suite, db_changes, db_source, db_binaries)
 
-        for f in byhand:
-            self._install_byhand(policy_upload, f)
+            for f in byhand:
+                self._install_byhand(policy_upload, f)
 
-        self._do_bts_versiontracking()
+        with self.timings.measure('install.bts_versiontracking'):
+            self._do_bts_versiontracking()
 
     def commit(self):
         """commit changes"""
-        self.transaction.commit()
+        with self.timings.measure('commit'):
+            self.transaction.commit()
 
     def rollback(self):
         """rollback changes"""
         self.transaction.rollback()
 
     def __enter__(self):
-        self.prepare()
+        with self.timings.measure('prepare'):
+            self.prepare()
         return self
 
     def __exit__(self, type, value, traceback):
@@ -36,13 +36,16 @@ import daklib.upload
 import apt_inst
 import apt_pkg
 from apt_pkg import version_compare
+import atexit
 import datetime
 import errno
+import hashlib
 import os
 import subprocess
 import textwrap
 import time
 import yaml
+from sqlalchemy import func
 
 def check_fields_for_valid_utf8(filename, control):
     """Check all fields of a control file for valid UTF-8"""
@@ -577,48 +580,63 @@ class ACLCheck(Check):
         return True
 
 class TransitionCheck(Check):
-    """check for a transition"""
+    """check for a transition
+
+    The transitions file is parsed only once per process and re-read when its
+    modification time changes.  Together with the transitions an index from
+    affected source package to transition names is kept, so only transitions
+    that actually include the uploaded source need to be looked at.
+    """
+
+    _cache = None
+    """cached transitions shared by all instances
+    @type: tuple of (path, mtime, transitions, index)
+    """
+
     def check(self, upload):
         if 'source' not in upload.changes.architectures:
             return True
 
-        transitions = self.get_transitions()
+        transitions, index = self.get_indexed_transitions()
         if transitions is None:
             return True
 
-        session = upload.session
-
         control = upload.changes.changes
         source = re_field_source.match(control['Source']).group('package')
 
-        for trans in transitions:
+        affected = index.get(source)
+        if not affected:
+            return True
+
+        session = upload.session
+        testing_versions = self._versions_in_testing(session, set(transitions[trans]["source"] for trans in affected))
+
+        for trans in affected:
             t = transitions[trans]
             transition_source = t["source"]
             expected = t["new"]
 
             # Will be None if nothing is in testing.
-            current = get_source_in_suite(transition_source, "testing", session)
+            current = testing_versions.get(transition_source)
             if current is not None:
-                compare = apt_pkg.version_compare(current.version, expected)
+                compare = apt_pkg.version_compare(current, expected)
 
             if current is None or compare < 0:
                 # This is still valid, the current version in testing is older than
                 # the new version we wait for, or there is none in testing yet
 
-                # Check if the source we look at is affected by this.
-                if source in t['packages']:
-                    # The source is affected, lets reject it.
+                # The source is affected, lets reject it.
 
-                    rejectmsg = "{0}: part of the {1} transition.\n\n".format(source, trans)
+                rejectmsg = "{0}: part of the {1} transition.\n\n".format(source, trans)
 
-                    if current is not None:
-                        currentlymsg = "at version {0}".format(current.version)
-                    else:
-                        currentlymsg = "not present in testing"
+                if current is not None:
+                    currentlymsg = "at version {0}".format(current)
+                else:
+                    currentlymsg = "not present in testing"
 
-                    rejectmsg += "Transition description: {0}\n\n".format(t["reason"])
+                rejectmsg += "Transition description: {0}\n\n".format(t["reason"])
 
-                    rejectmsg += "\n".join(textwrap.wrap("""Your package
+                rejectmsg += "\n".join(textwrap.wrap("""Your package
 is part of a testing transition designed to get {0} migrated (it is
 currently {1}, we need version {2}).  This transition is managed by the
 Release Team, and {3} is the Release-Team member responsible for it.
@@ -626,16 +644,67 @@ Please mail debian-release@lists.debian.org or contact {3} directly if you
 need further assistance.  You might want to upload to experimental until this
 transition is done.""".format(transition_source, currentlymsg, expected,t["rm"])))
 
-                    raise Reject(rejectmsg)
+                raise Reject(rejectmsg)
 
         return True
 
-    def get_transitions(self):
+    def _versions_in_testing(self, session, source_names):
+        """get versions of the given sources in testing with a single query
+
+        @rtype:  dict
+        @return: mapping of source name to the highest version in testing;
+                 sources not in testing are missing from the mapping
+        """
+        versions = dict()
+        suite = get_suite("testing", session)
+        if suite is None or len(source_names) == 0:
+            return versions
+
+        query = session.query(DBSource.source, DBSource.version) \
+            .filter(DBSource.source.in_(source_names)) \
+            .filter(DBSource.suites.contains(suite))
+        for source_name, version in query:
+            if source_name not in versions or apt_pkg.version_compare(version, versions[source_name]) > 0:
+                versions[source_name] = version
+        return versions
+
+    def get_indexed_transitions(self):
+        """get transitions together with an index by affected source
+
+        @rtype:  tuple
+        @return: tuple of the transitions (as returned by C{get_transitions})
+                 and a dict mapping source package names to the sorted list
+                 of transitions including them.  Both are C{None} if there
+                 are no transitions.
+        """
         cnf = Config()
         path = cnf.get('Dinstall::ReleaseTransitions', '')
-        if path == '' or not os.path.exists(path):
-            return None
+        if path == '':
+            return None, None
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None, None
+
+        cache = TransitionCheck._cache
+        if cache is None or cache[0] != path or cache[1] != mtime:
+            transitions = self._load_transitions(path)
+            index = None
+            if transitions is not None:
+                index = dict()
+                for trans in sorted(transitions):
+                    for package in transitions[trans]['packages']:
+                        index.setdefault(package, []).append(trans)
+            cache = (path, mtime, transitions, index)
+            TransitionCheck._cache = cache
+
+        return cache[2], cache[3]
+
+    def get_transitions(self):
+        transitions, index = self.get_indexed_transitions()
+        return transitions
 
+    def _load_transitions(self, path):
         contents = file(path, 'r').read()
         try:
             transitions = yaml.safe_load(contents)
@@ -696,37 +765,70 @@ class NoSourceOnlyCheck(Check):
         return True
 
 class LintianCheck(Check):
-    """Check package using lintian"""
-    def check(self, upload):
-        changes = upload.changes
+    """Check package using lintian
 
-        # Only check sourceful uploads.
-        if changes.source is None:
-            return True
-        # Only check uploads to unstable or experimental.
-        if 'unstable' not in changes.distributions and 'experimental' not in changes.distributions:
-            return True
+    The tags file is parsed (and written to a temporary file for lintian)
+    only once per process.  Parsed lintian output is cached by the hashes
+    of the checked files, the lintian version and the digest of the tags
+    file; if Dinstall::LintianCache names a directory, results are also
+    kept there across runs.  Cache hits do not run lintian at all.
+    """
 
-        cnf = Config()
-        if 'Dinstall::LintianTags' not in cnf:
-            return True
-        tagfile = cnf['Dinstall::LintianTags']
+    _tags = None
+    """compiled tags file shared by all instances
+    @type: L{_LintianTags}
+    """
 
-        with open(tagfile, 'r') as sourcefile:
-            sourcecontent = sourcefile.read()
-        try:
-            lintiantags = yaml.safe_load(sourcecontent)['lintian']
-        except yaml.YAMLError as msg:
-            raise Exception('Could not read lintian tags file {0}, YAML error: {1}'.format(tagfile, msg))
+    _lintian_version = None
 
-        fd, temp_filename = utils.temp_filename(mode=0o644)
-        temptagfile = os.fdopen(fd, 'w')
-        for tags in lintiantags.itervalues():
-            for tag in tags:
-                print >>temptagfile, tag
-        temptagfile.close()
+    _cache = None
+    """cache of parsed lintian output shared by all instances
+    @type: L{daklib.lintian.LintianResultCache}
+    """
+
+    def _compiled_tags(self, tagfile):
+        cls = LintianCheck
+        mtime = os.stat(tagfile).st_mtime
+        if cls._tags is None or cls._tags.path != tagfile or cls._tags.mtime != mtime:
+            if cls._tags is not None:
+                cls._tags.remove()
+            cls._tags = _LintianTags(tagfile, mtime)
+        return cls._tags
+
+    def _get_lintian_version(self):
+        cls = LintianCheck
+        if cls._lintian_version is None:
+            try:
+                output = daklib.daksubprocess.check_output(['/usr/bin/lintian', '--print-version'])
+                cls._lintian_version = output.strip()
+            except (OSError, subprocess.CalledProcessError):
+                # Without a version we cannot safely use cached results.
+                cls._lintian_version = ''
+        return cls._lintian_version
+
+    def _get_cache(self):
+        cls = LintianCheck
+        if cls._cache is None:
+            directory = Config().get('Dinstall::LintianCache') or None
+            cls._cache = lintian.LintianResultCache(directory)
+        return cls._cache
+
+    def _cache_key(self, upload, tags):
+        lintian_version = self._get_lintian_version()
+        if not lintian_version:
+            return None
+
+        changes = upload.changes
+        file_hashes = [ (f.filename, f.sha256sum) for f in changes.files.itervalues() ]
+        file_hashes.extend((f.filename, f.sha256sum) for f in changes.source.files.itervalues())
+        # Use the unsigned contents of the .changes so refreshing only the
+        # signature still hits the cache.
+        file_hashes.append((changes.filename, changes.contents_sha1()))
 
-        changespath = os.path.join(upload.directory, changes.filename)
+        return lintian.result_cache_key(file_hashes, lintian_version, tags.digest)
+
+    def _run_lintian(self, changespath, tags):
+        cnf = Config()
         try:
             cmd = []
             result = 0
@@ -735,27 +837,87 @@ class LintianCheck(Check):
             if user is not None:
                 cmd.extend(['sudo', '-H', '-u', user])
 
-            cmd.extend(['/usr/bin/lintian', '--show-overrides', '--tags-from-file', temp_filename, changespath])
+            cmd.extend(['/usr/bin/lintian', '--show-overrides', '--tags-from-file', tags.temp_filename, changespath])
             output = daklib.daksubprocess.check_output(cmd, stderr=subprocess.STDOUT)
         except subprocess.CalledProcessError as e:
             result = e.returncode
             output = e.output
-        finally:
-            os.unlink(temp_filename)
 
-        if result == 2:
-            utils.warn("lintian failed for %s [return code: %s]." % \
-                (changespath, result))
-            utils.warn(utils.prefix_multi_line_string(output, \
-                " [possible output:] "))
+        return result, output
+
+    def check(self, upload):
+        changes = upload.changes
+
+        # Only check sourceful uploads.
+        if changes.source is None:
+            return True
+        # Only check uploads to unstable or experimental.
+        if 'unstable' not in changes.distributions and 'experimental' not in changes.distributions:
+            return True
+
+        cnf = Config()
+        if 'Dinstall::LintianTags' not in cnf:
+            return True
+        tags = self._compiled_tags(cnf['Dinstall::LintianTags'])
+
+        cache = self._get_cache()
+        key = self._cache_key(upload, tags)
+        parsed_tags = None
+        if key is not None:
+            parsed_tags = cache.get(key)
+
+        if parsed_tags is None:
+            changespath = os.path.join(upload.directory, changes.filename)
+            result, output = self._run_lintian(changespath, tags)
+
+            if result == 2:
+                utils.warn("lintian failed for %s [return code: %s]." % \
+                    (changespath, result))
+                utils.warn(utils.prefix_multi_line_string(output, \
+                    " [possible output:] "))
+
+            parsed_tags = list(lintian.parse_lintian_output(output))
+            if key is not None and result != 2:
+                cache.set(key, parsed_tags)
 
-        parsed_tags = lintian.parse_lintian_output(output)
-        rejects = list(lintian.generate_reject_messages(parsed_tags, lintiantags))
+        rejects = list(lintian.generate_reject_messages(parsed_tags, tags.lintiantags))
         if len(rejects) != 0:
             raise Reject('\n'.join(rejects))
 
         return True
 
+class _LintianTags(object):
+    """parsed lintian tags file together with the flat list passed to lintian"""
+    def __init__(self, path, mtime):
+        self.path = path
+        self.mtime = mtime
+
+        with open(path, 'r') as sourcefile:
+            sourcecontent = sourcefile.read()
+        try:
+            self.lintiantags = yaml.safe_load(sourcecontent)['lintian']
+        except yaml.YAMLError as msg:
+            raise Exception('Could not read lintian tags file {0}, YAML error: {1}'.format(path, msg))
+        self.digest = hashlib.sha256(sourcecontent).hexdigest()
+
+        fd, self.temp_filename = utils.temp_filename(mode=0o644)
+        temptagfile = os.fdopen(fd, 'w')
+        for tags in self.lintiantags.itervalues():
+            for tag in tags:
+                print >>temptagfile, tag
+        temptagfile.close()
+        atexit.register(self.remove)
+
+    def remove(self):
+        """remove the temporary tags file"""
+        if self.temp_filename is not None:
+            try:
+                os.unlink(self.temp_filename)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            self.temp_filename = None
+
 class SourceFormatCheck(Check):
     """Check source format is allowed in the target suite"""
     def per_suite_check(self, upload, suite):
@@ -780,33 +942,78 @@ class SuiteArchitectureCheck(Check):
         return True
 
 class VersionCheck(Check):
-    """Check version constraints"""
+    """Check version constraints
+
+    The highest versions present in a referenced suite are fetched for all
+    packages of the upload at once (one query for the source and one for all
+    binaries) and then compared in memory.
+    """
+    def __init__(self):
+        self._highest_versions_cache = dict()
+
     def _highest_source_version(self, session, source_name, suite):
-        db_source = session.query(DBSource).filter_by(source=source_name) \
-            .filter(DBSource.suites.contains(suite)).order_by(DBSource.version.desc()).first()
-        if db_source is None:
-            return None
-        else:
-            return db_source.version
+        return session.query(func.max(DBSource.version)).filter(DBSource.source == source_name) \
+            .filter(DBSource.suites.contains(suite)).scalar()
 
-    def _highest_binary_version(self, session, binary_name, suite, architecture):
-        db_binary = session.query(DBBinary).filter_by(package=binary_name) \
+    def _highest_binary_versions(self, session, binary_names, suite, architectures):
+        """get highest binary versions in a suite
+
+        @rtype:  dict
+        @return: mapping of (package, architecture) to the highest version
+                 for all given binary names and architectures (including
+                 C{all}) found in C{suite}
+        """
+        if len(binary_names) == 0:
+            return dict()
+        architectures = set(architectures)
+        architectures.add('all')
+        query = session.query(DBBinary.package, Architecture.arch_string, func.max(DBBinary.version)) \
+            .filter(DBBinary.package.in_(binary_names)) \
             .filter(DBBinary.suites.contains(suite)) \
             .join(DBBinary.architecture) \
-            .filter(Architecture.arch_string.in_(['all', architecture])) \
-            .order_by(DBBinary.version.desc()).first()
-        if db_binary is None:
-            return None
-        else:
-            return db_binary.version
+            .filter(Architecture.arch_string.in_(architectures)) \
+            .group_by(DBBinary.package, Architecture.arch_string)
+        return dict( ((package, arch), version) for package, arch, version in query )
+
+    def _highest_versions(self, upload, suite):
+        """get highest versions of the upload's packages in C{suite}
+
+        Results are remembered per suite for the lifetime of this check.
+
+        @rtype:  tuple
+        @return: tuple of the highest source version (or C{None}) and a dict
+                 as returned by C{_highest_binary_versions}
+        """
+        if suite.suite_id not in self._highest_versions_cache:
+            session = upload.session
+            source_version = None
+            if upload.changes.source is not None:
+                source_name = upload.changes.source.dsc['Source']
+                source_version = self._highest_source_version(session, source_name, suite)
+
+            binaries = upload.changes.binaries
+            binary_names = set(binary.control['Package'] for binary in binaries)
+            architectures = set(binary.control['Architecture'] for binary in binaries)
+            binary_versions = self._highest_binary_versions(session, binary_names, suite, architectures)
+
+            self._highest_versions_cache[suite.suite_id] = (source_version, binary_versions)
+        return self._highest_versions_cache[suite.suite_id]
+
+    def _highest_binary_version(self, binary_versions, binary_name, architecture):
+        highest = None
+        for arch in (architecture, 'all'):
+            v = binary_versions.get((binary_name, arch))
+            if v is not None and (highest is None or version_compare(v, highest) > 0):
+                highest = v
+        return highest
 
     def _version_checks(self, upload, suite, other_suite, op, op_name):
-        session = upload.session
+        source_version_in_suite, binary_versions = self._highest_versions(upload, other_suite)
 
         if upload.changes.source is not None:
             source_name = upload.changes.source.dsc['Source']
             source_version = upload.changes.source.dsc['Version']
-            v = self._highest_source_version(session, source_name, other_suite)
+            v = source_version_in_suite
             if v is not None and not op(version_compare(source_version, v)):
                 raise Reject("Version check failed:\n"
                              "Your upload included the source package {0}, version {1},\n"
@@ -818,7 +1025,7 @@ class VersionCheck(Check):
             binary_name = binary.control['Package']
             binary_version = binary.control['Version']
             architecture = binary.control['Architecture']
-            v = self._highest_binary_version(session, binary_name, other_suite, architecture)
+            v = self._highest_binary_version(binary_versions, binary_name, architecture)
             if v is not None and not op(version_compare(binary_version, v)):
                 raise Reject("Version check failed:\n"
                              "Your upload included the binary package {0}, version {1}, for {2},\n"
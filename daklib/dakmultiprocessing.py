@@ -30,6 +30,8 @@ from signal import signal, SIGHUP, SIGTERM, SIGPIPE, SIGALRM
 
 import sqlalchemy.orm.session
 
+from daklib.querystats import QueryStats
+
 __all__ = []
 
 PROC_STATUS_SUCCESS      = 0  # Everything ok
@@ -59,21 +61,35 @@ def _func_wrapper(func, *args, **kwds):
     signal(SIGPIPE, signal_handler)
     signal(SIGALRM, signal_handler)
 
+    # Only report statements executed for this job to the parent
+    querystats = QueryStats()
+    querystats.reset()
+
     # We expect our callback function to return:
     # (status, messages)
     # Where:
     #  status is one of PROC_STATUS_*
     #  messages is a string used for logging
     try:
-        return (func(*args, **kwds))
+        result = func(*args, **kwds)
     except SignalException as e:
-        return (PROC_STATUS_SIGNALRAISED, e.signum)
+        result = (PROC_STATUS_SIGNALRAISED, e.signum)
     except Exception as e:
-        return (PROC_STATUS_EXCEPTION, str(e))
+        result = (PROC_STATUS_EXCEPTION, str(e))
     finally:
         # Make sure connections are closed. We might die otherwise.
         sqlalchemy.orm.session.Session.close_all()
 
+    return (result, querystats.snapshot())
+
+def _callback_wrapper(callback):
+    def wrapped(value):
+        result, statements = value
+        QueryStats().merge(statements)
+        if callback is not None:
+            callback(result)
+    return wrapped
+
 
 class DakProcessPool(Pool):
     def __init__(self, *args, **kwds):
@@ -84,14 +100,14 @@ class DakProcessPool(Pool):
     def apply_async(self, func, args=(), kwds={}, callback=None):
         wrapper_args = list(args)
         wrapper_args.insert(0, func)
-        self.int_results.append(Pool.apply_async(self, _func_wrapper, wrapper_args, kwds, callback))
+        self.int_results.append(Pool.apply_async(self, _func_wrapper, wrapper_args, kwds, _callback_wrapper(callback)))
 
     def join(self):
         Pool.join(self)
         for r in self.int_results:
             # return values were already handled in the callbacks, but asking
             # for them might raise exceptions which would otherwise be lost
-            self.results.append(r.get())
+            self.results.append(r.get()[0])
 
     def overall_status(self):
         # Return the highest of our status results
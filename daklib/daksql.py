@@ -19,7 +19,7 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 from sqlalchemy.ext.compiler import compiles
-from sqlalchemy.sql.expression import ColumnElement, ClauseElement, ClauseList, literal
+from sqlalchemy.sql.expression import ColumnElement, ClauseElement, ClauseList, literal, text
 from sqlalchemy.types import Text
 from sqlalchemy.util import to_list
 
@@ -50,3 +50,45 @@ def compile_string_agg(element, compiler, **kw):
     if element.order_by is not None:
         return "STRING_AGG({0}, {1} ORDER BY {2})".format(compiler.process(element.column), compiler.process(element.seperator), compiler.process(element.order_by))
     return "STRING_AGG({0}, {1})".format(compiler.process(element.column), compiler.process(element.seperator))
+
+def stream(session, statement, params=None, fetch_size=None):
+    """execute a statement using a server-side cursor and iterate over the rows
+
+    The result is fetched from a named cursor in chunks, so memory usage does
+    not depend on the size of the result.  The session's transaction must
+    stay open while iterating.
+
+    @type  session: Session
+    @param session: database session
+
+    @type  statement: str or SQL expression
+    @param statement: statement to execute
+
+    @type  params: dict
+    @param params: bind parameters
+
+    @type  fetch_size: int
+    @param fetch_size: number of rows to fetch at once (default: DB::FetchSize
+                       or 1000)
+
+    @return: iterator over result rows
+    """
+    if fetch_size is None:
+        from daklib.config import Config
+        fetch_size = Config().find_i('DB::FetchSize', 1000)
+    if isinstance(statement, basestring):
+        statement = text(statement)
+
+    # max_row_buffer is only used by SQLAlchemy 1.0.6 and later; older versions
+    # grow the buffer of a streaming result up to 1000 rows.
+    connection = session.connection().execution_options(stream_results=True, max_row_buffer=fetch_size)
+    result = connection.execute(statement, params or {})
+    try:
+        while True:
+            rows = result.fetchmany(fetch_size)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                yield row
+    finally:
+        result.close()
@@ -49,6 +49,7 @@ except:
     # python <= 2.5
     import simplejson as json
 
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from errno import ENOENT
 from tempfile import mkstemp, mkdtemp
@@ -60,14 +61,15 @@ import sqlalchemy
 from sqlalchemy import create_engine, Table, MetaData, Column, Integer, desc, \
     Text, ForeignKey
 from sqlalchemy.orm import sessionmaker, mapper, relation, object_session, \
-    backref, MapperExtension, EXT_CONTINUE, object_mapper, clear_mappers
+    backref, MapperExtension, EXT_CONTINUE, object_mapper, clear_mappers, \
+    joinedload
 from sqlalchemy import types as sqltypes
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy.ext.associationproxy import association_proxy
 
 # Don't remove this, we re-export the exceptions to scripts which import us
 from sqlalchemy.exc import *
-from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
 # Only import Config until Queue stuff is changed to store its config
 # in the database
@@ -172,6 +174,151 @@ __all__.append('session_wrapper')
 
 ################################################################################
 
+class LookupCache(object):
+    """
+    Bounded cache for lookups in small, rarely changing tables.
+
+    Only primary keys are cached, never ORM objects, so a cache hit is
+    resolved with C{session.query(cls).get(pk)}.  This attaches the object
+    to the calling session and does not need a query if the object is
+    already in the session's identity map.  Objects that vanished (for
+    example because the transaction that created them was rolled back) or
+    no longer match the lookup key are evicted and looked up again.
+
+    Negative results are not cached.
+    """
+
+    def __init__(self, name, match, size=1024):
+        """
+        @type  name: str
+        @param name: name of the cache (used for statistics)
+
+        @type  match: callable
+        @param match: called as C{match(obj, key)}, returns C{True} if
+                      C{obj} is still the result for C{key}
+
+        @type  size: int
+        @param size: maximum number of cached keys
+        """
+        self.name = name
+        self.match = match
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._ids = OrderedDict()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, cls, key, session):
+        """
+        Look up C{key} in the cache.
+
+        @type  cls: class
+        @param cls: mapped class
+
+        @param key: lookup key
+
+        @param session: SQL session object
+
+        @return: object attached to C{session} or C{None} on a cache miss
+        """
+        pk = self._ids.pop(key, None)
+        if pk is not None:
+            obj = session.query(cls).get(pk)
+            if obj is not None and self.match(obj, key):
+                self._ids[key] = pk
+                self.hits += 1
+                return obj
+        self.misses += 1
+        return None
+
+    def get_id(self, key):
+        """
+        Return the cached primary key for C{key} without touching the
+        database.  The caller is responsible for handling stale ids.
+
+        @return: primary key or C{None}
+        """
+        pk = self._ids.pop(key, None)
+        if pk is None:
+            self.misses += 1
+            return None
+        self._ids[key] = pk
+        self.hits += 1
+        return pk
+
+    def add(self, key, pk):
+        """
+        Remember primary key C{pk} for C{key}.
+        """
+        if pk is None:
+            return
+        self._ids.pop(key, None)
+        self._ids[key] = pk
+        while len(self._ids) > self.size:
+            self._ids.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """
+        Forget C{key} or, if no key is given, all cached entries.
+        """
+        if key is None:
+            self._ids.clear()
+        else:
+            self._ids.pop(key, None)
+
+    def stats(self):
+        """
+        @rtype:  tuple
+        @return: C{(name, entries, hits, misses)}
+        """
+        return (self.name, len(self._ids), self.hits, self.misses)
+
+_lookup_caches = {}
+
+def _lookup_cache(name, match):
+    """get or create the process-wide lookup cache C{name}"""
+    cache = _lookup_caches.get(name)
+    if cache is None:
+        cache = _lookup_caches[name] = LookupCache(name, match)
+    return cache
+
+def invalidate_lookup_caches(*names):
+    """
+    Invalidate process-wide lookup caches.
+
+    Call this after modifying architectures, components, suites, sections,
+    priorities, override types or similar tables in a long-running process.
+
+    The caches are private to each process, so changes made by other
+    processes (for example C{dak admin}) are only noticed once the
+    long-running process invalidates its caches.  The C{dak process-upload}
+    daemon does so before each batch of uploads (see
+    C{dak.process_upload.process_queue}).
+
+    @type  names: str
+    @param names: names of the caches to invalidate; all caches if empty
+    """
+    for name, cache in _lookup_caches.iteritems():
+        if len(names) == 0 or name in names:
+            cache.invalidate()
+
+__all__.append('invalidate_lookup_caches')
+
+def lookup_cache_stats():
+    """
+    Return hit/miss statistics of the process-wide lookup caches.
+
+    @rtype:  list of tuples
+    @return: C{(name, entries, hits, misses)} for each cache, sorted by name
+    """
+    return [ _lookup_caches[name].stats() for name in sorted(_lookup_caches) ]
+
+__all__.append('lookup_cache_stats')
+
+################################################################################
+
 class ORMObject(object):
     """
     ORMObject is a base class for all ORM classes mapped by SQLalchemy. All
@@ -423,15 +570,24 @@ def get_architecture(architecture, session=None):
     @return: Architecture object for the given arch (None if not present)
     """
 
+    ret = _architecture_cache.get(Architecture, architecture, session)
+    if ret is not None:
+        return ret
+
     q = session.query(Architecture).filter_by(arch_string=architecture)
 
     try:
-        return q.one()
+        ret = q.one()
     except NoResultFound:
         return None
 
+    _architecture_cache.add(architecture, ret.arch_id)
+    return ret
+
 __all__.append('get_architecture')
 
+_architecture_cache = _lookup_cache('architecture', lambda obj, key: obj.arch_string == key)
+
 ################################################################################
 
 class Archive(object):
@@ -629,6 +785,46 @@ def get_component_by_package_suite(package, suite_list, arch_list=[], session=No
 
 __all__.append('get_component_by_package_suite')
 
+@session_wrapper
+def get_components_by_packages_suite(packages, suite_list, arch_list=[], session=None):
+    '''
+    Returns the component names of the newest binary packages in suite_list
+    like L{get_component_by_package_suite}, but for many packages with a
+    single query.
+
+    @type packages: iterable of str
+    @param packages: DBBinary package names to search for
+
+    @type suite_list: list of str
+    @param suite_list: list of suite_name items
+
+    @type arch_list: list of str
+    @param arch_list: optional list of arch_string items that defaults to []
+
+    @rtype: dict
+    @return: package name to component name; packages that are not found
+             are missing
+    '''
+
+    packages = set(packages)
+    if len(packages) == 0:
+        return {}
+    q = session.query(DBBinary.package, Component.component_name). \
+        filter(DBBinary.package.in_(packages)). \
+        join(DBBinary.suites).filter(Suite.suite_name.in_(suite_list)). \
+        join(ArchiveFile, (ArchiveFile.file_id == DBBinary.poolfile_id) & \
+                          (ArchiveFile.archive_id == Suite.archive_id)). \
+        join(ArchiveFile.component)
+    if len(arch_list) > 0:
+        q = q.join(DBBinary.architecture). \
+            filter(Architecture.arch_string.in_(arch_list))
+    components = {}
+    for package, component in q.order_by(DBBinary.package, desc(DBBinary.version)):
+        components.setdefault(package, component)
+    return components
+
+__all__.append('get_components_by_packages_suite')
+
 ################################################################################
 
 class BuildQueue(object):
@@ -682,15 +878,24 @@ def get_component(component, session=None):
     """
     component = component.lower()
 
+    ret = _component_cache.get(Component, component, session)
+    if ret is not None:
+        return ret
+
     q = session.query(Component).filter_by(component_name=component)
 
     try:
-        return q.one()
+        ret = q.one()
     except NoResultFound:
         return None
 
+    _component_cache.add(component, ret.component_id)
+    return ret
+
 __all__.append('get_component')
 
+_component_cache = _lookup_cache('component', lambda obj, key: obj.component_name == key)
+
 @session_wrapper
 def get_mapped_component(component_name, session=None):
     """get component after mappings
@@ -1132,6 +1337,10 @@ def get_or_set_fingerprint(fpr, session=None):
     @return: the Fingerprint object for the given fpr
     """
 
+    ret = _fingerprint_cache.get(Fingerprint, fpr, session)
+    if ret is not None:
+        return ret
+
     q = session.query(Fingerprint).filter_by(fingerprint=fpr)
 
     try:
@@ -1143,10 +1352,13 @@ def get_or_set_fingerprint(fpr, session=None):
         session.commit_or_flush()
         ret = fingerprint
 
+    _fingerprint_cache.add(fpr, ret.fingerprint_id)
     return ret
 
 __all__.append('get_or_set_fingerprint')
 
+_fingerprint_cache = _lookup_cache('fingerprint', lambda obj, key: obj.fingerprint == key)
+
 ################################################################################
 
 # Helper routine for Keyring class
@@ -1424,6 +1636,10 @@ def get_or_set_maintainer(name, session=None):
     @return: the Maintainer object for the given maintainer
     """
 
+    ret = _maintainer_cache.get(Maintainer, name, session)
+    if ret is not None:
+        return ret
+
     q = session.query(Maintainer).filter_by(name=name)
     try:
         ret = q.one()
@@ -1434,10 +1650,13 @@ def get_or_set_maintainer(name, session=None):
         session.commit_or_flush()
         ret = maintainer
 
+    _maintainer_cache.add(name, ret.maintainer_id)
     return ret
 
 __all__.append('get_or_set_maintainer')
 
+_maintainer_cache = _lookup_cache('maintainer', lambda obj, key: obj.name == key)
+
 @session_wrapper
 def get_maintainer(maintainer_id, session=None):
     """
@@ -1593,6 +1812,102 @@ def get_override(package, suite=None, component=None, overridetype=None, session
 
 __all__.append('get_override')
 
+class OverrideResolver(object):
+    """serve override lookups for a set of packages from memory
+
+    All overrides for the known package names in an override suite are
+    loaded with a single query (including type, component, section and
+    priority) the first time the suite is used.  Lookups for other package
+    names load them on demand.  Component mappings and override suite
+    redirections are remembered as well.
+
+    The resolver is meant to be used for the lifetime of a single upload;
+    it does not notice changes to the overrides made in the meantime.
+    """
+    def __init__(self, session, package_names=()):
+        """
+        @param session: database session
+
+        @type  package_names: iterable of str
+        @param package_names: package names to load overrides for
+        """
+        self.session = session
+        self.package_names = set(package_names)
+        self._overrides = dict()
+        self._loaded = dict()
+        self._components = dict()
+        self._override_suites = dict()
+
+    def override_suite(self, suite):
+        """get the suite holding the overrides for C{suite}
+
+        @type  suite: L{Suite}
+
+        @rtype: L{Suite}
+        """
+        if suite.overridesuite is None:
+            return suite
+        if suite.overridesuite not in self._override_suites:
+            self._override_suites[suite.overridesuite] = self.session.query(Suite) \
+                .filter_by(suite_name=suite.overridesuite).one()
+        return self._override_suites[suite.overridesuite]
+
+    def mapped_component(self, component_name):
+        """cached version of L{get_mapped_component}"""
+        if component_name not in self._components:
+            self._components[component_name] = get_mapped_component(component_name, self.session)
+        return self._components[component_name]
+
+    def _load(self, suite, package_names):
+        loaded = self._loaded.setdefault(suite.suite_id, set())
+        overrides = self._overrides.setdefault(suite.suite_id, dict())
+        missing = set(package_names) - loaded
+        if len(missing) == 0:
+            return overrides
+
+        query = self.session.query(Override).filter(Override.suite_id == suite.suite_id) \
+            .filter(Override.package.in_(missing)) \
+            .options(joinedload(Override.overridetype), joinedload(Override.component),
+                     joinedload(Override.section), joinedload(Override.priority))
+        for override in query:
+            key = (override.package, override.overridetype.overridetype)
+            overrides.setdefault(key, []).append(override)
+        loaded.update(missing)
+        return overrides
+
+    def get(self, suite, package, overridetype, component=None):
+        """get override entry
+
+        Like a query for a single override entry, this raises an exception
+        if C{component} is not given and there are several matching entries.
+
+        @type  suite: L{Suite}
+        @param suite: override suite (no redirection is applied)
+
+        @type  package: str
+        @param package: package name
+
+        @type  overridetype: str
+        @param overridetype: override type (eg. C{deb}, C{udeb} or C{dsc})
+
+        @type  component: L{Component}
+        @param component: optional component to limit to
+
+        @rtype:  L{Override} or C{None}
+        """
+        self.package_names.add(package)
+        overrides = self._load(suite, self.package_names)
+        candidates = overrides.get((package, overridetype), [])
+        if component is not None:
+            candidates = [ o for o in candidates if o.component_id == component.component_id ]
+        if len(candidates) > 1:
+            raise MultipleResultsFound('Multiple overrides for {0}/{1} in {2}'.format(package, overridetype, suite.suite_name))
+        if len(candidates) == 0:
+            return None
+        return candidates[0]
+
+__all__.append('OverrideResolver')
+
 
 ################################################################################
 
@@ -1624,15 +1939,24 @@ def get_override_type(override_type, session=None):
     @return: the database id for the given override type
     """
 
+    ret = _override_type_cache.get(OverrideType, override_type, session)
+    if ret is not None:
+        return ret
+
     q = session.query(OverrideType).filter_by(overridetype=override_type)
 
     try:
-        return q.one()
+        ret = q.one()
     except NoResultFound:
         return None
 
+    _override_type_cache.add(override_type, ret.overridetype_id)
+    return ret
+
 __all__.append('get_override_type')
 
+_override_type_cache = _lookup_cache('override_type', lambda obj, key: obj.overridetype == key)
+
 ################################################################################
 
 class PolicyQueue(object):
@@ -1737,15 +2061,24 @@ def get_priority(priority, session=None):
     @return: Priority object for the given priority
     """
 
+    ret = _priority_cache.get(Priority, priority, session)
+    if ret is not None:
+        return ret
+
     q = session.query(Priority).filter_by(priority=priority)
 
     try:
-        return q.one()
+        ret = q.one()
     except NoResultFound:
         return None
 
+    _priority_cache.add(priority, ret.priority_id)
+    return ret
+
 __all__.append('get_priority')
 
+_priority_cache = _lookup_cache('priority', lambda obj, key: obj.priority == key)
+
 @session_wrapper
 def get_priorities(session=None):
     """
@@ -1810,15 +2143,24 @@ def get_section(section, session=None):
     @return: Section object for the given section name
     """
 
+    ret = _section_cache.get(Section, section, session)
+    if ret is not None:
+        return ret
+
     q = session.query(Section).filter_by(section=section)
 
     try:
-        return q.one()
+        ret = q.one()
     except NoResultFound:
         return None
 
+    _section_cache.add(section, ret.section_id)
+    return ret
+
 __all__.append('get_section')
 
+_section_cache = _lookup_cache('section', lambda obj, key: obj.section == key)
+
 @session_wrapper
 def get_sections(session=None):
     """
@@ -2132,29 +2474,129 @@ def get_source_in_suite(source, suite_name, session=None):
 
 __all__.append('get_source_in_suite')
 
-@session_wrapper
-def import_metadata_into_db(obj, session=None):
+_metadata_key_cache = _lookup_cache('metadata_key', lambda obj, key: obj.key == key)
+
+def get_metadatakey_ids(keynames, session):
     """
-    This routine works on either DBBinary or DBSource objects and imports
-    their metadata into the database
+    Returns the ids of the metadata keys with the given names.
+
+    Keys are looked up in a process-wide cache first; unknown keys are
+    fetched with a single query.  Keys that do not exist yet are created and
+    committed in a separate session, so the cached ids stay valid even if
+    the caller's transaction is rolled back.  Metadata keys must therefore
+    not be created in other transactions, see L{get_or_set_metadatakey}.
+
+    @type keynames: iterable of string
+    @param keynames: names of the metadata keys
+
+    @param session: SQL session object
+
+    @rtype: dict
+    @return: mapping of key name to key id
     """
-    fields = obj.read_control_fields()
-    for k in fields.keys():
+    ids = dict()
+    for keyname in set(keynames):
+        ids[keyname] = _metadata_key_cache.get_id(keyname)
+    missing = set(k for k, v in ids.iteritems() if v is None)
+
+    if missing:
+        query = session.query(MetadataKey.key, MetadataKey.key_id).filter(MetadataKey.key.in_(missing))
+        for key, key_id in query:
+            ids[key] = key_id
+        missing = set(k for k, v in ids.iteritems() if v is None)
+
+    if missing:
+        private_session = DBConn().session()
+        try:
+            for keyname in missing:
+                try:
+                    private_session.add(MetadataKey(keyname))
+                    private_session.commit()
+                except IntegrityError:
+                    # Somebody else created the key in the meantime.
+                    private_session.rollback()
+            query = private_session.query(MetadataKey.key, MetadataKey.key_id).filter(MetadataKey.key.in_(missing))
+            for key, key_id in query:
+                ids[key] = key_id
+        finally:
+            private_session.close()
+
+    for key, key_id in ids.iteritems():
+        _metadata_key_cache.add(key, key_id)
+    return ids
+
+__all__.append('get_metadatakey_ids')
+
+def _metadata_value(value):
+    """convert a control field value to a string suitable for the database"""
+    try:
+        # Try raw ASCII
+        return str(value)
+    except UnicodeEncodeError:
+        # Fall back to UTF-8
         try:
-            # Try raw ASCII
-            val = str(fields[k])
+            return value.encode('utf-8')
         except UnicodeEncodeError:
-            # Fall back to UTF-8
-            try:
-                val = fields[k].encode('utf-8')
-            except UnicodeEncodeError:
-                # Finally try iso8859-1
-                val = fields[k].encode('iso8859-1')
-                # Otherwise we allow the exception to percolate up and we cause
-                # a reject as someone is playing silly buggers
+            # Finally try iso8859-1
+            return value.encode('iso8859-1')
+            # Otherwise we allow the exception to percolate up and we cause
+            # a reject as someone is playing silly buggers
+
+def _import_metadata(objs, session):
+    """write metadata rows for C{objs}; the caller commits or flushes"""
+    dbconn = DBConn()
+    session.flush()
+
+    fields_by_obj = [ (obj, obj.read_control_fields()) for obj in objs ]
+    keynames = set()
+    for obj, fields in fields_by_obj:
+        keynames.update(fields.keys())
+    key_ids = get_metadatakey_ids(keynames, session)
+
+    binary_rows = []
+    source_rows = []
+    for obj, fields in fields_by_obj:
+        if isinstance(obj, DBBinary):
+            for k in fields.keys():
+                binary_rows.append(dict(bin_id=obj.binary_id, key_id=key_ids[k], value=_metadata_value(fields[k])))
+        elif isinstance(obj, DBSource):
+            for k in fields.keys():
+                source_rows.append(dict(src_id=obj.source_id, key_id=key_ids[k], value=_metadata_value(fields[k])))
+        else:
+            raise ValueError('Cannot import metadata for {0}'.format(obj))
+
+    for table, id_column, rows in ((dbconn.tbl_binaries_metadata, 'bin_id', binary_rows),
+                                   (dbconn.tbl_source_metadata, 'src_id', source_rows)):
+        if len(rows) == 0:
+            continue
+        ids = set(row[id_column] for row in rows)
+        session.execute(table.delete().where(table.c[id_column].in_(ids)))
+        session.execute(table.insert().values(rows))
 
-        obj.metadata[get_or_set_metadatakey(k, session)] = val
+    # The ORM collections do not know about the new rows yet.
+    for obj, fields in fields_by_obj:
+        session.expire(obj, ['key'])
 
+@session_wrapper
+def import_metadata_into_db_bulk(objs, session=None):
+    """
+    Imports the metadata of several DBBinary and/or DBSource objects.
+
+    All rows for the binaries and for the sources are written with (at most)
+    one INSERT statement each; existing metadata for the objects is replaced.
+    """
+    _import_metadata(objs, session)
+    session.commit_or_flush()
+
+__all__.append('import_metadata_into_db_bulk')
+
+@session_wrapper
+def import_metadata_into_db(obj, session=None):
+    """
+    This routine works on either DBBinary or DBSource objects and imports
+    their metadata into the database
+    """
+    _import_metadata([obj], session)
     session.commit_or_flush()
 
 __all__.append('import_metadata_into_db')
@@ -2298,6 +2740,18 @@ def get_suite(suite, session=None):
     @return: Suite object for the requested suite name (None if not present)
     """
 
+    ret = _suite_cache.get(Suite, suite, session)
+    if ret is not None:
+        return ret
+
+    ret = _get_suite_uncached(suite, session)
+    if ret is not None:
+        _suite_cache.add(suite, ret.suite_id)
+    return ret
+
+__all__.append('get_suite')
+
+def _get_suite_uncached(suite, session):
     # Start by looking for the dak internal name
     q = session.query(Suite).filter_by(suite_name=suite)
     try:
@@ -2319,7 +2773,45 @@ def get_suite(suite, session=None):
     except NoResultFound:
         return None
 
-__all__.append('get_suite')
+_suite_cache = _lookup_cache('suite', lambda obj, key: key in (obj.suite_name, obj.codename, obj.release_suite))
+
+################################################################################
+
+def bump_archive_generation(session):
+    """
+    Advances the archive generation counter and commits.  This must be
+    called after the transaction changing suite contents has been committed
+    so that readers (including those on a read-only replica) never see the
+    new generation together with the old contents.
+
+    @type session: Session
+    @param session: SQL session object
+
+    @rtype: int
+    @return: the new archive generation
+    """
+    generation = session.execute("UPDATE archive_generation SET generation = generation + 1 RETURNING generation").scalar()
+    session.commit()
+    return generation
+
+__all__.append('bump_archive_generation')
+
+@session_wrapper
+def get_archive_generation(session=None):
+    """
+    Returns the current archive generation.  The value changes whenever the
+    contents of any suite change and can be used to validate cached results.
+
+    @type session: Session
+    @param session: Optional SQL session object (a temporary one will be
+    generated if not supplied)
+
+    @rtype: int
+    @return: the current archive generation
+    """
+    return session.execute("SELECT generation FROM archive_generation").scalar()
+
+__all__.append('get_archive_generation')
 
 ################################################################################
 
@@ -2401,6 +2893,10 @@ def get_or_set_uid(uidname, session=None):
     @return: the uid object for the given uidname
     """
 
+    ret = _uid_cache.get(Uid, uidname, session)
+    if ret is not None:
+        return ret
+
     q = session.query(Uid).filter_by(uid=uidname)
 
     try:
@@ -2412,10 +2908,13 @@ def get_or_set_uid(uidname, session=None):
         session.commit_or_flush()
         ret = uid
 
+    _uid_cache.add(uidname, ret.uid_id)
     return ret
 
 __all__.append('get_or_set_uid')
 
+_uid_cache = _lookup_cache('uid', lambda obj, key: obj.uid == key)
+
 @session_wrapper
 def get_uid_from_fingerprint(fpr, session=None):
     q = session.query(Uid)
@@ -2445,32 +2944,29 @@ __all__.append('MetadataKey')
 @session_wrapper
 def get_or_set_metadatakey(keyname, session=None):
     """
-    Returns MetadataKey object for given uidname.
+    Returns MetadataKey object for given keyname.
 
-    If no matching keyname is found, a row is inserted.
+    If no matching keyname is found, a row is inserted and committed in a
+    separate transaction (see L{get_metadatakey_ids}), so the key id can be
+    cached even if the caller's transaction is rolled back.
 
-    @type uidname: string
-    @param uidname: The keyname to add
+    @type keyname: string
+    @param keyname: The keyname to add
 
     @type session: SQLAlchemy
     @param session: Optional SQL session object (a temporary one will be
-    generated if not supplied).  If not passed, a commit will be performed at
-    the end of the function, otherwise the caller is responsible for commiting.
+    generated if not supplied).
 
     @rtype: MetadataKey
     @return: the metadatakey object for the given keyname
     """
 
-    q = session.query(MetadataKey).filter_by(key=keyname)
-
-    try:
-        ret = q.one()
-    except NoResultFound:
-        ret = MetadataKey(keyname)
-        session.add(ret)
-        session.commit_or_flush()
+    ret = _metadata_key_cache.get(MetadataKey, keyname, session)
+    if ret is not None:
+        return ret
 
-    return ret
+    key_id = get_metadatakey_ids([keyname], session)[keyname]
+    return session.query(MetadataKey).get(key_id)
 
 __all__.append('get_or_set_metadatakey')
 
@@ -2955,22 +3451,26 @@ class DBConn(object):
 		reference = relation(Suite, primaryjoin=self.tbl_version_check.c.reference==self.tbl_suite.c.id, lazy='joined')))
 
     ## Connection functions
-    def __createconn(self):
-        from config import Config
-        cnf = Config()
-        if cnf.has_key("DB::Service"):
-            connstr = "postgresql://service=%s" % cnf["DB::Service"]
-        elif cnf.has_key("DB::Host"):
+    def __connstr(self, cnf, prefix):
+        if cnf.has_key(prefix + "::Service"):
+            connstr = "postgresql://service=%s" % cnf[prefix + "::Service"]
+        elif cnf.has_key(prefix + "::Host"):
             # TCP/IP
-            connstr = "postgresql://%s" % cnf["DB::Host"]
-            if cnf.has_key("DB::Port") and cnf["DB::Port"] != "-1":
-                connstr += ":%s" % cnf["DB::Port"]
-            connstr += "/%s" % cnf["DB::Name"]
+            connstr = "postgresql://%s" % cnf[prefix + "::Host"]
+            if cnf.has_key(prefix + "::Port") and cnf[prefix + "::Port"] != "-1":
+                connstr += ":%s" % cnf[prefix + "::Port"]
+            connstr += "/%s" % cnf.get(prefix + "::Name", cnf["DB::Name"])
         else:
             # Unix Socket
-            connstr = "postgresql:///%s" % cnf["DB::Name"]
-            if cnf.has_key("DB::Port") and cnf["DB::Port"] != "-1":
-                connstr += "?port=%s" % cnf["DB::Port"]
+            connstr = "postgresql:///%s" % cnf.get(prefix + "::Name", cnf["DB::Name"])
+            if cnf.has_key(prefix + "::Port") and cnf[prefix + "::Port"] != "-1":
+                connstr += "?port=%s" % cnf[prefix + "::Port"]
+        return connstr
+
+    def __createconn(self):
+        from config import Config
+        cnf = Config()
+        connstr = self.__connstr(cnf, "DB")
 
         engine_args = { 'echo': self.debug }
         if cnf.has_key('DB::PoolSize'):
@@ -3003,26 +3503,112 @@ class DBConn(object):
                                           autoflush=True,
                                           autocommit=False)
 
+            # Optional read-only replica for reporting commands
+            self.db_ro = None
+            self.db_ro_smaker = None
+            self.db_ro_lag = None
+            if any(cnf.has_key("DB::ReadOnly::" + key) for key in ("Service", "Host", "Name")):
+                self.db_ro = create_engine(self.__connstr(cnf, "DB::ReadOnly"), **engine_args)
+                self.db_ro_smaker = sessionmaker(bind=self.db_ro,
+                                                 autoflush=True,
+                                                 autocommit=False)
+                self.db_ro_max_lag = float(cnf.get("DB::ReadOnly::MaxLag", "60"))
+
             self.__setuptables()
             self.__setupmappers()
 
+            if cnf.find_b('DB::QueryStats::Enable'):
+                self.__setupquerystats(cnf)
+                if self.db_ro is not None:
+                    self.__setupquerystats(cnf, self.db_ro)
+
         except OperationalError as e:
             import utils
             utils.fubar("Cannot connect to database (%s)" % str(e))
 
         self.pid = os.getpid()
 
-    def session(self, work_mem = 0):
+    def __setupquerystats(self, cnf, engine=None):
+        import querystats
+        logfile = cnf.get('DB::QueryStats::LogFile') or None
+        log = querystats.SlowQueryLog(logfile)
+        threshold = float(cnf.get('DB::QueryStats::SlowThreshold', '1.0'))
+        querystats.install(engine or self.db_pg, threshold=threshold,
+                           explain=cnf.find_b('DB::QueryStats::Explain'), log=log)
+
+        # Worker processes re-create the connection; their statistics are
+        # collected by DakProcessPool, so only register one summary.
+        if not getattr(self, 'querystats_summary', False):
+            self.querystats_summary = True
+            limit = cnf.find_i('DB::QueryStats::SummaryLimit', 20)
+            pid = os.getpid()
+            def summary():
+                stats = querystats.QueryStats()
+                if os.getpid() == pid and len(stats) > 0:
+                    log.write(stats.format(limit))
+            import atexit
+            atexit.register(summary)
+
+    # seconds to remember the result of a replication lag check
+    replica_lag_check_interval = 10
+
+    def replica_lag(self):
+        '''
+        Returns the replication lag of the read-only replica in seconds, or
+        None if no replica is configured or it cannot be reached.  The
+        result is cached for a few seconds.
+        '''
+        if self.db_ro is None:
+            return None
+        now = datetime.now()
+        if self.db_ro_lag is not None and \
+                now - self.db_ro_lag[0] < timedelta(seconds=self.replica_lag_check_interval):
+            return self.db_ro_lag[1]
+
+        lag = None
+        try:
+            conn = self.db_ro.connect()
+            try:
+                lag = conn.execute('''
+                    SELECT CASE
+                      WHEN pg_last_xlog_receive_location() = pg_last_xlog_replay_location() THEN 0
+                      ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                    END''').scalar()
+            finally:
+                conn.close()
+            lag = float(lag)
+        except DBAPIError:
+            lag = None
+        self.db_ro_lag = (now, lag)
+        return lag
+
+    def session(self, work_mem = 0, readonly = False, max_lag = None):
         '''
         Returns a new session object. If a work_mem parameter is provided a new
         transaction is started and the work_mem parameter is set for this
         transaction. The work_mem parameter is measured in MB. A default value
         will be used if the parameter is not set.
+
+        If readonly is set and a read-only replica is configured in
+        DB::ReadOnly, the session is connected to the replica unless its
+        replication lag exceeds max_lag seconds (default: DB::ReadOnly::MaxLag)
+        or it is unreachable; then the primary server is used.  Commands that
+        need to see their own or very recent changes should not ask for a
+        read-only session.
         '''
         # reinitialize DBConn in new processes
         if self.pid != os.getpid():
             clear_mappers()
             self.__createconn()
+        if readonly and self.db_ro is not None:
+            if max_lag is None:
+                max_lag = self.db_ro_max_lag
+            lag = self.replica_lag()
+            if lag is not None and lag <= max_lag:
+                session = self.db_ro_smaker()
+                if work_mem > 0:
+                    session.execute("SET LOCAL work_mem TO '%d MB'" % work_mem)
+                return session
         session = self.db_smaker()
         if work_mem > 0:
             session.execute("SET LOCAL work_mem TO '%d MB'" % work_mem)
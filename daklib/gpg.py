@@ -20,11 +20,17 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import apt_pkg
+import base64
+import binascii
+import collections
 import datetime
 import errno
 import fcntl
+import hashlib
 import os
 import select
+import struct
+import subprocess
 
 try:
     _MAXFD = os.sysconf("SC_OPEN_MAX")
@@ -34,6 +40,44 @@ except:
 class GpgException(Exception):
     pass
 
+class _VerificationCache(object):
+    """bounded cache of raw GnuPG verification results
+
+    Entries are keyed by the SHA1 of the signed data and the keyrings used
+    (including their size and modification time so updated keyrings are
+    noticed).  The least recently used entries are dropped first.
+    """
+    def __init__(self, size=256):
+        self.size = size
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            result = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries[key] = result
+        self.hits += 1
+        return result
+
+    def add(self, key, result):
+        self._entries.pop(key, None)
+        self._entries[key] = result
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+_verification_cache = _VerificationCache()
+
+def clear_verification_cache():
+    """forget all cached signature verification results"""
+    _verification_cache.clear()
+
 class _Pipe(object):
     """context manager for pipes
 
@@ -58,6 +102,178 @@ class _Pipe(object):
             os.close(self.w)
             self.w = None
 
+def _read_length(data, pos):
+    """read a new-format packet or subpacket length
+
+    @return: tuple of (length, new position)
+    """
+    first = ord(data[pos])
+    if first < 192:
+        return first, pos + 1
+    elif first < 255:
+        return ((first - 192) << 8) + ord(data[pos + 1]) + 192, pos + 2
+    else:
+        return struct.unpack('>I', data[pos + 1:pos + 5])[0], pos + 5
+
+def _packets(data):
+    """iterate over (tag, body) of OpenPGP packets in binary C{data}"""
+    pos = 0
+    while pos < len(data):
+        header = ord(data[pos])
+        if not header & 0x80:
+            raise ValueError('invalid packet header')
+        if header & 0x40:
+            tag = header & 0x3f
+            if ord(data[pos + 1]) >= 224 and ord(data[pos + 1]) < 255:
+                raise ValueError('partial body lengths are not supported')
+            length, pos = _read_length(data, pos + 1)
+        else:
+            tag = (header >> 2) & 0x0f
+            length_type = header & 0x03
+            if length_type == 3:
+                length = len(data) - pos - 1
+                pos += 1
+            else:
+                size = (1, 2, 4)[length_type]
+                length = int(binascii.hexlify(data[pos + 1:pos + 1 + size]), 16)
+                pos += 1 + size
+        body = data[pos:pos + length]
+        if len(body) != length:
+            raise ValueError('truncated packet')
+        yield tag, body
+        pos += length
+
+def _signature_issuers(body):
+    """issuer key ids and fingerprints of a signature packet"""
+    issuers = set()
+    version = ord(body[0])
+    if version == 3:
+        issuers.add(binascii.hexlify(body[7:15]).upper())
+    elif version == 4:
+        pos = 4
+        for area in range(2):
+            length = struct.unpack('>H', body[pos:pos + 2])[0]
+            pos += 2
+            end = pos + length
+            while pos < end:
+                sublength, pos = _read_length(body, pos)
+                subtype = ord(body[pos]) & 0x7f
+                subdata = body[pos + 1:pos + sublength]
+                if subtype == 16:
+                    issuers.add(binascii.hexlify(subdata).upper())
+                elif subtype == 33:
+                    issuers.add(binascii.hexlify(subdata[1:]).upper())
+                pos += sublength
+    else:
+        raise ValueError('unsupported signature version {0}'.format(version))
+    return issuers
+
+def signature_issuers(data):
+    """get issuers of the signatures in a clearsigned message
+
+    This parses the OpenPGP packets of the signature without verifying
+    anything.  It is only meant to cheaply find out which key claims to
+    have made a signature.
+
+    @type  data: str
+    @param data: clearsigned message
+
+    @rtype:  set of str or C{None}
+    @return: upper-case key ids (16 hex digits) and fingerprints (40 hex
+             digits) found in the signatures or C{None} if the signatures
+             could not be parsed
+    """
+    begin = data.find('\n-----BEGIN PGP SIGNATURE-----')
+    end = data.find('\n-----END PGP SIGNATURE-----', begin + 1)
+    if begin == -1 or end == -1:
+        return None
+
+    lines = data[begin:end].splitlines()[2:]
+    # skip armor headers
+    while len(lines) > 0 and lines[0].strip() != '':
+        lines.pop(0)
+    encoded = "".join(line.strip() for line in lines if not line.startswith('='))
+
+    try:
+        binary = base64.b64decode(encoded)
+        issuers = set()
+        for tag, body in _packets(binary):
+            if tag == 2:
+                issuers.update(_signature_issuers(body))
+    except (TypeError, ValueError, IndexError, struct.error):
+        return None
+
+    if len(issuers) == 0:
+        return None
+    return issuers
+
+class KeyringIndex(object):
+    """index of key ids and fingerprints in a set of keyrings
+
+    The index covers primary keys and subkeys.  It is built once with a
+    single gpg run and rebuilt only when one of the keyring files changes.
+    Use L{KeyringIndex.get} to get a shared instance.
+    """
+    _instances = {}
+
+    def __init__(self, keyrings, gpg="/usr/bin/gpg"):
+        self.keyrings = tuple(keyrings)
+        self.gpg = gpg
+        self.stamp = None
+        self.ids = frozenset()
+
+    @classmethod
+    def get(cls, keyrings, gpg="/usr/bin/gpg"):
+        """shared up-to-date index for C{keyrings}
+
+        @rtype: L{KeyringIndex}
+        """
+        key = (tuple(keyrings), gpg)
+        index = cls._instances.get(key)
+        if index is None:
+            index = cls._instances[key] = cls(keyrings, gpg)
+        index.refresh()
+        return index
+
+    def _stamp(self):
+        return tuple((os.stat(k).st_size, os.stat(k).st_mtime) for k in self.keyrings)
+
+    def refresh(self):
+        """rebuild the index if any keyring has changed"""
+        stamp = self._stamp()
+        if stamp == self.stamp:
+            return
+
+        cmd = [self.gpg, "--no-default-keyring", "--batch", "--no-tty",
+               "--with-colons", "--fixed-list-mode",
+               "--fingerprint", "--fingerprint"]
+        for k in self.keyrings:
+            cmd.append("--keyring=%s" % k)
+        cmd.append("--list-keys")
+        devnull = open(os.devnull, 'w')
+        try:
+            output = subprocess.check_output(cmd, stderr=devnull)
+        finally:
+            devnull.close()
+
+        ids = set()
+        for line in output.splitlines():
+            field = line.split(":")
+            if field[0] in ("pub", "sub"):
+                ids.add(field[4].upper())
+            elif field[0] == "fpr":
+                ids.add(field[9].upper())
+
+        self.ids = frozenset(ids)
+        self.stamp = stamp
+
+    def __contains__(self, issuer):
+        return issuer.upper() in self.ids
+
+    def knows_any(self, issuers):
+        """check if any of C{issuers} is in the index"""
+        return any(issuer in self for issuer in issuers)
+
 class SignedFile(object):
     """handle files signed with PGP
 
@@ -67,15 +283,19 @@ class SignedFile(object):
       fingerprint         - fingerprint of the key used for signing
       primary_fingerprint - fingerprint of the primary key associated to the key used for signing
     """
-    def __init__(self, data, keyrings, require_signature=True, gpg="/usr/bin/gpg"):
+    def __init__(self, data, keyrings, require_signature=True, gpg="/usr/bin/gpg", use_cache=True, check_issuer=True):
         """
         @param data: string containing the message
         @param keyrings: sequence of keyrings
         @param require_signature: if True (the default), will raise an exception if no valid signature was found
         @param gpg: location of the gpg binary
+        @param use_cache: if True (the default), reuse the result of an earlier verification of the same data with the same keyrings
+        @param check_issuer: if True (the default) and a signature is required, reject signatures whose issuer is not in any of the keyrings without running gpg
         """
         self.gpg = gpg
         self.keyrings = keyrings
+        self.use_cache = use_cache
+        self.check_issuer = check_issuer
 
         self.valid = False
         self.expired = False
@@ -86,7 +306,69 @@ class SignedFile(object):
 
         self._verify(data, require_signature)
 
+    def _cache_key(self, data):
+        """key for the verification cache or C{None} if caching is not possible"""
+        keyrings = []
+        for k in self.keyrings:
+            try:
+                st = os.stat(k)
+            except OSError:
+                return None
+            keyrings.append((k, st.st_size, st.st_mtime))
+        return (hashlib.sha1(data).hexdigest(), self.gpg, tuple(keyrings))
+
+    def _check_issuer(self, data):
+        """reject signatures by unknown keys without running gpg
+
+        Nothing is rejected if the signature cannot be parsed or the
+        keyrings cannot be indexed; gpg will then decide.
+        """
+        issuers = signature_issuers(data)
+        if issuers is None:
+            return
+        try:
+            index = KeyringIndex.get(self.keyrings, self.gpg)
+        except (OSError, subprocess.CalledProcessError):
+            return
+        if not index.knows_any(issuers):
+            raise GpgException("No valid signature found. Signing key {0} is not in any keyring.".format(", ".join(sorted(issuers))))
+
     def _verify(self, data, require_signature):
+        if require_signature and self.check_issuer:
+            self._check_issuer(data)
+
+        key = None
+        result = None
+        if self.use_cache:
+            key = self._cache_key(data)
+            if key is not None:
+                result = _verification_cache.get(key)
+
+        if result is None:
+            result = self._run_gpg(data)
+            if key is not None:
+                _verification_cache.add(key, result)
+
+        (self.contents, self.status, self.stderr, exit_code) = result
+
+        if self.status == "":
+            raise GpgException("No status output from GPG. (GPG exited with status code %s)\n%s" % (exit_code, self.stderr))
+
+        for line in self.status.splitlines():
+            self._parse_status(line)
+
+        if self.invalid:
+            self.valid = False
+
+        if require_signature and not self.valid:
+            raise GpgException("No valid signature found. (GPG exited with status code %s)\n%s" % (exit_code, self.stderr))
+
+    def _run_gpg(self, data):
+        """run gpg to verify C{data}
+
+        @rtype:  tuple
+        @return: tuple of (contents, status output, stderr, exit code)
+        """
         with _Pipe() as stdin:
          with _Pipe() as contents:
           with _Pipe() as status:
@@ -105,21 +387,7 @@ class SignedFile(object):
 
                 (pid_, exit_code, usage_) = os.wait4(pid, 0)
 
-                self.contents = read[contents.r]
-                self.status   = read[status.r]
-                self.stderr   = read[stderr.r]
-
-                if self.status == "":
-                    raise GpgException("No status output from GPG. (GPG exited with status code %s)\n%s" % (exit_code, self.stderr))
-
-                for line in self.status.splitlines():
-                    self._parse_status(line)
-
-                if self.invalid:
-                    self.valid = False
-
-                if require_signature and not self.valid:
-                    raise GpgException("No valid signature found. (GPG exited with status code %s)\n%s" % (exit_code, self.stderr))
+                return (read[contents.r], read[status.r], read[stderr.r], exit_code)
 
     def _do_io(self, read, write):
         for fd in write.keys():
@@ -46,6 +46,12 @@
 
 ################################################################################
 
+import errno
+import hashlib
+import json
+import os
+import tempfile
+
 from regexes import re_parse_lintian
 
 def parse_lintian_output(output):
@@ -113,3 +119,92 @@ def generate_reject_messages(parsed_tags, tag_definitions, log=lambda *args: arg
                    "override this lintian tag." % tag
             else:
                 log("auto rejecting", "not overridable", tag_name)
+
+def result_cache_key(file_hashes, lintian_version, tags_digest):
+    """
+    Computes the key used to look up cached lintian results.
+
+    >>> result_cache_key([('b', '2'), ('a', '1')], '2.5', 'x') == result_cache_key([('a', '1'), ('b', '2')], '2.5', 'x')
+    True
+
+    @type file_hashes: sequence of (str, str) tuples
+    @param file_hashes: (filename, sha256sum) of every file lintian looks at
+
+    @type lintian_version: string
+    @param lintian_version: version of lintian producing the output
+
+    @type tags_digest: string
+    @param tags_digest: digest of the tags file passed to lintian
+
+    @return: hex digest identifying the lintian run
+    """
+
+    h = hashlib.sha256()
+    h.update("lintian {0}\ntags {1}\n".format(lintian_version, tags_digest))
+    for filename, sha256sum in sorted(file_hashes):
+        h.update("{0} {1}\n".format(sha256sum, filename))
+    return h.hexdigest()
+
+class LintianResultCache(object):
+    """
+    Cache of parsed lintian output.
+
+    Results are always kept in memory for the lifetime of the process. If
+    a directory is given, they are also stored there (one JSON file per key)
+    so later runs can reuse them.
+    """
+
+    def __init__(self, directory=None):
+        """
+        @type directory: string
+        @param directory: optional directory for persistent results
+        """
+        self.directory = directory
+        self._results = {}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """
+        Returns the parsed tags stored for C{key} or C{None}.
+        """
+        if key in self._results:
+            return self._results[key]
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self._path(key), 'r') as fh:
+                tags = json.load(fh)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        except ValueError:
+            # Ignore broken cache entries; they get overwritten later.
+            return None
+
+        self._results[key] = tags
+        return tags
+
+    def set(self, key, tags):
+        """
+        Stores the parsed tags C{tags} for C{key}.
+        """
+        tags = [ dict(tag) for tag in tags ]
+        self._results[key] = tags
+        if self.directory is None:
+            return
+
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o2775)
+
+        # Write to a temporary file first so readers never see partial data.
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(tags, fh)
+        os.chmod(temp_path, 0o664)
+        os.rename(temp_path, path)
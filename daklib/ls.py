@@ -20,6 +20,8 @@
 
 import sqlalchemy.sql as sql
 import daklib.daksql as daksql
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import Text
 
 from daklib.dbconn import DBConn, session_wrapper
 from collections import defaultdict
@@ -28,17 +30,23 @@ from collections import defaultdict
 @session_wrapper
 def list_packages(packages, suites=None, components=None, architectures=None, binary_types=None,
                   source_and_binary=False, regex=False,
-                  format=None, highest=None,
+                  format=None, highest=None, per_package=False,
                   session=None):
     t = DBConn().view_package_list
 
-    comparison_operator = "~" if regex else "="
-
-    where = sql.false()
-    for package in packages:
-        where = where | t.c.package.op(comparison_operator)(package)
+    if regex:
+        where = sql.false()
+        for package in packages:
+            where = where | t.c.package.op("~")(package)
+            if source_and_binary:
+                where = where | t.c.source.op("~")(package)
+    else:
+        # Pass all names as a single array so the statement stays small and
+        # can use the index however many packages are requested.
+        names = sql.func.any(sql.literal(list(packages), type_=ARRAY(Text)))
+        where = t.c.package == names
         if source_and_binary:
-            where = where | t.c.source.op(comparison_operator)(package)
+            where = where | (t.c.source == names)
 
     if suites is not None:
         where = where & t.c.suite.in_(suites)
@@ -71,7 +79,7 @@ def list_packages(packages, suites=None, components=None, architectures=None, bi
             yield format.format(row[t.c.package], row[t.c.version], row[t.c.display_suite], row[c_architectures], lengths=lengths)
     elif format in ('control-suite', 'heidi'):
         query = sql.select([t.c.package, t.c.version, t.c.architecture]).where(where)
-        result = session.execute(query)
+        result = daksql.stream(session, query)
         for row in result:
             yield "{0} {1} {2}".format(row[t.c.package], row[t.c.version], row[t.c.architecture])
     elif format == "python":
@@ -90,14 +98,15 @@ def list_packages(packages, suites=None, components=None, architectures=None, bi
                       t.c.source,
                       t.c.component,
                       t.c.source_version)
-        result = session.execute(query).fetchall()
-
-        if len(result) == 0:
-            raise StopIteration
+        if per_package:
+            query = query.order_by(t.c.package)
 
         val = lambda: defaultdict(val)
         ret = val()
-        for row in result:
+        for row in daksql.stream(session, query):
+            if per_package and len(ret) > 0 and row[t.c.package] not in ret:
+                yield ret
+                ret = val()
             ret[row[t.c.package]] \
                [row[t.c.display_suite]] \
                [row[t.c.version]]={'component':      row[t.c.component],
@@ -106,6 +115,9 @@ def list_packages(packages, suites=None, components=None, architectures=None, bi
                                    'source_version': row[t.c.source_version]
                                }
 
+        if len(ret) == 0:
+            raise StopIteration
+
         yield ret
         return
     else:
@@ -114,7 +126,7 @@ def list_packages(packages, suites=None, components=None, architectures=None, bi
     if highest is not None:
         query = sql.select([t.c.package, sql.func.max(t.c.version)]).where(where) \
                    .group_by(t.c.package).order_by(t.c.package)
-        result = session.execute(query)
+        result = daksql.stream(session, query)
         yield ""
         for row in result:
             yield "{0} ({1} {2})".format(row[0], highest, row[1])
@@ -0,0 +1,230 @@
+"""parallel removal of pool files to the morgue
+
+@contact: Debian FTP Master <ftpmaster@debian.org>
+@license: GPL-2+
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import errno
+import os
+import shutil
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+class RateLimiter(object):
+    """limit throughput to a number of bytes per second
+
+    C{acquire} may be called from several threads.
+
+    @type  rate: float
+    @param rate: bytes per second; C{None} or 0 disables the limit
+    """
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.available = 0.0
+
+    def acquire(self, amount):
+        """wait until C{amount} bytes may be processed"""
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.time()
+            start = max(now, self.available)
+            self.available = start + float(amount) / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+class MorgueJournal(object):
+    """record pending filesystem operations
+
+    Before a batch of files is moved, the planned moves are written to the
+    journal.  The journal is cleared once the corresponding database rows
+    were deleted.  If a run was interrupted, L{reconcile} cleans up after
+    moves that did not complete.
+
+    @type  filename: str
+    @param filename: journal file
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+    def write(self, moves):
+        """record planned moves
+
+        @type  moves: list of (str, str) tuples
+        @param moves: source and destination for each move; destination is
+                      C{None} for files that are simply removed
+        """
+        tmp = self.filename + '.new'
+        with open(tmp, 'w') as fh:
+            for src, dest in moves:
+                fh.write("{0}\t{1}\n".format(src, dest or ''))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.rename(tmp, self.filename)
+
+    def clear(self):
+        """forget recorded moves after they were committed"""
+        try:
+            os.unlink(self.filename)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def reconcile(self):
+        """clean up after an interrupted run
+
+        A move copies the file and removes the source last.  If the source
+        still exists, the destination may be incomplete and is removed.  If
+        the source is gone, the move completed; the database row is removed
+        later as it refers to a non-existing file.
+
+        @rtype:  list of lists
+        @return: log entries describing what was done
+        """
+        if not os.path.exists(self.filename):
+            return []
+        log = []
+        with open(self.filename) as fh:
+            for line in fh:
+                src, dest = line.rstrip('\n').split('\t', 1)
+                if dest and os.path.lexists(src) and os.path.lexists(dest):
+                    os.unlink(dest)
+                    log.append(["removed incomplete morgue file", dest])
+                elif not os.path.lexists(src):
+                    log.append(["removal completed before interruption", src])
+        self.clear()
+        return log
+
+def _move(src, dest, perms=0o664):
+    dest_dir = os.path.dirname(dest)
+    if not os.path.lexists(dest_dir):
+        umask = os.umask(00000)
+        try:
+            os.makedirs(dest_dir, 0o2775)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        finally:
+            os.umask(umask)
+    try:
+        os.rename(src, dest)
+        os.chmod(dest, perms)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copy2(src, dest)
+        os.chmod(dest, perms)
+        os.unlink(src)
+
+class FileRemover(object):
+    """remove or move files using a bounded thread pool
+
+    @type  threads: int
+    @param threads: number of worker threads
+
+    @type  rate: float
+    @param rate: maximum bytes per second (C{None} for no limit)
+
+    @type  no_action: bool
+    @param no_action: only collect statistics, do not touch any file
+    """
+    def __init__(self, threads=1, rate=None, no_action=False):
+        self.threads = max(1, threads)
+        self.limiter = RateLimiter(rate)
+        self.no_action = no_action
+        self.reserved = set()
+        self.count = 0
+        self.bytes = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+    def reserve(self, dest, too_many=100):
+        """find an unused destination filename
+
+        Like L{daklib.utils.find_next_free}, but also avoids names already
+        handed out for files that were not moved yet.
+        """
+        candidate = dest
+        extra = 0
+        while os.path.lexists(candidate) or candidate in self.reserved:
+            if extra >= too_many:
+                raise OSError(errno.EEXIST, "no free filename", dest)
+            candidate = "{0}.{1}".format(dest, extra)
+            extra += 1
+        self.reserved.add(candidate)
+        return candidate
+
+    def _remove(self, job):
+        key, src, dest = job
+        try:
+            if os.path.islink(src):
+                size = 0
+            else:
+                size = os.stat(src).st_size
+            if not self.no_action:
+                self.limiter.acquire(size)
+                if dest is None:
+                    os.unlink(src)
+                else:
+                    _move(src, dest)
+            return (key, src, dest, size, None)
+        except Exception as e:
+            return (key, src, dest, 0, str(e))
+
+    def run(self, jobs):
+        """process a batch of files
+
+        @type  jobs: list of tuples
+        @param jobs: C{(key, source, destination)} tuples; destination is
+                     C{None} to remove the file
+
+        @rtype:  list of tuples
+        @return: C{(key, source, destination, size, error)} for each job;
+                 C{error} is C{None} on success
+        """
+        start = time.time()
+        if self.threads == 1 or len(jobs) < 2:
+            results = [ self._remove(job) for job in jobs ]
+        else:
+            pool = ThreadPool(min(self.threads, len(jobs)))
+            try:
+                results = pool.map(self._remove, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        self.seconds += time.time() - start
+
+        for key, src, dest, size, error in results:
+            if error is None:
+                self.count += 1
+                self.bytes += size
+            else:
+                self.failed += 1
+        return results
+
+    def summary(self):
+        """throughput summary
+
+        @rtype:  str
+        """
+        seconds = max(self.seconds, 0.001)
+        return "{0} files, {1} bytes in {2:.1f}s ({3:.1f} files/s, {4:.1f} MB/s), {5} failed".format(
+            self.count, self.bytes, self.seconds, self.count / seconds,
+            self.bytes / seconds / 1024 / 1024, self.failed)
@@ -17,7 +17,7 @@
 """module to process policy queue uploads"""
 
 from .config import Config
-from .dbconn import BinaryMetadata, Component, MetadataKey, Override, OverrideType, Suite, get_mapped_component
+from .dbconn import BinaryMetadata, Component, MetadataKey, Override, OverrideResolver, OverrideType, Suite, get_mapped_component
 from .fstransactions import FilesystemTransaction
 from .regexes import re_file_changes, re_file_safe
 from .packagelist import PackageList
@@ -134,30 +134,38 @@ class PolicyQueueUploadHandler(object):
         """
         self.upload = upload
         self.session = session
+        self._overrides = None
+
+    @property
+    def _override_resolver(self):
+        if self._overrides is None:
+            package_names = set(binary.package for binary in self.upload.binaries)
+            source = self.upload.source
+            if source is not None:
+                package_names.add(source.source)
+                package_list = PackageList(source.proxy)
+                package_names.update(entry.name for entry in package_list.package_list)
+            self._overrides = OverrideResolver(self.session, package_names)
+        return self._overrides
 
     @property
     def _overridesuite(self):
-        overridesuite = self.upload.target_suite
-        if overridesuite.overridesuite is not None:
-            overridesuite = self.session.query(Suite).filter_by(suite_name=overridesuite.overridesuite).one()
-        return overridesuite
+        return self._override_resolver.override_suite(self.upload.target_suite)
 
     def _source_override(self, component_name):
         package = self.upload.source.source
         suite = self._overridesuite
-        component = get_mapped_component(component_name, self.session)
-        query = self.session.query(Override).filter_by(package=package, suite=suite) \
-            .join(OverrideType).filter(OverrideType.overridetype == 'dsc') \
-            .filter(Override.component == component)
-        return query.first()
+        component = self._override_resolver.mapped_component(component_name)
+        if component is None:
+            return None
+        return self._override_resolver.get(suite, package, 'dsc', component)
 
     def _binary_override(self, name, binarytype, component_name):
         suite = self._overridesuite
-        component = get_mapped_component(component_name, self.session)
-        query = self.session.query(Override).filter_by(package=name, suite=suite) \
-            .join(OverrideType).filter(OverrideType.overridetype == binarytype) \
-            .filter(Override.component == component)
-        return query.first()
+        component = self._override_resolver.mapped_component(component_name)
+        if component is None:
+            return None
+        return self._override_resolver.get(suite, name, binarytype, component)
 
     @property
     def _changes_prefix(self):
@@ -239,6 +247,9 @@ class PolicyQueueUploadHandler(object):
 
                  All values are strings.
         """
+        # Overrides might have been added since the last call.
+        self._overrides = None
+
         # TODO: use Package-List field
         missing = []
         components = set()
@@ -0,0 +1,215 @@
+"""SQL statement statistics and slow-query log
+
+@contact: Debian FTP Master <ftpmaster@debian.org>
+@license: GPL-2+
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import re
+import sys
+import threading
+import time
+
+re_whitespace = re.compile(r'\s+')
+re_string_literal = re.compile(r"'(?:[^']|'')*'")
+re_number_literal = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+re_placeholder = re.compile(r'%\(\w+\)s|%s|\?|(?<!:):\w+')
+re_in_list = re.compile(r'\bIN \((?:\?, )*\?\)', re.IGNORECASE)
+re_select = re.compile(r'\s*SELECT\b', re.IGNORECASE)
+
+def normalise_statement(statement):
+    """normalise a SQL statement for aggregation
+
+    Whitespace is collapsed, literals and bind parameters are replaced by
+    C{?} and C{IN} lists of any length are collapsed to C{IN (...)}.
+
+    @type  statement: str
+    @param statement: SQL statement
+
+    @rtype:  str
+    """
+    statement = re_whitespace.sub(' ', statement).strip()
+    statement = re_string_literal.sub('?', statement)
+    statement = re_placeholder.sub('?', statement)
+    statement = re_number_literal.sub('?', statement)
+    statement = re_in_list.sub('IN (...)', statement)
+    return statement
+
+class QueryStats(object):
+    """per-process statistics of executed SQL statements
+
+    Statistics are kept per normalised statement as a list
+    C{[count, total seconds, max seconds, rows]}.
+    """
+    __shared_state = {}
+
+    def __init__(self, *args, **kwargs):
+        self.__dict__ = self.__shared_state
+
+        if not getattr(self, 'initialised', False):
+            self.initialised = True
+            self.lock = threading.Lock()
+            self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.statements = dict()
+
+    def record(self, statement, seconds, rows):
+        """record an executed statement
+
+        @type  statement: str
+        @param statement: SQL statement (will be normalised)
+
+        @type  seconds: float
+        @param seconds: execution time
+
+        @type  rows: int
+        @param rows: number of rows returned or affected; negative values are
+                     ignored
+        """
+        key = normalise_statement(statement)
+        with self.lock:
+            entry = self.statements.setdefault(key, [0, 0.0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            if rows > 0:
+                entry[3] += rows
+
+    def snapshot(self):
+        """copy of the statistics suitable for pickling
+
+        @rtype:  dict
+        """
+        with self.lock:
+            return dict( (k, list(v)) for k, v in self.statements.iteritems() )
+
+    def merge(self, statements):
+        """add statistics collected elsewhere, for example in a worker process
+
+        @type  statements: dict
+        @param statements: result of L{snapshot}
+        """
+        with self.lock:
+            for key, other in statements.iteritems():
+                entry = self.statements.setdefault(key, [0, 0.0, 0.0, 0])
+                entry[0] += other[0]
+                entry[1] += other[1]
+                entry[2] = max(entry[2], other[2])
+                entry[3] += other[3]
+
+    def __len__(self):
+        return len(self.statements)
+
+    def rows(self, limit=None):
+        """statements ordered by total time spent
+
+        @rtype:  list of tuples
+        @return: C{(statement, count, total, max, rows)} tuples
+        """
+        with self.lock:
+            rows = [ (k,) + tuple(v) for k, v in self.statements.iteritems() ]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        if limit is not None:
+            rows = rows[:limit]
+        return rows
+
+    def format(self, limit=20):
+        """format summary as a human-readable table
+
+        @rtype:  str
+        """
+        lines = ["{0:>7} {1:>9} {2:>8} {3:>9}  {4}".format('count', 'total', 'max', 'rows', 'statement')]
+        for statement, count, total, maximum, rows in self.rows(limit):
+            lines.append("{0:>7} {1:>9.3f} {2:>8.3f} {3:>9}  {4}".format(count, total, maximum, rows, statement))
+        return "\n".join(lines)
+
+class SlowQueryLog(object):
+    """write slow statements to a file
+
+    @type  filename: str
+    @param filename: file to append to; C{None} writes to stderr
+    """
+    def __init__(self, filename=None):
+        self.filename = filename
+
+    def write(self, text):
+        prefix = "{0} {1}[{2}]: ".format(time.strftime("%Y-%m-%d %H:%M:%S"), os.path.basename(sys.argv[0]), os.getpid())
+        lines = [ prefix + line for line in text.splitlines() ]
+        if self.filename is None:
+            sys.stderr.write("\n".join(lines) + "\n")
+        else:
+            with open(self.filename, 'a') as fh:
+                fh.write("\n".join(lines) + "\n")
+
+def _explain(cursor, statement, parameters):
+    # Use a savepoint so a failing EXPLAIN does not abort the transaction.
+    c = cursor.connection.cursor()
+    try:
+        c.execute("SAVEPOINT dak_explain")
+        try:
+            c.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+            plan = "\n".join(row[0] for row in c.fetchall())
+            c.execute("RELEASE SAVEPOINT dak_explain")
+            return plan
+        except Exception as e:
+            c.execute("ROLLBACK TO SAVEPOINT dak_explain")
+            return "EXPLAIN failed: {0}".format(e)
+    finally:
+        c.close()
+
+def install(engine, threshold=1.0, explain=False, log=None):
+    """install statement instrumentation on an engine
+
+    Every statement is recorded in L{QueryStats}.  Statements running longer
+    than C{threshold} seconds are written to C{log} together with their
+    parameters.  If C{explain} is set, the output of
+    C{EXPLAIN (ANALYZE, BUFFERS)} is written as well; this executes the
+    statement a second time, so it is only done for SELECT statements.
+
+    @type  engine: C{sqlalchemy.engine.Engine}
+
+    @type  threshold: float
+    @param threshold: slow-query threshold in seconds
+
+    @type  explain: bool
+    @param explain: log query plans of slow SELECT statements
+
+    @type  log: L{SlowQueryLog}
+    @param log: where to write slow statements to (default: stderr)
+    """
+    from sqlalchemy import event
+
+    stats = QueryStats()
+    if log is None:
+        log = SlowQueryLog()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('dak_query_start', []).append(time.time())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.time() - conn.info['dak_query_start'].pop()
+        stats.record(statement, seconds, cursor.rowcount)
+        if seconds >= threshold:
+            text = "slow query ({0:.3f}s, {1} rows): {2}\nparameters: {3!r}".format(seconds, cursor.rowcount, statement, parameters)
+            if explain and not executemany and re_select.match(statement):
+                text += "\n" + _explain(cursor, statement, parameters)
+            log.write(text)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
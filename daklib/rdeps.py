@@ -0,0 +1,438 @@
+"""reverse dependency index for removals
+
+@contact: Debian FTP Master <ftpmaster@debian.org>
+@license: GPL-2+
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import apt_pkg
+import cPickle
+import os
+import re
+import sys
+
+from daklib.config import Config
+from daklib.dbconn import Component, Override, OverrideType, get_architecture, \
+    get_or_set_metadatakey, get_suite
+from daklib.regexes import re_build_dep_arch
+
+FORMAT_VERSION = 1
+"""version of the on-disk index; an index with a different version is
+rebuilt from scratch"""
+
+class _Architecture(object):
+    """index of Depends and Provides of one architecture"""
+    def __init__(self):
+        self.packages = dict()
+        """package name to (source, component)"""
+        self.groups = []
+        """list of (package, names) tuples, one per OR group of a Depends"""
+        self.dependents = dict()
+        """package name to indices into groups mentioning it"""
+        self.providers = dict()
+        """virtual package to set of providing packages"""
+        self.provides = dict()
+        """package name to list of virtual packages it provides"""
+
+    def add(self, entry):
+        package, source, component, groups, provides = entry
+        self.packages[package] = (source, component)
+        for names in groups:
+            index = len(self.groups)
+            self.groups.append((package, names))
+            for name in names:
+                self.dependents.setdefault(name, []).append(index)
+        for virtual_pkg in provides:
+            self.providers.setdefault(virtual_pkg, set()).add(package)
+            self.provides.setdefault(package, []).append(virtual_pkg)
+
+class ReverseDependencyGraph(object):
+    """reverse dependencies of all packages in a suite
+
+    Depends and Provides are parsed only once per binary, Build-Depends and
+    Build-Depends-Indep once per source, and kept per association id.  The
+    first time an architecture (or the sources) is used in a process, the
+    association ids of the suite are compared with the known ones: only new
+    associations are loaded from the database and parsed, removed ones are
+    dropped.
+
+    Each OR group of a dependency is indexed by all package names it
+    mentions, so checking a set of removals only looks at the groups that
+    mention one of the removed packages.
+
+    The parsed dependencies can be persisted with L{save} and L{load}.  Use
+    L{get_reverse_dependency_graph} to get a graph backed by the database
+    and the on-disk index.
+
+    @type  suite_id: int
+    @param suite_id: id of the suite
+
+    @type  overridesuite_id: int
+    @param overridesuite_id: id of the suite holding the overrides
+
+    @param session: database session used to load data; if C{None}, only
+                    packages added with L{add_binary} and L{add_source} are
+                    used
+    """
+    def __init__(self, suite_id=None, overridesuite_id=None, session=None):
+        self.session = session
+        self.suite_id = suite_id
+        self.overridesuite_id = overridesuite_id
+        self.filename = None
+        """file written by L{save}"""
+        self.dirty = False
+        """whether data changed since the last L{load} or L{save}"""
+        self._binaries = dict()
+        self._sources = dict()
+        self._arches = dict()
+        self._synced = set()
+        self._source_groups = None
+        self._source_dependents = None
+        self._source_components = dict()
+        self._source_components_loaded = False
+
+    def add_binary(self, architecture, assoc_id, package, source, component, depends, provides):
+        """add a binary package to the index
+
+        @type  assoc_id: int
+        @param assoc_id: id of the association in bin_associations
+
+        @type  depends: str
+        @param depends: Depends field or C{None}
+
+        @type  provides: str
+        @param provides: Provides field or C{None}
+        """
+        groups = []
+        if depends is not None:
+            try:
+                parsed = apt_pkg.parse_depends(depends)
+            except ValueError as e:
+                print "Error for package %s: %s" % (package, e)
+                parsed = []
+            for dep in parsed:
+                groups.append(tuple(set(dep_package for dep_package, _, _ in dep)))
+        virtual_pkgs = []
+        if provides is not None:
+            for virtual_pkg in provides.split(","):
+                virtual_pkg = virtual_pkg.strip()
+                if virtual_pkg == package: continue
+                virtual_pkgs.append(virtual_pkg)
+        self._binaries.setdefault(architecture, dict())[assoc_id] = \
+            (package, source, component, tuple(groups), tuple(virtual_pkgs))
+        self._arches.pop(architecture, None)
+        self.dirty = True
+
+    def add_source(self, assoc_id, source, build_depends, component=None):
+        """add a source package to the index
+
+        @type  assoc_id: int
+        @param assoc_id: id of the association in src_associations
+
+        @type  build_depends: str
+        @param build_depends: Build-Depends and Build-Depends-Indep, joined
+                              with commas
+
+        @type  component: str
+        @param component: component of the source; looked up in the
+                          overrides when needed if not given
+        """
+        if component is not None:
+            self._source_components[source] = component
+        groups = []
+        if build_depends is not None:
+            # Remove [arch] information since we want to see breakage on all arches
+            build_depends = re_build_dep_arch.sub("", build_depends)
+            try:
+                parsed = apt_pkg.parse_depends(build_depends)
+            except ValueError as e:
+                print "Error for source %s: %s" % (source, e)
+                parsed = []
+            for dep in parsed:
+                groups.append(tuple(tuple(atom) for atom in dep))
+        self._sources[assoc_id] = (source, tuple(groups))
+        self._source_groups = None
+        self.dirty = True
+
+    def _sync(self, entries, current, statement, params):
+        """drop removed associations from C{entries} and fetch new ones
+
+        C{statement} must contain a C{{condition}} placeholder that is
+        replaced to restrict the result to the new associations.
+
+        @rtype:  list
+        @return: rows for associations not known yet
+        """
+        gone = set(entries) - current
+        for assoc_id in gone:
+            del entries[assoc_id]
+        if gone:
+            self.dirty = True
+        missing = current - set(entries)
+        if not missing:
+            return []
+        condition = ''
+        if len(entries) > 0:
+            condition = 'AND a.id IN :assoc_ids'
+            params = dict(params, assoc_ids=tuple(missing))
+        return self.session.execute(statement.format(condition=condition), params).fetchall()
+
+    def _sync_architecture(self, architecture):
+        entries = self._binaries.setdefault(architecture, dict())
+        params = {
+            'suite_id':     self.suite_id,
+            'arch_id':      get_architecture(architecture, self.session).arch_id,
+        }
+        current = set(assoc_id for assoc_id, in self.session.execute('''
+            SELECT a.id FROM bin_associations a JOIN binaries b ON a.bin = b.id
+             WHERE a.suite = :suite_id AND b.architecture = :arch_id''', params))
+        params['metakey_d_id'] = get_or_set_metadatakey("Depends", self.session).key_id
+        params['metakey_p_id'] = get_or_set_metadatakey("Provides", self.session).key_id
+        statement = '''
+            SELECT a.id, b.package, s.source, c.name as component,
+                (SELECT bmd.value FROM binaries_metadata bmd WHERE bmd.bin_id = b.id AND bmd.key_id = :metakey_d_id) AS depends,
+                (SELECT bmp.value FROM binaries_metadata bmp WHERE bmp.bin_id = b.id AND bmp.key_id = :metakey_p_id) AS provides
+                FROM binaries b
+                JOIN bin_associations a ON b.id = a.bin AND a.suite = :suite_id
+                JOIN source s ON b.source = s.id
+                JOIN files_archive_map af ON b.file = af.file_id
+                JOIN component c ON af.component_id = c.id
+                WHERE b.architecture = :arch_id {condition}'''
+        for row in self._sync(entries, current, statement, params):
+            self.add_binary(architecture, *row)
+        self._arches.pop(architecture, None)
+
+    def _sync_sources(self):
+        params = {'suite_id': self.suite_id}
+        current = set(assoc_id for assoc_id, in self.session.execute(
+            'SELECT id FROM src_associations WHERE suite = :suite_id', params))
+        params['metakey_ids'] = (get_or_set_metadatakey("Build-Depends", self.session).key_id,
+                                 get_or_set_metadatakey("Build-Depends-Indep", self.session).key_id)
+        statement = '''
+            SELECT a.id, s.source, string_agg(sm.value, ', ') as build_dep
+               FROM src_associations a
+               JOIN source s ON a.source = s.id
+               LEFT JOIN source_metadata sm ON s.id = sm.src_id AND sm.key_id in :metakey_ids
+               WHERE a.suite = :suite_id {condition}
+               GROUP BY a.id, s.source'''
+        for row in self._sync(self._sources, current, statement, params):
+            self.add_source(*row)
+        self._source_groups = None
+
+    def _architecture(self, architecture):
+        if architecture not in self._synced:
+            if self.session is not None:
+                self._sync_architecture(architecture)
+            self._synced.add(architecture)
+        if architecture not in self._arches:
+            data = _Architecture()
+            for entry in self._binaries.get(architecture, dict()).itervalues():
+                data.add(entry)
+            self._arches[architecture] = data
+        return self._arches[architecture]
+
+    def _source_index(self):
+        if 'source' not in self._synced:
+            if self.session is not None:
+                self._sync_sources()
+            self._synced.add('source')
+        if self._source_groups is None:
+            self._source_groups = []
+            self._source_dependents = dict()
+            for source, groups in self._sources.itervalues():
+                for dep in groups:
+                    index = len(self._source_groups)
+                    self._source_groups.append((source, dep))
+                    for name in set(dep_package for dep_package, _, _ in dep):
+                        self._source_dependents.setdefault(name, []).append(index)
+        return self._source_groups, self._source_dependents
+
+    def load(self, filename):
+        """load parsed dependencies written by L{save}
+
+        Further calls to L{save} write to C{filename}.  A missing, unreadable
+        or outdated file is ignored.
+
+        @type  filename: str
+        @param filename: index file
+
+        @rtype:  bool
+        @return: C{True} if the index was loaded
+        """
+        self.filename = filename
+        try:
+            with open(filename, 'rb') as fh:
+                data = cPickle.load(fh)
+        except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+            return False
+        if data.get('version') != FORMAT_VERSION or data.get('suite_id') != self.suite_id:
+            return False
+        self._binaries = data['binaries']
+        self._sources = data['sources']
+        self._arches = dict()
+        self._synced = set()
+        self._source_groups = None
+        self.dirty = False
+        return True
+
+    def save(self):
+        """write parsed dependencies to the file given to L{load}
+
+        Nothing is written if nothing changed.  Failing to write the index
+        only prints a warning as the index can always be rebuilt.
+        """
+        if self.filename is None or not self.dirty:
+            return
+        data = {
+            'version':  FORMAT_VERSION,
+            'suite_id': self.suite_id,
+            'binaries': self._binaries,
+            'sources':  self._sources,
+        }
+        tmp = "{0}.{1}.new".format(self.filename, os.getpid())
+        try:
+            with open(tmp, 'wb') as fh:
+                cPickle.dump(data, fh, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.filename)
+        except (IOError, OSError) as e:
+            sys.stderr.write("W: Could not write reverse dependency index {0}: {1}\n".format(self.filename, e))
+            return
+        self.dirty = False
+
+    def expand_removals(self, removals, architecture):
+        """add virtual packages that are only provided by removed packages
+
+        @type  removals: set
+        @param removals: names of packages to remove
+
+        @rtype:  set
+        @return: C{removals} plus virtual packages that are no longer provided
+                 on C{architecture}
+        """
+        data = self._architecture(architecture)
+        removed = set(removals)
+        for package in removals:
+            for virtual_pkg in data.provides.get(package, ()):
+                if data.providers[virtual_pkg] <= removals:
+                    removed.add(virtual_pkg)
+        return removed
+
+    def broken_depends(self, removals, architectures):
+        """find packages whose Depends would no longer be satisfiable
+
+        A dependency is only broken if all alternatives of an OR group are
+        removed.
+
+        @type  removals: iterable
+        @param removals: names of packages to remove
+
+        @type  architectures: iterable
+        @param architectures: architectures to check
+
+        @rtype:  tuple
+        @return: C{(broken, removed)}: C{broken} maps (source, component)
+                 to a dict of binary package to set of architectures;
+                 C{removed} are the removals including virtual packages no
+                 longer provided on some architecture
+        """
+        removals = set(removals)
+        broken = dict()
+        all_removed = set(removals)
+        for architecture in architectures:
+            data = self._architecture(architecture)
+            removed = self.expand_removals(removals, architecture)
+            all_removed.update(removed)
+            candidates = set()
+            for name in removed:
+                candidates.update(data.dependents.get(name, ()))
+            for index in candidates:
+                package, names = data.groups[index]
+                if package in removed:
+                    continue
+                if all(name in removed for name in names):
+                    source, component = data.packages[package]
+                    broken.setdefault((source, component), {}).setdefault(package, set()).add(architecture)
+        return broken, all_removed
+
+    def broken_build_depends(self, removals):
+        """find sources whose build dependencies would be broken
+
+        @type  removals: iterable
+        @param removals: names of packages to remove, including virtual
+                         packages (see L{broken_depends})
+
+        @rtype:  dict
+        @return: (source, component) to set of broken dependencies; each
+                 dependency is a tuple of C{(package, version, relation)}
+                 alternatives
+        """
+        source_groups, source_dependents = self._source_index()
+        removals = set(removals)
+        broken = dict()
+        candidates = set()
+        for name in removals:
+            candidates.update(source_dependents.get(name, ()))
+        for index in candidates:
+            source, dep = source_groups[index]
+            if source in removals:
+                continue
+            if all(dep_package in removals for dep_package, _, _ in dep):
+                broken.setdefault(source, set()).add(dep)
+        if broken and self.session is not None and not self._source_components_loaded:
+            self._load_source_components()
+        return dict( ((source, self._source_components.get(re.sub('/(contrib|non-free)$', '', source))), deps)
+                     for source, deps in broken.iteritems() )
+
+    def _load_source_components(self):
+        """load the components of all sources from the override suite
+
+        This is a single query instead of one per source with broken build
+        dependencies.
+        """
+        query = self.session.query(Override.package, Component.component_name) \
+            .join(Override.component) \
+            .join(Override.overridetype).filter(OverrideType.overridetype == 'dsc') \
+            .filter(Override.suite_id == self.overridesuite_id)
+        for package, component in query:
+            self._source_components.setdefault(package, component)
+        self._source_components_loaded = True
+
+_graphs = dict()
+
+def get_reverse_dependency_graph(suite, session):
+    """get the shared L{ReverseDependencyGraph} for C{suite}
+
+    The graph is built once per process and suite.  C{session} replaces the
+    session used for loading further data.
+
+    If C{Dir::RdepsIndex} is set, the parsed dependencies are loaded from
+    and (with L{ReverseDependencyGraph.save}) written to an index file per
+    suite in this directory, so only associations changed since the index
+    was last written have to be loaded and parsed.
+    """
+    graph = _graphs.get(suite)
+    if graph is None:
+        dbsuite = get_suite(suite, session)
+        overridesuite = dbsuite
+        if dbsuite.overridesuite is not None:
+            overridesuite = get_suite(dbsuite.overridesuite, session)
+        graph = ReverseDependencyGraph(dbsuite.suite_id, overridesuite.suite_id, session)
+        index_dir = Config().get('Dir::RdepsIndex')
+        if index_dir:
+            graph.load(os.path.join(index_dir, "{0}.rdeps".format(dbsuite.suite_name)))
+        _graphs[suite] = graph
+    graph.session = session
+    return graph
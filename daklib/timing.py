@@ -0,0 +1,171 @@
+"""timing instrumentation for the upload pipeline
+
+@contact: Debian FTP Master <ftpmaster@debian.org>
+@license: GPL-2+
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import time
+from collections import deque
+
+class PhaseTimer(object):
+    """measure the time spent in named phases
+
+    Phases are recorded in the order they were first entered.  Entering a
+    phase a second time (for example a per-suite check run for several
+    suites) adds to the time already recorded for it.
+
+    Use the C{measure} method as a context manager::
+
+       timer = PhaseTimer()
+       with timer.measure('SignatureAndHashesCheck'):
+           ...
+    """
+    def __init__(self):
+        self.names = []
+        """phase names in the order they were first seen
+        @type: list of str
+        """
+
+        self.durations = dict()
+        """seconds spent per phase
+        @type: dict of str to float
+        """
+
+    def add(self, name, seconds):
+        """add time to a phase
+
+        @type  name: str
+        @param name: name of the phase
+
+        @type  seconds: float
+        @param seconds: time spent in seconds
+        """
+        if name not in self.durations:
+            self.names.append(name)
+            self.durations[name] = 0.0
+        self.durations[name] += seconds
+
+    def measure(self, name):
+        """context manager recording the time spent in its body
+
+        Time is also recorded when the body raises an exception.
+
+        @type  name: str
+        @param name: name of the phase
+        """
+        return _Measurement(self, name)
+
+    @property
+    def total(self):
+        """total time spent in all phases"""
+        return sum(self.durations.itervalues())
+
+    def items(self):
+        """list of (name, seconds) tuples in the order phases were seen"""
+        return [ (name, self.durations[name]) for name in self.names ]
+
+    def log_fields(self):
+        """fields suitable for L{daklib.daklog.Logger.log}
+
+        @rtype:  list of str
+        @return: one C{name=seconds} field per phase
+        """
+        return [ "{0}={1:.3f}".format(name, seconds) for name, seconds in self.items() ]
+
+class _Measurement(object):
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.start = None
+    def __enter__(self):
+        self.start = time.time()
+        return self
+    def __exit__(self, type, value, traceback):
+        self.timer.add(self.name, time.time() - self.start)
+        return False
+
+def percentile(values, p):
+    """nearest-rank percentile
+
+    @type  values: sequence of float
+    @param values: values to look at (need not be sorted)
+
+    @type  p: float
+    @param p: percentile to compute (0 < p <= 100)
+
+    @rtype:  float or C{None}
+    @return: percentile of C{values} or C{None} if C{values} is empty
+    """
+    if len(values) == 0:
+        return None
+    ordered = sorted(values)
+    rank = int(-(-p * len(ordered) // 100))
+    rank = max(1, min(rank, len(ordered)))
+    return ordered[rank - 1]
+
+class TimingSummary(object):
+    """collect phase timings over a batch of uploads
+
+    If C{window} is given, only the last C{window} samples of each phase are
+    kept, so long-running processes do not grow without bound.
+    """
+    def __init__(self, window=None):
+        self.names = []
+        self.samples = dict()
+        self.window = window
+
+    def add(self, timer):
+        """add all phases recorded by a L{PhaseTimer}"""
+        for name, seconds in timer.items():
+            if name not in self.samples:
+                self.names.append(name)
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(seconds)
+
+    def __len__(self):
+        return len(self.names)
+
+    def rows(self, percentiles=(50, 90, 99)):
+        """summary rows
+
+        @rtype:  list of tuples
+        @return: one C{(name, count, total, p1, p2, ..., max)} tuple per phase
+        """
+        rows = []
+        for name in self.names:
+            values = self.samples[name]
+            row = [name, len(values), sum(values)]
+            row.extend(percentile(values, p) for p in percentiles)
+            row.append(max(values))
+            rows.append(tuple(row))
+        return rows
+
+    def format(self, percentiles=(50, 90, 99)):
+        """format summary as a human-readable table
+
+        @rtype:  str
+        """
+        width = max([len('phase')] + [ len(name) for name in self.names ])
+        header = ["{0:<{1}}".format('phase', width), "{0:>6}".format('count'), "{0:>9}".format('total')]
+        header.extend("{0:>8}".format('p{0}'.format(p)) for p in percentiles)
+        header.append("{0:>8}".format('max'))
+        lines = [" ".join(header)]
+        for row in self.rows(percentiles):
+            fields = ["{0:<{1}}".format(row[0], width), "{0:>6}".format(row[1]), "{0:>9.3f}".format(row[2])]
+            fields.extend("{0:>8.3f}".format(v) for v in row[3:])
+            lines.append(" ".join(fields))
+        return "\n".join(lines)
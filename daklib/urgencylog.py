@@ -88,8 +88,16 @@ class UrgencyLog(object):
         self.log_file.close()
 
         if self.writes:
+            # Long-running programs may close more than one log per second.
             new_filename = "%s/install-urgencies-%s" % (self.log_dir, self.timestamp)
+            suffix = 0
+            while os.path.exists(new_filename):
+                suffix += 1
+                new_filename = "%s/install-urgencies-%s.%d" % (self.log_dir, self.timestamp, suffix)
             move(self.log_filename, new_filename)
         else:
             os.unlink(self.log_filename)
 
+        # Allow long-running programs to start a new log
+        self.initialised = False
+
@@ -0,0 +1,237 @@
+""" HTTP caching for dakweb responses
+
+Responses only change when the contents of a suite change, which is tracked
+by the archive generation counter (see
+L{daklib.dbconn.bump_archive_generation}).  Responses are validated against
+the generation with ETag and Last-Modified headers and kept in an in-process
+cache keyed on the request path, query string and generation.  Responses are
+compressed with gzip for clients that accept it.
+
+@contact: Debian FTPMaster <ftpmaster@debian.org>
+@license: GNU General Public License version 2 or later
+"""
+
+import bottle
+import functools
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from daklib.config import Config
+from daklib.dbconn import DBConn, get_archive_generation
+
+
+class ResponseCache(object):
+    """
+    Least recently used cache of response bodies, bounded by the total size
+    of the cached bodies.  Also remembers the current archive generation,
+    which is only re-read from the database every C{DakWeb::GenerationTTL}
+    seconds.
+    """
+    __shared_state = {}
+
+    def __init__(self, *args, **kwargs):
+        self.__dict__ = self.__shared_state
+
+        if not getattr(self, 'initialised', False):
+            self.initialised = True
+
+            cnf = Config()
+            self.max_size = cnf.find_i('DakWeb::CacheSize', 64 << 20)
+            self.ttl = cnf.find_i('DakWeb::GenerationTTL', 2)
+            self.gzip = cnf.find_b('DakWeb::Gzip', True)
+
+            self.lock = threading.Lock()
+            self.entries = OrderedDict()
+            self.size = 0
+
+            self._generation = None
+            self._modified = None
+            self._checked = 0
+
+    def generation(self, session=None):
+        """
+        Returns the current archive generation and the time it was first
+        seen by this process.
+
+        @type session: Session
+        @param session: Optional SQL session object (a temporary one will be
+        generated if not supplied)
+
+        @rtype: tuple
+        @return: (generation, modification time)
+        """
+        now = time.time()
+        with self.lock:
+            if now - self._checked < self.ttl:
+                return self._generation, self._modified
+
+        if session is not None:
+            generation = get_archive_generation(session=session)
+        else:
+            s = DBConn().session(readonly=True)
+            try:
+                generation = get_archive_generation(session=s)
+            finally:
+                s.close()
+
+        with self.lock:
+            if generation != self._generation:
+                self._generation = generation
+                self._modified = now
+                # Entries for older generations can never be hit again.
+                self.entries.clear()
+                self.size = 0
+            self._checked = now
+            return self._generation, self._modified
+
+    def get(self, key):
+        """
+        Returns the cached C{(body, content_type)} for C{key} or C{None}.
+        """
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                self.entries[key] = value
+            return value
+
+    def add(self, key, body, content_type):
+        """
+        Adds a response to the cache, evicting the least recently used
+        entries if the cache grows beyond its size limit.
+        """
+        if len(body) > self.max_size:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self.entries[key] = (body, content_type)
+            self.size += len(body)
+            while self.size > self.max_size:
+                _, (old_body, _) = self.entries.popitem(last=False)
+                self.size -= len(old_body)
+
+    def record(self, key, chunks, content_type):
+        """
+        Passes on the chunks of a response as they are produced and adds the
+        complete response to the cache once it has been sent.
+        """
+        body = []
+        size = 0
+        for chunk in chunks:
+            if body is not None:
+                size += len(chunk)
+                if size > self.max_size:
+                    body = None
+                else:
+                    body.append(chunk)
+            yield chunk
+        if body is not None:
+            self.add(key, ''.join(body), content_type)
+
+__all__ = ['ResponseCache']
+
+
+def _accepts_gzip(request):
+    for coding in request.get_header('Accept-Encoding', '').split(','):
+        params = [param.strip() for param in coding.split(';')]
+        if params[0].lower() in ('gzip', 'x-gzip'):
+            return 'q=0' not in params
+    return False
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _not_modified(request, etag, modified):
+    if_none_match = request.get_header('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags
+
+    if_modified_since = request.get_header('If-Modified-Since')
+    if if_modified_since is not None:
+        since = bottle.parse_date(if_modified_since.split(';')[0].strip())
+        return since is not None and since >= int(modified)
+
+    return False
+
+
+def cached(func):
+    """
+    Decorator for query functions whose result only depends on the request
+    and the archive contents.  Adds ETag and Last-Modified headers, answers
+    conditional requests with 304 Not Modified and serves repeated requests
+    from L{ResponseCache}.
+
+    Query functions may return a string or an iterator over strings.  The
+    latter is passed on to the client as it is produced (and compressed with
+    gzip if the client accepts it), so large responses need not be built in
+    memory first.  The content type has to be set before returning.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        cache = ResponseCache()
+        generation, modified = cache.generation(kwargs.get('session'))
+
+        r = bottle.request
+        compress = cache.gzip and _accepts_gzip(r)
+        etag = '"%d%s"' % (generation, '-gzip' if compress else '')
+        headers = [('ETag', etag), ('Last-Modified', bottle.http_date(modified))]
+        if cache.gzip:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if compress:
+            headers.append(('Content-Encoding', 'gzip'))
+
+        if _not_modified(r, etag, modified):
+            response = bottle.HTTPResponse(status=304)
+            for name, value in headers:
+                if name != 'Content-Encoding':
+                    response.set_header(name, value)
+            return response
+
+        key = (r.path, r.query_string, compress, generation)
+        entry = cache.get(key)
+        if entry is not None:
+            body, content_type = entry
+            bottle.response.content_type = content_type
+        else:
+            session = kwargs.get('session')
+            if session is not None and hasattr(session, 'acquire'):
+                # Wait for a database slot before any output is produced.
+                session.acquire()
+            result = func(*args, **kwargs)
+            if isinstance(result, bottle.HTTPResponse):
+                return result
+            # Streamed responses are cached after the handler has returned,
+            # when bottle.response may already describe another request.
+            content_type = bottle.response.content_type
+            if isinstance(result, basestring):
+                if compress:
+                    result = ''.join(_gzip([result]))
+                cache.add(key, result, content_type)
+                body = result
+            else:
+                if compress:
+                    result = _gzip(result)
+                body = cache.record(key, result, content_type)
+
+        for name, value in headers:
+            bottle.response.set_header(name, value)
+        return body
+
+    # see dakweb.plugin.SessionPlugin
+    wrapper.lazy_session = True
+    return wrapper
+
+__all__.append('cached')
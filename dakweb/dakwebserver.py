@@ -13,6 +13,7 @@ from bottle import redirect
 from daklib.dbconn import DBConn
 import json
 
+from dakweb.plugin import SessionPlugin
 from dakweb.webregister import QueryRegister
 
 
@@ -40,6 +41,26 @@ def path_help(path=None):
              (QueryRegister().get_path_help(path), path))
 QueryRegister().register_path('/path_help', list_paths)
 
+
+@bottle.route('/stats')
+def stats():
+    """
+    Returns statistics about the requests being handled and the database
+    connection pools.
+
+    @rtype: dictionary
+    @return: A dictionary of
+             - active: requests currently using the database
+             - peak: highest number of concurrent requests
+             - max_concurrent: limit of concurrent requests
+             - requests: number of requests handled
+             - rejected: number of requests rejected as the limit was reached
+             - pool_primary, pool_replica: size, checkedin, checkedout and
+               overflow of the connection pools
+    """
+    return json.dumps(session_plugin.stats())
+QueryRegister().register_path('/stats', stats)
+
 # Import our other methods
 from queries.archive import *
 from queries.madison import *
@@ -49,6 +70,10 @@ from queries.suite import *
 # Set up our initial database connection
 d = DBConn()
 
+# Pass a request-scoped session to all queries taking one
+session_plugin = SessionPlugin()
+bottle.install(session_plugin)
+
 # Run the bottle if we're called directly
 if __name__ == '__main__':
     bottle.run()
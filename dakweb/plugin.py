@@ -0,0 +1,212 @@
+""" Bottle plugin providing request-scoped database sessions
+
+@contact: Debian FTPMaster <ftpmaster@debian.org>
+@license: GNU General Public License version 2 or later
+"""
+
+import bottle
+import threading
+import time
+
+from daklib.config import Config
+from daklib.dbconn import DBConn
+
+
+class _ClosingIterator(object):
+    """
+    Passes on a streamed response and calls C{release} once it has been
+    sent completely or the server closes it.
+    """
+    def __init__(self, iterator, release):
+        self.iterator = iter(iterator)
+        self.release = release
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            return next(self.iterator)
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        try:
+            if hasattr(self.iterator, 'close'):
+                self.iterator.close()
+        finally:
+            self.release()
+
+
+class RequestSession(object):
+    """
+    Read-only session of a single request.  A request slot is taken and the
+    session opened when it is first used (or L{acquire} is called), so
+    requests answered without the database do not count against the limit.
+    """
+    def __init__(self, plugin):
+        self._plugin = plugin
+        self._session = None
+
+    def acquire(self):
+        """
+        Takes a request slot and opens the session if not done yet.
+
+        @raise bottle.HTTPError: 503 if no slot became free in time
+        """
+        if self._session is None:
+            if not self._plugin.acquire():
+                error = bottle.HTTPError(503, 'Too many concurrent requests.')
+                error.set_header('Retry-After', '1')
+                raise error
+            try:
+                self._session = self._plugin.session_factory()
+            except:
+                self._plugin.release()
+                raise
+        return self._session
+
+    def close(self):
+        """Closes the session and gives the request slot back."""
+        if self._session is None:
+            return
+        session, self._session = self._session, None
+        try:
+            session.close()
+        finally:
+            self._plugin.release()
+
+    def __getattr__(self, name):
+        return getattr(self.acquire(), name)
+
+
+class SessionPlugin(object):
+    """
+    Passes a read-only session (a L{RequestSession}) to every route callback
+    taking a C{session} argument and closes it when the response has been
+    sent, including streamed responses and requests ending in an exception.
+    Queries decorated with L{dakweb.cache.cached} only open it on a cache
+    miss.
+
+    At most C{DakWeb::MaxConcurrent} such requests are handled at the same
+    time (default: DB::PoolSize + DB::MaxOverflow, the size of the database
+    connection pool).  Further requests wait up to C{DakWeb::QueueTimeout}
+    seconds for a slot and are rejected with 503 Service Unavailable
+    afterwards, so an overloaded server fails fast instead of piling up
+    threads waiting for database connections.
+    """
+    name = 'dak_session'
+    api = 2
+
+    def __init__(self, keyword='session', max_concurrent=None, timeout=None):
+        cnf = Config()
+        if max_concurrent is None:
+            max_concurrent = cnf.find_i('DakWeb::MaxConcurrent',
+                                        cnf.find_i('DB::PoolSize', 5) + cnf.find_i('DB::MaxOverflow', 10))
+        if timeout is None:
+            timeout = float(cnf.get('DakWeb::QueueTimeout', '0.5'))
+
+        self.keyword = keyword
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+
+        self.session_factory = lambda: DBConn().session(readonly=True)
+
+        self.condition = threading.Condition()
+        self.active = 0
+        self.peak = 0
+        self.requests = 0
+        self.rejected = 0
+
+    def setup(self, app):
+        for other in app.plugins:
+            if isinstance(other, SessionPlugin) and other.keyword == self.keyword:
+                raise bottle.PluginError("Found another session plugin with conflicting settings (non-unique keyword).")
+
+    def acquire(self):
+        """
+        Waits for a free request slot.
+
+        @rtype: bool
+        @return: C{False} if no slot became free within the timeout
+        """
+        deadline = time.time() + self.timeout
+        with self.condition:
+            while self.active >= self.max_concurrent:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.rejected += 1
+                    return False
+                self.condition.wait(remaining)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.requests += 1
+            return True
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def request_stats(self):
+        """
+        Returns request statistics.
+
+        @rtype: dict
+        """
+        with self.condition:
+            return {'active':         self.active,
+                    'peak':           self.peak,
+                    'max_concurrent': self.max_concurrent,
+                    'requests':       self.requests,
+                    'rejected':       self.rejected}
+
+    def stats(self):
+        """
+        Returns request and connection pool statistics.
+
+        @rtype: dict
+        """
+        stats = self.request_stats()
+
+        d = DBConn()
+        engines = [('primary', d.db_pg)]
+        if getattr(d, 'db_ro', None) is not None:
+            engines.append(('replica', d.db_ro))
+        for name, engine in engines:
+            pool = {}
+            for key in ('size', 'checkedin', 'checkedout', 'overflow'):
+                method = getattr(engine.pool, key, None)
+                if method is not None:
+                    pool[key] = method()
+            stats['pool_' + name] = pool
+
+        return stats
+
+    def apply(self, callback, route):
+        if self.keyword not in route.get_callback_args():
+            return callback
+        # Cached queries only need the database on a cache miss.
+        lazy = getattr(callback, 'lazy_session', False)
+
+        def wrapper(*args, **kwargs):
+            session = RequestSession(self)
+            try:
+                if not lazy:
+                    session.acquire()
+                kwargs[self.keyword] = session
+                result = callback(*args, **kwargs)
+            except:
+                session.close()
+                raise
+
+            if isinstance(result, (basestring, list, tuple, dict, bottle.HTTPResponse)) \
+                    or not hasattr(result, '__iter__'):
+                session.close()
+                return result
+            return _ClosingIterator(result, session.close)
+
+        return wrapper
+
+__all__ = ['SessionPlugin']
@@ -10,12 +10,12 @@
 import bottle
 import json
 
-from daklib.dbconn import DBConn, Archive
+from daklib.dbconn import Archive
 from dakweb.webregister import QueryRegister
 
 
 @bottle.route('/archives')
-def archives():
+def archives(session):
     """
     Give information about all known archives (sets of suites)
 
@@ -23,16 +23,13 @@ def archives():
     return: list of dictionaries
     """
 
-    s = DBConn().session()
-    q = s.query(Archive)
+    q = session.query(Archive)
     q = q.order_by(Archive.archive_name)
     ret = []
     for a in q:
         ret.append({'name':      a.archive_name,
                     'suites':    [x.suite_name for x in a.suites]})
 
-    s.close()
-
     return json.dumps(ret)
 
 QueryRegister().register_path('/archives', archives)
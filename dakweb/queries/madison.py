@@ -9,11 +9,20 @@
 import bottle
 import json
 
+from daklib.config import Config
 from daklib.ls import list_packages
+from dakweb.cache import cached
 from dakweb.webregister import QueryRegister
 
+def _lines(rows):
+    for row in rows:
+        yield row
+        yield "\n"
+
+
 @bottle.route('/madison')
-def madison():
+@cached
+def madison(session):
     """
     Display information about B{package(s)}.
 
@@ -53,15 +62,120 @@ def madison():
     if format is not None:
         kwargs['format'] = 'python'
 
-    result = list_packages(packages, **kwargs)
+    result = list_packages(packages, session=session, **kwargs)
 
     if format is None:
         bottle.response.content_type = 'text/plain'
-        for row in result:
-            yield row
-            yield "\n"
+        return _lines(result)
     else:
-        yield json.dumps(list(result))
+        return json.dumps(list(result))
 
 
 QueryRegister().register_path('/madison', madison)
+
+
+def _stream_batch(result):
+    yield '{'
+    separator = ''
+    for entry in result:
+        for package, suites in entry.iteritems():
+            yield '%s%s:%s' % (separator, json.dumps(package),
+                               json.dumps(suites, separators=(',', ':')))
+            separator = ','
+    yield '}'
+
+
+def _is_form(request):
+    return request.method == 'POST' and \
+        request.content_type.split(';')[0].strip() in ('application/x-www-form-urlencoded', 'multipart/form-data')
+
+
+def _batch_packages(request, max_packages, max_size):
+    """
+    Collects the package names of a /madison_batch request.
+
+    @rtype: list or bottle.HTTPError
+    @return: sorted list of unique package names or the error to return
+    """
+    packages = request.query.getall('package[]') + request.query.get('package', '').split()
+    if request.method == 'POST':
+        # Without a Content-Length (e.g. with chunked encoding) bottle would
+        # read the whole body into memory before its size could be checked.
+        if request.content_length < 0:
+            return bottle.HTTPError(411, 'Content-Length required.')
+        if request.content_length > max_size:
+            return bottle.HTTPError(413, 'Request body too large.')
+        if _is_form(request):
+            packages += request.forms.getall('package[]') + request.forms.get('package', '').split()
+        else:
+            packages += request.body.read(max_size).split()
+
+    packages = sorted(set(packages))
+    if len(packages) == 0:
+        return bottle.HTTPError(400, 'No packages specified.')
+    if len(packages) > max_packages:
+        return bottle.HTTPError(413, 'Too many packages (at most %d).' % max_packages)
+    return packages
+
+
+@bottle.route('/madison_batch', method=['GET', 'POST'])
+def madison_batch(session):
+    """
+    Display information about many packages in a single request.
+
+    Package names are taken from all B{package[]} keywords and from the
+    B{package} keyword (space separated).  A POST request may also carry
+    the names in a form with the same keywords or as a plain text body
+    with one or more names per line.  Requests naming more than
+    DakWeb::MadisonBatch::MaxPackages packages or with a body larger than
+    DakWeb::MadisonBatch::MaxSize bytes are rejected, as are POST requests
+    without a Content-Length header (e.g. using chunked transfer encoding).
+
+    @since: October 2026
+
+    @keyword package[]: A package name, may be given multiple times.
+    @keyword package: Space seperated list of packages.
+    @keyword b: only show info for a binary type. I{deb/udeb/dsc}
+    @keyword c: only show info for specified component(s). I{main/contrib/non-free}
+    @keyword s: only show info for this suite.
+    @keyword S: show info for the binary children of source pkgs. I{true/false}
+    @see: L{I{suites}<dakweb.queries.suite.suites>} on how to receive a list of valid suites.
+
+    @rtype: application/json
+    @return: Dictionary mapping package names to suites, versions and their
+             details, as returned by L{madison} in json format
+    """
+
+    cnf = Config()
+    max_packages = cnf.find_i('DakWeb::MadisonBatch::MaxPackages', 5000)
+    max_size = cnf.find_i('DakWeb::MadisonBatch::MaxSize', 1 << 20)
+
+    r = bottle.request
+
+    packages = _batch_packages(r, max_packages, max_size)
+    if isinstance(packages, bottle.HTTPError):
+        return packages
+
+    # Only form bodies carry options; others must not be parsed as one.
+    params = r.params if _is_form(r) else r.query
+    kwargs = dict()
+
+    binary_type = params.get('b', None)
+    if binary_type is not None:
+        kwargs['binary_types'] = [binary_type]
+    component = params.get('c', None)
+    if component is not None:
+        kwargs['components'] = component.split(",")
+    suite = params.get('s', None)
+    if suite is not None:
+        kwargs['suites'] = suite.split(",")
+    if 'S' in params:
+        kwargs['source_and_binary'] = True
+
+    result = list_packages(packages, format='python', per_package=True, session=session, **kwargs)
+
+    bottle.response.content_type = 'application/json'
+    return _stream_batch(result)
+
+
+QueryRegister().register_path('/madison_batch', madison_batch)
@@ -10,12 +10,15 @@ from sqlalchemy import or_
 import bottle
 import json
 
-from daklib.dbconn import DBConn, DBSource, Suite, DSCFile, PoolFile
+from daklib.daksql import stream
+from daklib.dbconn import DBSource, Suite, DSCFile, PoolFile
+from dakweb.cache import cached
 from dakweb.webregister import QueryRegister
 
 
 @bottle.route('/dsc_in_suite/<suite>/<source>')
-def dsc_in_suite(suite=None, source=None):
+@cached
+def dsc_in_suite(session, suite=None, source=None):
     """
     Find all dsc files for a given source package name in a given suite.
 
@@ -41,8 +44,7 @@ def dsc_in_suite(suite=None, source=None):
     if source is None:
         return bottle.HTTPError(503, 'Source package not specified.')
 
-    s = DBConn().session()
-    q = s.query(DSCFile).join(PoolFile)
+    q = session.query(DSCFile).join(PoolFile)
     q = q.join(DBSource).join(Suite, DBSource.suites)
     q = q.filter(or_(Suite.suite_name == suite, Suite.codename == suite))
     q = q.filter(DBSource.source == source)
@@ -55,15 +57,36 @@ def dsc_in_suite(suite=None, source=None):
                     'filesize':  p.poolfile.filesize,
                     'sha256sum': p.poolfile.sha256sum})
 
-    s.close()
-
     return json.dumps(ret)
 
 QueryRegister().register_path('/dsc_in_suite', dsc_in_suite)
 
 
+def _stream_sources(session, statement, params=None):
+    """
+    Encodes the (source, version) rows returned by C{statement} as a JSON
+    list of dictionaries, a chunk of rows at a time.  The rows are read with
+    a server-side cursor so neither the result nor the JSON document is held
+    in memory as a whole.
+    """
+    yield '['
+    separator = ''
+    chunk = []
+    for source, version in stream(session, statement, params):
+        chunk.append(json.dumps({'source':    source,
+                                 'version':   version}))
+        if len(chunk) >= 1000:
+            yield separator + ', '.join(chunk)
+            separator = ', '
+            chunk = []
+    if chunk:
+        yield separator + ', '.join(chunk)
+    yield ']'
+
+
 @bottle.route('/sources_in_suite/<suite>')
-def sources_in_suite(suite=None):
+@cached
+def sources_in_suite(session, suite=None):
     """
     Returns all source packages and their versions in a given suite.
 
@@ -81,23 +104,20 @@ def sources_in_suite(suite=None):
     if suite is None:
         return bottle.HTTPError(503, 'Suite not specified.')
 
-    s = DBConn().session()
-    q = s.query(DBSource).join(Suite, DBSource.suites)
-    q = q.filter(or_(Suite.suite_name == suite, Suite.codename == suite))
-    ret = []
-    for p in q:
-        ret.append({'source':    p.source,
-                    'version':   p.version})
-
-    s.close()
-
-    return json.dumps(ret)
+    return _stream_sources(session, """
+        SELECT s.source, s.version
+          FROM source s
+          JOIN src_associations sa ON sa.source = s.id
+          JOIN suite su ON su.id = sa.suite
+         WHERE su.suite_name = :suite OR su.codename = :suite""",
+        {'suite': suite})
 
 QueryRegister().register_path('/sources_in_suite', sources_in_suite)
 
 
 @bottle.route('/all_sources')
-def all_sources():
+@cached
+def all_sources(session):
     """
     Returns all source packages and their versions known to the archive
     (this includes NEW).
@@ -108,15 +128,6 @@ def all_sources():
              - version
     """
 
-    s = DBConn().session()
-    q = s.query(DBSource)
-    ret = []
-    for p in q:
-        ret.append({'source':    p.source,
-                    'version':   p.version})
-
-    s.close()
-
-    return json.dumps(ret)
+    return _stream_sources(session, "SELECT source, version FROM source")
 
 QueryRegister().register_path('/all_sources', all_sources)
@@ -10,12 +10,12 @@
 import bottle
 import json
 
-from daklib.dbconn import DBConn, Suite
+from daklib.dbconn import Suite
 from dakweb.webregister import QueryRegister
 
 
 @bottle.route('/suites')
-def suites():
+def suites(session):
     """
     Give information about all known suites.
 
@@ -34,8 +34,7 @@ def suites():
 
     """
 
-    s = DBConn().session()
-    q = s.query(Suite)
+    q = session.query(Suite)
     q = q.order_by(Suite.suite_name)
     ret = []
     for p in q:
@@ -46,14 +45,12 @@ def suites():
                     'architectures': [x.arch_string for x in p.architectures],
                     'components': [x.component_name for x in p.components]})
 
-    s.close()
-
     return json.dumps(ret)
 
 QueryRegister().register_path('/suites', suites)
 
 @bottle.route('/suite/<suite>')
-def suite(suite=None):
+def suite(session, suite=None):
     """
     Gives information about a single suite.  Note that this routine will look
     up a suite first by the main suite_name, but then also by codename if no
@@ -84,22 +81,19 @@ def suite(suite=None):
     # TODO: We should probably stick this logic into daklib/dbconn.py
     so = None
 
-    s = DBConn().session()
-    q = s.query(Suite)
+    q = session.query(Suite)
     q = q.filter(Suite.suite_name == suite)
 
     if q.count() > 1:
         # This would mean dak is misconfigured
-        s.close()
         return bottle.HTTPError(503, 'Multiple suites found: configuration error')
     elif q.count() == 1:
         so = q[0]
     else:
         # Look it up by suite_name
-        q = s.query(Suite).filter(Suite.codename == suite)
+        q = session.query(Suite).filter(Suite.codename == suite)
         if q.count() > 1:
             # This would mean dak is misconfigured
-            s.close()
             return bottle.HTTPError(503, 'Multiple suites found: configuration error')
         elif q.count() == 1:
             so = q[0]
@@ -112,8 +106,6 @@ def suite(suite=None):
               'architectures': [x.arch_string for x in so.architectures],
               'components': [x.component_name for x in so.components]}
 
-    s.close()
-
     return json.dumps(so)
 
 QueryRegister().register_path('/suite', suite)
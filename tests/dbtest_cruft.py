@@ -5,6 +5,10 @@ from db_test import DBDakTestCase
 from daklib.dbconn import *
 from daklib.cruft import *
 
+from dak.cruft_report import reportAllNBS
+
+from StringIO import StringIO
+import sys
 import unittest
 
 class CruftTestCase(DBDakTestCase):
@@ -67,5 +71,17 @@ class CruftTestCase(DBDakTestCase):
         self.assertEqual('hello built by: hello(2.2-1, 2.2-2), sl(3.03-16)', \
             str(bin))
 
+    def test_nbs_readonly(self):
+        'tests that the NBS section works with a read-only session'
+
+        # a hot-standby replica only allows read-only transactions
+        self.session.execute("SET TRANSACTION READ ONLY")
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            reportAllNBS('sid', self.suite['sid'].suite_id, self.session)
+        finally:
+            sys.stdout = stdout
+
 if __name__ == '__main__':
     unittest.main()
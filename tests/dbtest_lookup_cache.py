@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+from db_test import DBDakTestCase
+
+from daklib.dbconn import Uid, get_or_set_uid, get_suite, \
+    invalidate_lookup_caches, lookup_cache_stats, \
+    MetadataKey, get_or_set_metadatakey, get_metadatakey_ids
+
+import unittest
+
+class LookupCacheTestCase(DBDakTestCase):
+    """
+    This TestCase checks the process-wide lookup caches in dbconn.
+    """
+
+    def setUp(self):
+        super(LookupCacheTestCase, self).setUp()
+        invalidate_lookup_caches()
+
+    def stats(self, name):
+        for stats in lookup_cache_stats():
+            if stats[0] == name:
+                return stats[1:]
+        return None
+
+    def test_suite(self):
+        self.setup_suites()
+        self.session.flush()
+        sid = get_suite('sid', self.session)
+        self.assertEqual(sid, get_suite('sid', self.session))
+        entries, hits, misses = self.stats('suite')
+        self.assertEqual(1, entries)
+        self.assertEqual(1, hits)
+        # a renamed suite must not be returned for its old name
+        sid.suite_name = 'unstable'
+        self.session.flush()
+        self.assertEqual(None, get_suite('sid', self.session))
+        self.assertEqual(sid, get_suite('unstable', self.session))
+        invalidate_lookup_caches('suite')
+        self.assertEqual(0, self.stats('suite')[0])
+
+    def test_rollback(self):
+        uid = get_or_set_uid('dak', self.session)
+        self.assertEqual(uid, get_or_set_uid('dak', self.session))
+        self.session.rollback()
+        # the cached id is gone with the transaction
+        uid = get_or_set_uid('dak', self.session)
+        self.assertEqual('dak', uid.uid)
+        self.assertEqual(1, self.session.query(Uid).filter_by(uid='dak').count())
+
+    def test_metadatakey_rollback(self):
+        key_id = get_or_set_metadatakey('X-Dak-Test', self.session).key_id
+        self.session.rollback()
+        # the key was committed separately, so the cached id stays valid
+        self.assertEqual(key_id, get_metadatakey_ids(['X-Dak-Test'], self.session)['X-Dak-Test'])
+        self.assertEqual(1, self.session.query(MetadataKey).filter_by(key_id=key_id).count())
+        self.session.query(MetadataKey).filter_by(key_id=key_id).delete()
+        self.session.commit()
+        invalidate_lookup_caches('metadata_key')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,8 @@
 
 from db_test import DBDakTestCase
 
-from daklib.dbconn import DBConn, MetadataKey, BinaryMetadata, SourceMetadata
+from daklib.dbconn import DBConn, MetadataKey, BinaryMetadata, SourceMetadata, \
+    import_metadata_into_db_bulk, invalidate_lookup_caches
 
 import unittest
 
@@ -11,6 +12,15 @@ class MetadataTestCase(DBDakTestCase):
     This TestCase checks the metadata handling.
     """
 
+    def setUp(self):
+        super(MetadataTestCase, self).setUp()
+        # keys created by the tests are rolled back
+        invalidate_lookup_caches('metadata_key')
+
+    def tearDown(self):
+        invalidate_lookup_caches('metadata_key')
+        super(MetadataTestCase, self).tearDown()
+
     def setup_metadata(self):
         '''
         Setup the metadata objects.
@@ -76,6 +86,21 @@ class MetadataTestCase(DBDakTestCase):
         self.assertEqual('http://debian.org', self.src_hello.metadata[self.homepage])
         self.assertTrue(self.depends not in self.src_hello.metadata)
 
+    def test_import_bulk(self):
+        '''
+        Tests importing the metadata of several packages at once.
+        '''
+        self.setup_metadata()
+        self.bin_hello.read_control_fields = lambda: {'Depends': 'libc6'}
+        self.src_hello.read_control_fields = lambda: {'Build-Depends': 'debhelper',
+                                                      'Homepage': 'http://www.gnu.org/'}
+        import_metadata_into_db_bulk([self.bin_hello, self.src_hello], self.session)
+        self.assertEqual('libc6', self.bin_hello.metadata[self.depends])
+        # existing metadata is replaced
+        self.assertFalse(self.recommends in self.bin_hello.metadata)
+        self.assertEqual('debhelper', self.src_hello.metadata[self.build_dep])
+        self.assertEqual('http://www.gnu.org/', self.src_hello.metadata[self.homepage])
+
     def test_delete(self):
         '''
         Tests the delete / cascading behaviour.
@@ -397,5 +397,20 @@ class PackageTestCase(DBDakTestCase):
             arch_list = ['amd64'], session = self.session)
         self.assertEqual(None, result)
 
+    def test_get_components_by_packages_suite(self):
+        'test get_components_by_packages_suite()'
+
+        result = get_components_by_packages_suite(['hello', 'gnome-hello', 'foobar'], \
+            ['sid'], session = self.session)
+        self.assertEqual({'hello': 'main', 'gnome-hello': 'contrib'}, result)
+        result = get_components_by_packages_suite(['hello', 'gnome-hello'], \
+            ['squeeze'], session = self.session)
+        self.assertEqual('main', result['gnome-hello'])
+        result = get_components_by_packages_suite(['hello'], ['sid'], \
+            arch_list = ['amd64'], session = self.session)
+        self.assertEqual({}, result)
+        self.assertEqual({}, get_components_by_packages_suite([], ['sid'], \
+            session = self.session))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+from base_test import DakTestCase
+
+from daklib.daksql import stream
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import unittest
+
+class StreamTestCase(DakTestCase):
+    def setUp(self):
+        # SQLite has no server-side cursors; this only checks that rows
+        # are passed through correctly in chunks.
+        engine = create_engine('sqlite://')
+        self.session = sessionmaker(bind=engine)()
+        self.session.execute("CREATE TABLE t (id INTEGER)")
+        for i in range(5):
+            self.session.execute("INSERT INTO t VALUES (:id)", {'id': i})
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_stream(self):
+        rows = list(stream(self.session, "SELECT id FROM t WHERE id >= :min ORDER BY id", {'min': 1}, fetch_size=2))
+        self.assertEqual([1, 2, 3, 4], [ row[0] for row in rows ])
+
+    def test_empty(self):
+        self.assertEqual([], list(stream(self.session, "SELECT id FROM t WHERE id < 0", fetch_size=2)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+from base_test import DakTestCase
+
+import bottle
+from dakweb.cache import ResponseCache, cached, _accepts_gzip
+
+import gzip
+from StringIO import StringIO
+import time
+import unittest
+
+class ResponseCacheTestCase(DakTestCase):
+    def setUp(self):
+        ResponseCache._ResponseCache__shared_state.clear()
+        self.cache = ResponseCache()
+        self.cache.max_size = 10
+        self.cache.gzip = False
+        # pretend the generation has just been read from the database
+        self.cache.ttl = 3600
+        self.cache._generation = 5
+        self.cache._modified = 1000000000
+        self.cache._checked = time.time()
+
+    def tearDown(self):
+        ResponseCache._ResponseCache__shared_state.clear()
+
+    def test_eviction(self):
+        self.cache.add('a', '1234', 'text/plain')
+        self.cache.add('b', '1234', 'text/plain')
+        # 'a' is now the most recently used entry
+        self.assertEqual(('1234', 'text/plain'), self.cache.get('a'))
+        self.cache.add('c', '1234', 'text/plain')
+        self.assertEqual(None, self.cache.get('b'))
+        self.assertEqual(('1234', 'text/plain'), self.cache.get('a'))
+        self.assertEqual(8, self.cache.size)
+
+    def test_replace(self):
+        self.cache.add('a', '1234', 'text/plain')
+        self.cache.add('a', '123456', 'text/plain')
+        self.assertEqual(6, self.cache.size)
+
+    def test_too_large(self):
+        self.cache.add('a', '12345678901', 'text/plain')
+        self.assertEqual(None, self.cache.get('a'))
+        self.assertEqual(0, self.cache.size)
+
+    def test_generation(self):
+        self.assertEqual((5, 1000000000), self.cache.generation())
+
+class CachedTestCase(ResponseCacheTestCase):
+    def setUp(self):
+        super(CachedTestCase, self).setUp()
+        self.calls = 0
+
+    def query(self):
+        self.calls += 1
+        return '["hello"]'
+
+    def request(self, func, path='/query', **headers):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': ''}
+        for name, value in headers.iteritems():
+            environ['HTTP_' + name.upper()] = value
+        bottle.request.bind(environ)
+        bottle.response.bind()
+        return cached(func)()
+
+    def test_cache_hit(self):
+        self.assertEqual('["hello"]', self.request(self.query))
+        self.assertEqual('"5"', bottle.response.get_header('ETag'))
+        self.assertEqual(bottle.http_date(1000000000), bottle.response.get_header('Last-Modified'))
+        self.assertEqual('["hello"]', self.request(self.query))
+        self.assertEqual(1, self.calls)
+        self.request(self.query, path='/other')
+        self.assertEqual(2, self.calls)
+
+    def test_if_none_match(self):
+        response = self.request(self.query, If_None_Match='"4", "5"')
+        self.assertEqual(304, response.status_code)
+        self.assertEqual('"5"', response.get_header('ETag'))
+        self.assertEqual(0, self.calls)
+        response = self.request(self.query, If_None_Match='"4"')
+        self.assertEqual('["hello"]', response)
+
+    def test_if_modified_since(self):
+        response = self.request(self.query, If_Modified_Since=bottle.http_date(1000000000))
+        self.assertEqual(304, response.status_code)
+        response = self.request(self.query, If_Modified_Since=bottle.http_date(999999999))
+        self.assertEqual('["hello"]', response)
+
+    def test_error_not_cached(self):
+        def failing():
+            self.calls += 1
+            return bottle.HTTPError(503, 'Suite not specified.')
+        self.assertTrue(isinstance(self.request(failing), bottle.HTTPError))
+        self.assertTrue(isinstance(self.request(failing), bottle.HTTPError))
+        self.assertEqual(2, self.calls)
+
+    def test_stream(self):
+        def stream():
+            self.calls += 1
+            bottle.response.content_type = 'text/plain'
+            def chunks():
+                yield 'a\n'
+                # the handler has returned; the response may be reused
+                bottle.response.content_type = 'text/html'
+                yield 'b\n'
+            return chunks()
+        self.assertEqual('a\nb\n', ''.join(self.request(stream)))
+        self.assertEqual('a\nb\n', self.request(stream))
+        self.assertEqual('text/plain', bottle.response.content_type)
+        self.assertEqual(1, self.calls)
+
+    def test_gzip(self):
+        self.cache.gzip = True
+        body = ''.join(self.request(self.query, Accept_Encoding='deflate, gzip'))
+        self.assertEqual('gzip', bottle.response.get_header('Content-Encoding'))
+        self.assertEqual('"5-gzip"', bottle.response.get_header('ETag'))
+        self.assertEqual('Accept-Encoding', bottle.response.get_header('Vary'))
+        self.assertEqual('["hello"]', gzip.GzipFile(fileobj=StringIO(body)).read())
+        # uncompressed responses are cached separately
+        self.assertEqual('["hello"]', self.request(self.query))
+        self.assertEqual(None, bottle.response.get_header('Content-Encoding'))
+        self.assertEqual(2, self.calls)
+
+    def test_accepts_gzip(self):
+        def accepts(value):
+            bottle.request.bind({'HTTP_ACCEPT_ENCODING': value})
+            return _accepts_gzip(bottle.request)
+        self.assertTrue(accepts('gzip'))
+        self.assertTrue(accepts('deflate, x-gzip;q=0.5'))
+        self.assertFalse(accepts('gzip;q=0'))
+        self.assertFalse(accepts('deflate'))
+        self.assertFalse(accepts(''))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+from base_test import DakTestCase
+
+import bottle
+from dakweb.queries.madison import _batch_packages
+
+from StringIO import StringIO
+import unittest
+
+class BatchPackagesTestCase(DakTestCase):
+    def packages(self, query='', body=None, content_type='text/plain',
+                 max_packages=5, max_size=100, **environ):
+        environ.update({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/madison_batch',
+                        'QUERY_STRING': query, 'wsgi.input': StringIO()})
+        if body is not None:
+            environ.update({'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': content_type,
+                            'wsgi.input': StringIO(body)})
+            environ.setdefault('CONTENT_LENGTH', str(len(body)))
+        bottle.request.bind(environ)
+        result = _batch_packages(bottle.request, max_packages, max_size)
+        if isinstance(result, bottle.HTTPError):
+            return result.status_code
+        return result
+
+    def test_query(self):
+        self.assertEqual(['a', 'b', 'c'],
+                         self.packages('package[]=c&package[]=a&package=b+a'))
+
+    def test_text_body(self):
+        self.assertEqual(['a', 'b', 'c'],
+                         self.packages('package=c', body='b\na c\n'))
+
+    def test_form_body(self):
+        self.assertEqual(['a', 'b', 'c'],
+                         self.packages('package=c', body='package[]=b&package=a+b',
+                                       content_type='application/x-www-form-urlencoded'))
+
+    def test_no_packages(self):
+        self.assertEqual(400, self.packages())
+        self.assertEqual(400, self.packages(body='\n'))
+
+    def test_too_many_packages(self):
+        self.assertEqual(['a', 'b', 'c', 'd', 'e'], self.packages(body='a b c d e a'))
+        self.assertEqual(413, self.packages(body='a b c d e f'))
+
+    def test_body_too_large(self):
+        self.assertEqual(413, self.packages(body='a ' * 51))
+
+    def test_content_length_required(self):
+        self.assertEqual(411, self.packages(body='a\n', CONTENT_LENGTH='',
+                                            HTTP_TRANSFER_ENCODING='chunked'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+from base_test import DakTestCase
+
+import bottle
+from dakweb.cache import ResponseCache, cached
+from dakweb.plugin import SessionPlugin
+
+from StringIO import StringIO
+import sys
+import time
+import unittest
+
+class FakeSession(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class SessionPluginTestCase(DakTestCase):
+    def setUp(self):
+        self.plugin = SessionPlugin(max_concurrent=1, timeout=0)
+        self.sessions = []
+        def factory():
+            session = FakeSession()
+            self.sessions.append(session)
+            return session
+        self.plugin.session_factory = factory
+
+        self.app = bottle.Bottle(catchall=False)
+        self.app.install(self.plugin)
+
+        ResponseCache._ResponseCache__shared_state.clear()
+        cache = ResponseCache()
+        cache.gzip = False
+        cache.ttl = 3600
+        cache._generation = 1
+        cache._modified = 1000000000
+        cache._checked = time.time()
+
+    def tearDown(self):
+        ResponseCache._ResponseCache__shared_state.clear()
+
+    def call(self, path):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+                   'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+                   'wsgi.url_scheme': 'http', 'wsgi.input': StringIO(),
+                   'wsgi.errors': sys.stderr}
+        response = {}
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split()[0])
+            response['headers'] = dict(headers)
+        body = self.app(environ, start_response)
+        try:
+            content = ''.join(body)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        return response['status'], response['headers'], content
+
+    def test_slots(self):
+        self.assertTrue(self.plugin.acquire())
+        self.assertFalse(self.plugin.acquire())
+        self.plugin.release()
+        self.assertTrue(self.plugin.acquire())
+        self.plugin.release()
+        stats = self.plugin.request_stats()
+        self.assertEqual(0, stats['active'])
+        self.assertEqual(1, stats['peak'])
+        self.assertEqual(2, stats['requests'])
+        self.assertEqual(1, stats['rejected'])
+
+    def test_session_closed(self):
+        @self.app.route('/query')
+        def query(session):
+            return str(session.closed)
+        self.assertEqual((200, 'False'), self.call('/query')[::2])
+        self.assertEqual(1, len(self.sessions))
+        self.assertTrue(self.sessions[0].closed)
+        self.assertEqual(0, self.plugin.active)
+
+    def test_exception(self):
+        @self.app.route('/query')
+        def query(session):
+            session.closed
+            raise ValueError()
+        self.assertRaises(ValueError, self.call, '/query')
+        self.assertTrue(self.sessions[0].closed)
+        self.assertEqual(0, self.plugin.active)
+
+    def test_stream(self):
+        # Route functions must not close over anything but functions, or
+        # bottle cannot find their arguments.
+        @self.app.route('/query')
+        def query(session, plugin=self.plugin):
+            session.closed
+            def chunks():
+                yield 'a'
+                # the session stays open while the response is sent
+                yield str(plugin.active)
+            return chunks()
+        self.assertEqual((200, 'a1'), self.call('/query')[::2])
+        self.assertTrue(self.sessions[0].closed)
+        self.assertEqual(0, self.plugin.active)
+
+    def test_saturated(self):
+        @self.app.route('/query')
+        def query(session):
+            return 'ok'
+        self.plugin.acquire()
+        status, headers, body = self.call('/query')
+        self.assertEqual(503, status)
+        self.assertEqual('1', headers['Retry-After'])
+        self.assertEqual([], self.sessions)
+        self.plugin.release()
+        self.assertEqual(0, self.plugin.active)
+
+    def test_cache_hit_needs_no_slot(self):
+        @self.app.route('/query')
+        @cached
+        def query(session):
+            return 'ok'
+        self.assertEqual((200, 'ok'), self.call('/query')[::2])
+        self.assertEqual(1, len(self.sessions))
+        self.plugin.acquire()
+        self.assertEqual((200, 'ok'), self.call('/query')[::2])
+        self.assertEqual(1, len(self.sessions))
+        self.plugin.release()
+
+if __name__ == '__main__':
+    unittest.main()
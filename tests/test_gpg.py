@@ -19,7 +19,9 @@
 import datetime
 import unittest
 from base_test import DakTestCase, fixture
-from daklib.gpg import GpgException, SignedFile
+from daklib.gpg import GpgException, SignedFile, clear_verification_cache, \
+    signature_issuers, KeyringIndex
+import daklib.gpg
 
 keyring = fixture('gpg/gnupghome/pubring.gpg')
 fpr_valid = '0ABB89079CB58F8F94F6F310CB9D5C5828606E84'
@@ -69,5 +71,39 @@ class GpgTest(DakTestCase):
         with self.assertRaises(GpgException):
             verify('gpg/plaintext.txt')
 
+    def test_cached(self):
+        clear_verification_cache()
+        hits = daklib.gpg._verification_cache.hits
+        first = verify('gpg/valid.asc')
+        second = verify('gpg/valid.asc')
+        self.assertEqual(daklib.gpg._verification_cache.hits, hits + 1)
+        self.assertEqual(first.primary_fingerprint, second.primary_fingerprint)
+        self.assertEqual(first.contents, second.contents)
+
+    def test_cached_assertion(self):
+        clear_verification_cache()
+        verify('gpg/expired.asc', False)
+        with self.assertRaises(GpgException):
+            verify('gpg/expired.asc')
+
+class SignatureIssuersTest(DakTestCase):
+    def issuers(self, filename):
+        with open(fixture(filename)) as fh:
+            return signature_issuers(fh.read())
+
+    def test_issuers(self):
+        self.assertEqual(self.issuers('gpg/valid.asc'), set([fpr_valid[-16:]]))
+        self.assertEqual(self.issuers('gpg/expired.asc'), set([fpr_expired[-16:]]))
+
+    def test_not_clearsigned(self):
+        self.assertEqual(self.issuers('gpg/message.asc'), None)
+        self.assertEqual(self.issuers('gpg/plaintext.txt'), None)
+
+    def test_keyring_index(self):
+        index = KeyringIndex.get([keyring])
+        self.assertTrue(fpr_valid in index)
+        self.assertTrue(fpr_valid[-16:] in index)
+        self.assertFalse('0123456789ABCDEF' in index)
+
 if __name__ == '__main__':
     unittest.main()
@@ -4,7 +4,11 @@ from base_test import DakTestCase
 
 import unittest
 
-from daklib.lintian import parse_lintian_output, generate_reject_messages
+from daklib.lintian import parse_lintian_output, generate_reject_messages, \
+    result_cache_key, LintianResultCache
+
+import shutil
+import tempfile
 
 class ParseLintianTestCase(DakTestCase):
     def assertParse(self, output, expected):
@@ -144,5 +148,31 @@ class GenerateRejectMessages(DakTestCase):
             1,
         )
 
+class LintianResultCacheTestCase(DakTestCase):
+    tags = [{'level': 'E', 'package': 'pkgname', 'tag': 'some-tag', 'description': ''}]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testKey(self):
+        key = result_cache_key([('a.dsc', '1')], '2.5', 'x')
+        self.assertNotEqual(key, result_cache_key([('a.dsc', '1')], '2.6', 'x'))
+        self.assertNotEqual(key, result_cache_key([('a.dsc', '1')], '2.5', 'y'))
+        self.assertNotEqual(key, result_cache_key([('a.dsc', '2')], '2.5', 'x'))
+
+    def testMemory(self):
+        cache = LintianResultCache()
+        self.assertEqual(cache.get('00ff'), None)
+        cache.set('00ff', self.tags)
+        self.assertEqual(cache.get('00ff'), self.tags)
+
+    def testPersistent(self):
+        LintianResultCache(self.directory).set('00ff', self.tags)
+        self.assertEqual(LintianResultCache(self.directory).get('00ff'), self.tags)
+        self.assertEqual(LintianResultCache(self.directory).get('00fe'), None)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+from base_test import DakTestCase
+
+from daklib.morgue import FileRemover, MorgueJournal, RateLimiter
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+class MorgueTestCase(DakTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pool = os.path.join(self.directory, 'pool')
+        self.morgue = os.path.join(self.directory, 'morgue')
+        os.mkdir(self.pool)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_file(self, name, content='x'):
+        path = os.path.join(self.pool, name)
+        with open(path, 'w') as fh:
+            fh.write(content)
+        return path
+
+class FileRemoverTestCase(MorgueTestCase):
+    def test_run(self):
+        jobs = []
+        remover = FileRemover(threads=4)
+        for i in range(10):
+            src = self.make_file('file{0}'.format(i), 'a' * i)
+            dest = remover.reserve(os.path.join(self.morgue, 'file{0}'.format(i)))
+            jobs.append((i, src, dest))
+        unlinked = self.make_file('unlinked')
+        jobs.append((10, unlinked, None))
+        jobs.append((11, os.path.join(self.pool, 'missing'), None))
+
+        results = remover.run(jobs)
+        self.assertEqual(12, len(results))
+        self.assertEqual([ None ] * 11, [ r[4] for r in results[:11] ])
+        self.assertNotEqual(None, results[11][4])
+        self.assertEqual(11, remover.count)
+        self.assertEqual(46, remover.bytes)
+        self.assertEqual(1, remover.failed)
+        self.assertEqual([], os.listdir(self.pool))
+        self.assertEqual(10, len(os.listdir(self.morgue)))
+
+    def test_no_action(self):
+        src = self.make_file('file', 'abc')
+        remover = FileRemover(no_action=True)
+        remover.run([(1, src, None)])
+        self.assertTrue(os.path.exists(src))
+        self.assertEqual(3, remover.bytes)
+
+    def test_reserve(self):
+        os.mkdir(self.morgue)
+        existing = os.path.join(self.morgue, 'file')
+        open(existing, 'w').close()
+        remover = FileRemover()
+        self.assertEqual(existing + '.0', remover.reserve(existing))
+        self.assertEqual(existing + '.1', remover.reserve(existing))
+
+class MorgueJournalTestCase(MorgueTestCase):
+    def test_reconcile(self):
+        journal = MorgueJournal(os.path.join(self.directory, 'journal'))
+        os.mkdir(self.morgue)
+        # interrupted copy: both source and destination exist
+        partial_src = self.make_file('partial')
+        partial_dest = os.path.join(self.morgue, 'partial')
+        open(partial_dest, 'w').close()
+        # completed move
+        done_dest = os.path.join(self.morgue, 'done')
+        open(done_dest, 'w').close()
+        journal.write([(partial_src, partial_dest), (os.path.join(self.pool, 'done'), done_dest)])
+
+        log = journal.reconcile()
+        self.assertEqual(2, len(log))
+        self.assertTrue(os.path.exists(partial_src))
+        self.assertFalse(os.path.exists(partial_dest))
+        self.assertTrue(os.path.exists(done_dest))
+        self.assertFalse(os.path.exists(journal.filename))
+        self.assertEqual([], journal.reconcile())
+
+class RateLimiterTestCase(DakTestCase):
+    def test_limit(self):
+        limiter = RateLimiter(1000)
+        start = time.time()
+        limiter.acquire(100)
+        limiter.acquire(100)
+        self.assertTrue(time.time() - start >= 0.09)
+
+    def test_unlimited(self):
+        limiter = RateLimiter(None)
+        start = time.time()
+        limiter.acquire(10 ** 9)
+        self.assertTrue(time.time() - start < 0.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+from base_test import DakTestCase
+
+from daklib.querystats import QueryStats, normalise_statement, install
+
+import unittest
+
+class NormaliseStatementTestCase(DakTestCase):
+    def test_literals(self):
+        self.assertEqual(normalise_statement("SELECT *\n  FROM suite WHERE suite_name = 'sid' AND id = 5"),
+                         "SELECT * FROM suite WHERE suite_name = ? AND id = ?")
+
+    def test_placeholders(self):
+        self.assertEqual(normalise_statement("SELECT id FROM binaries WHERE package = %(package_1)s AND version = %s"),
+                         "SELECT id FROM binaries WHERE package = ? AND version = ?")
+        self.assertEqual(normalise_statement("SELECT id::text FROM suite WHERE id = :id"),
+                         "SELECT id::text FROM suite WHERE id = ?")
+
+    def test_in_list(self):
+        self.assertEqual(normalise_statement("SELECT 1 FROM t WHERE id IN (%(id_1)s, %(id_2)s, %(id_3)s)"),
+                         normalise_statement("SELECT 1 FROM t WHERE id IN (%(id_1)s)"))
+
+    def test_identifiers(self):
+        self.assertEqual(normalise_statement("SELECT t1.id FROM tbl2 t1"), "SELECT t1.id FROM tbl2 t1")
+
+class QueryStatsTestCase(DakTestCase):
+    def setUp(self):
+        QueryStats().reset()
+
+    def test_record_and_merge(self):
+        stats = QueryStats()
+        stats.record("SELECT 1 FROM t WHERE id = 1", 0.5, 1)
+        stats.record("SELECT 1 FROM t WHERE id = 2", 1.5, -1)
+        other = { "DELETE FROM t": [1, 3.0, 3.0, 10] }
+        stats.merge(other)
+        rows = stats.rows()
+        self.assertEqual(("DELETE FROM t", 1, 3.0, 3.0, 10), rows[0])
+        self.assertEqual(("SELECT ? FROM t WHERE id = ?", 2, 2.0, 1.5, 1), rows[1])
+        self.assertEqual(1, len(stats.rows(limit=1)))
+        self.assertEqual(3, len(stats.format().splitlines()))
+
+    def test_install(self):
+        try:
+            from sqlalchemy import create_engine
+            engine = create_engine('sqlite://')
+        except Exception:
+            self.skipTest('sqlite engine not available')
+
+        class Log(object):
+            def __init__(self):
+                self.lines = []
+            def write(self, text):
+                self.lines.append(text)
+
+        log = Log()
+        install(engine, threshold=0.0, log=log)
+        engine.execute("CREATE TABLE t (id INTEGER)")
+        engine.execute("SELECT id FROM t WHERE id = 1").fetchall()
+        engine.execute("SELECT id FROM t WHERE id = 2").fetchall()
+
+        stats = dict( (row[0], row[1]) for row in QueryStats().rows() )
+        self.assertEqual(2, stats["SELECT id FROM t WHERE id = ?"])
+        self.assertEqual(3, len(log.lines))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+from base_test import DakTestCase
+
+from daklib.rdeps import ReverseDependencyGraph
+
+import os
+import shutil
+import tempfile
+import unittest
+
+class ReverseDependencyGraphTestCase(DakTestCase):
+    def setUp(self):
+        self.graph = ReverseDependencyGraph()
+        assoc_id = 0
+        for arch in ('amd64', 'i386'):
+            for package, source, component, depends, provides in (
+                    ('libfoo1', 'foo', 'main', None, 'libfoo'),
+                    ('bar', 'bar', 'main', 'libfoo1 (>= 1.0), baz | qux', None),
+                    ('baz', 'baz', 'contrib', None, None),
+                    ('qux', 'qux', 'main', None, None),
+                    ('quux', 'quux', 'main', 'libfoo', None)):
+                assoc_id += 1
+                self.graph.add_binary(arch, assoc_id, package, source, component, depends, provides)
+        self.graph.add_binary('i386', 100, 'libfoo-compat', 'compat', 'main', None, 'libfoo')
+        self.graph.add_source(1, 'bar', 'libfoo-dev, debhelper (>= 9) | cdbs', 'main')
+        self.graph.add_source(2, 'foo', 'debhelper', 'main')
+
+    def test_broken_depends(self):
+        broken, removed = self.graph.broken_depends(['libfoo1'], ['amd64', 'i386'])
+        self.assertEqual(broken, {
+            ('bar', 'main'): {'bar': set(['amd64', 'i386'])},
+            ('quux', 'main'): {'quux': set(['amd64'])},
+        })
+        self.assertEqual(removed, set(['libfoo1', 'libfoo']))
+
+    def test_or_group(self):
+        broken, removed = self.graph.broken_depends(['baz'], ['amd64'])
+        self.assertEqual(broken, {})
+        broken, removed = self.graph.broken_depends(['baz', 'qux'], ['amd64'])
+        self.assertEqual(broken, {('bar', 'main'): {'bar': set(['amd64'])}})
+
+    def test_removed_dependent(self):
+        broken, removed = self.graph.broken_depends(['libfoo1', 'bar', 'quux'], ['amd64'])
+        self.assertEqual(broken, {})
+
+    def test_broken_build_depends(self):
+        self.assertEqual(self.graph.broken_build_depends(['debhelper']), {
+            ('foo', 'main'): set([(('debhelper', '', ''),)]),
+        })
+        self.assertEqual(self.graph.broken_build_depends(['debhelper', 'cdbs', 'foo']), {
+            ('bar', 'main'): set([(('debhelper', '9', '>='), ('cdbs', '', ''))]),
+        })
+
+    def test_save_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'unstable.rdeps')
+            self.assertFalse(self.graph.load(filename))
+            self.graph.save()
+            self.assertFalse(self.graph.dirty)
+
+            graph = ReverseDependencyGraph()
+            self.assertTrue(graph.load(filename))
+            self.assertEqual(graph.broken_depends(['libfoo1'], ['amd64', 'i386']),
+                             self.graph.broken_depends(['libfoo1'], ['amd64', 'i386']))
+
+            graph = ReverseDependencyGraph(suite_id=5)
+            self.assertFalse(graph.load(filename))
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
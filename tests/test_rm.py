@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+from base_test import DakTestCase
+
+import dak.rm
+from dak.rm import RemovalRequest
+
+import unittest
+
+class RemovalRequestTestCase(DakTestCase):
+    def setUp(self):
+        dak.rm.Options = {'Suite': 'unstable', 'No-Action': ''}
+
+    def request(self, **fields):
+        section = {'Package': 'foo bar', 'Reason': 'RoM; obsolete', 'Done': '123456'}
+        for key, value in fields.iteritems():
+            key = key.replace('_', '-')
+            if value is None:
+                del section[key]
+            else:
+                section[key] = value
+        return RemovalRequest(1, section)
+
+    def test_parse(self):
+        request = self.request(Reason='RoM; obsolete\n .\n superseded by baz',
+                               Binary_Only='yes', Carbon_Copy='package')
+        request.check()
+        self.assertEqual(['foo', 'bar'], request.packages)
+        self.assertEqual('RoM; obsolete\n\nsuperseded by baz', request.reason)
+        self.assertEqual('true', request.options['Binary-Only'])
+        self.assertEqual('', request.options['Partial'])
+        self.assertEqual('unstable', request.suite)
+        self.assertEqual('package', request.carbon_copy)
+
+    def test_architecture_implies_partial(self):
+        request = self.request(Architecture='i386', Suite='experimental')
+        request.check()
+        self.assertEqual('true', request.options['Partial'])
+        self.assertEqual('experimental', request.suite)
+
+    def test_invalid(self):
+        for fields in (dict(Package=None),
+                       dict(Reason=None),
+                       dict(Architecture='i386', Source_Only='yes'),
+                       dict(Binary='yes', Source_Only='yes'),
+                       dict(Suite='unstable experimental'),
+                       # nobody would be told about the removal
+                       dict(Done=None),
+                       dict(Done=None, Carbon_Copy='package')):
+            self.assertRaises(SystemExit, self.request(**fields).check)
+
+    def test_cruft(self):
+        self.request(Done=None, Reason='[auto-cruft] NBS').check()
+
+if __name__ == '__main__':
+    unittest.main()
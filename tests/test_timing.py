@@ -0,0 +1,53 @@
+#! /usr/bin/env python
+
+from base_test import DakTestCase
+
+from daklib.timing import PhaseTimer, TimingSummary, percentile
+
+import unittest
+
+class PhaseTimerTestCase(DakTestCase):
+    def test_accumulates(self):
+        timer = PhaseTimer()
+        timer.add('a', 1.0)
+        timer.add('b', 0.5)
+        timer.add('a', 2.0)
+        self.assertEqual(timer.items(), [('a', 3.0), ('b', 0.5)])
+        self.assertEqual(timer.total, 3.5)
+        self.assertEqual(timer.log_fields(), ['a=3.000', 'b=0.500'])
+
+    def test_measure_exception(self):
+        timer = PhaseTimer()
+        try:
+            with timer.measure('failing'):
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(timer.names, ['failing'])
+
+class PercentileTestCase(DakTestCase):
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(percentile(values, 50), 3)
+        self.assertEqual(percentile(values, 100), 5)
+        self.assertEqual(percentile(values, 1), 1)
+        self.assertEqual(percentile([], 50), None)
+
+    def test_summary(self):
+        summary = TimingSummary()
+        for seconds in (1.0, 2.0, 3.0):
+            timer = PhaseTimer()
+            timer.add('check', seconds)
+            summary.add(timer)
+        self.assertEqual(summary.rows(percentiles=(50,)), [('check', 3, 6.0, 2.0, 3.0)])
+
+    def test_summary_window(self):
+        summary = TimingSummary(window=2)
+        for seconds in (1.0, 2.0, 3.0):
+            timer = PhaseTimer()
+            timer.add('check', seconds)
+            summary.add(timer)
+        self.assertEqual(summary.rows(percentiles=(50,)), [('check', 2, 5.0, 2.0, 3.0)])
+
+if __name__ == '__main__':
+    unittest.main()